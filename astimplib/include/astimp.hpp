@@ -31,6 +31,17 @@ enum MEDIUM_TYPE {
     MEDIUM_BLOOD  // blood enriched medium
 };
 
+enum CROP_ENGINE {
+    CROP_GRABCUT,     // GrabCut segmentation, for dishes of any shape
+    CROP_CIRCLE_FIT,  // Hough circle fit of the border, for round dishes only
+    CROP_AUTO  // circle fit, GrabCut if the circle fit is not confident enough
+};
+
+enum KMEANS_ENGINE {
+    KMEANS_OPENCV,    // cv::kmeans on the pixel values
+    KMEANS_HISTOGRAM  // exact clustering on the histogram of the pixel values
+};
+
 class ImprocConfig {
     // configuration parameters for image processing
    private:
@@ -43,6 +54,11 @@ class ImprocConfig {
         float gcBorder{0.03};
         // grubcut iterations
         int gcIters{10};
+        // Algorithm used to find the Petri dish in the picture.
+        CROP_ENGINE cropEngine{CROP_GRABCUT};
+        // Min fraction of the fitted circle lying on an edge of the picture
+        // for the circle fit to be used by the CROP_AUTO engine.
+        float circleFitMinConfidence{0.6};
         // ===
         // Distance from the border of the Petri dish to the closest pellet
         // This value is used to crop the Petri dish image during preprocessing.
@@ -93,17 +109,50 @@ class ImprocConfig {
         // If st to zero, the sensibility will be automatically
         // adjusted based on the iamge contrast.
         float diameterReadingSensibility{0};
-        // Number of attempts for kmeans.
+        // Number of attempts for kmeans (KMEANS_OPENCV engine only).
         int kmeansNumAttempts{10};
+        // Algorithm used to cluster the pixel intensities into inhibition
+        // and bacteria. KMEANS_HISTOGRAM is exact and deterministic but only
+        // supports 2 clusters, KMEANS_OPENCV is used otherwise.
+        KMEANS_ENGINE kmeansEngine{KMEANS_OPENCV};
         // Min pellet intensity.
         // Pixels above this intensity will be masked during preprocessing
         int minPelletIntensity{160};
+        // Measure the diameters of the pellets of a plate in parallel.
+        // Disable it if plates are already processed in parallel.
+        bool parallelMeasurement{true};
+        // Max number of threads used to measure the diameters of a plate.
+        // If set to zero, the OpenCV default is used.
+        int measurementThreads{0};
+        // Run the local k-means of the inhibition ROIs in parallel.
+        bool parallelLocalKmeans{true};
+        // Max number of threads used by the local k-means.
+        // If set to zero, the OpenCV default is used.
+        int localKmeansThreads{0};
+        // Resample the plate image to preprocImg_px_per_mm before the median
+        // blur (with a kernel scaled to match) instead of after it. Much
+        // faster for high resolution pictures.
+        bool downscaleFirst{false};
+    };
+
+    struct LabelsSettings {
+        // Max number of TFLite interpreters kept alive by the label
+        // recognition pool. If set to zero, one interpreter per hardware
+        // thread is allowed.
+        // This value is read when the pool is initialized.
+        int interpreterPoolSize{0};
+        // Number of threads used by each TFLite interpreter.
+        int interpreterNumThreads{2};
+        // Max number of pellets labelled by a single model invocation.
+        // Set to 1 to run the model on one pellet at a time.
+        int maxInferenceBatchSize{16};
     };
 
    public:
     PetriDishSettings PetriDish;
     PelletsSettings Pellets;
     InhibitionSettings Inhibition;
+    LabelsSettings Labels;
 
     ImprocConfig() = default;
 };
@@ -141,6 +190,29 @@ class InhibDisk {
     }
 };
 
+// Intermediate results of inhib_diam_preprocessing, kept to update the
+// preprocessing when the pellets change (update_inhib_diam_preprocessing).
+// It holds images as large as the plate image: it is only returned on
+// request.
+struct InhibPreprocState {
+    // pellets in the plate image, as given to the preprocessing
+    vector<Circle> plateCircles;
+    // normalization of the gray levels of the plate (gray * scale + shift)
+    double grayScale = 0;
+    double grayShift = 0;
+    // ROI of the plate image that is preprocessed
+    cv::Rect bbox;
+    int medianBlurSize = 0;
+    // plate image in bbox, in gray levels, with the pellets painted white and
+    // median blurred
+    cv::Mat blurred;
+    // true if blurred is resampled to the scale of the preprocessed image
+    // (Inhibition.downscaleFirst)
+    bool downscaled = false;
+    // image of the local k-means (pellets and plate borders masked)
+    cv::Mat kmeansImg;
+};
+
 class InhibDiamPreprocResult {
    public:
     // The standardised version of the AST image for inhibition diameter
@@ -188,6 +260,20 @@ class InhibDiamPreprocResult {
     InhibDiamPreprocResult(){};
 };
 
+// Cumulated timings of inhib_diam_preprocessing, in milliseconds.
+struct InhibPreprocTimings {
+    // number of preprocessed plates
+    size_t calls;
+    // total preprocessing time
+    double totalMs;
+    // time spent in the k-means of the whole plate
+    double globalKmeansMs;
+    // time spent in the local k-means of all the inhibition ROIs
+    double localKmeansMs;
+    // number of inhibition ROIs clustered by the local k-means
+    size_t localKmeansROIs;
+};
+
 enum PROFILE_TYPE {
     PROFILE_MEAN,
     PROFILE_MAX,
@@ -195,6 +281,16 @@ enum PROFILE_TYPE {
     PROFILE_MAXAVERAGE
 };
 
+/** Radial profiles of one image, computed in a single pass. */
+struct RadialProfiles {
+    // the profile types, in the requested order
+    vector<PROFILE_TYPE> types;
+    // profiles[i] is the profile of type types[i]
+    vector<vector<float>> profiles;
+    // number of pixels at each radius used to compute the profiles
+    vector<float> counts;
+};
+
 /** Describes the appproach used to measure an inhibition diameter. */
 enum InhibMeasureMode {
     /**
@@ -214,19 +310,90 @@ enum InhibMeasureMode {
 };
 
 /* ---------------------------------- INIT ---------------------------------- */
-/* Returns the current library configuration object. */
+/* Returns the configuration used by the calling thread: the one of the
+ * innermost ScopedConfig alive in the thread, if any, otherwise the process
+ * default configuration. */
 const ImprocConfig *getConfig();
-/* Returns the current library configuration object, writable. */
+/* Returns the process default configuration, writable.
+ * It must not be modified while other threads are processing images. */
 ImprocConfig *getConfigWritable();
 
+/* Overrides the configuration of the calling thread with a copy of config,
+ * until the object is destroyed. ScopedConfig objects can be nested, they must
+ * be destroyed in the thread that created them.
+ * The parallel loops of the library run their tasks with the configuration of
+ * the thread that started them. */
+class ScopedConfig {
+   public:
+    explicit ScopedConfig(const ImprocConfig &config);
+    ~ScopedConfig();
+    ScopedConfig(const ScopedConfig &) = delete;
+    ScopedConfig &operator=(const ScopedConfig &) = delete;
+
+    // The overriding configuration, it can be modified by the thread that
+    // owns the object.
+    ImprocConfig *config() { return &local; }
+
+   private:
+    ImprocConfig local;
+    const ImprocConfig *previous;
+};
+
+/* Images derived from the picture of a plate (a whole AST picture, or a
+ * cropped Petri dish), computed the first time a stage of the analysis needs
+ * them and kept for the next stages: resized copies, gray levels and color
+ * channels.
+ *
+ * The functions taking a PlateContext give the same results as the ones
+ * taking its image. A context holds a reference to the image data, which must
+ * not be modified while the context is used. A context must not be used by
+ * several threads at the same time. */
+class PlateContext {
+   public:
+    PlateContext() {}
+    explicit PlateContext(const cv::Mat &img) : img(img) {}
+
+    const cv::Mat &image() const { return img; }
+
+    // The image resized so that its longest side is at most maxSize pixels
+    // (the image itself if it is smaller). If scale is not null, it is set to
+    // the resize factor.
+    const cv::Mat &resized(int maxSize, double *scale = nullptr);
+    // The image resized to size.
+    const cv::Mat &resized(const cv::Size &size);
+    // Gray levels of the image (BGR).
+    const cv::Mat &gray();
+    // Channel i of the image (the image itself if it has one channel).
+    const cv::Mat &channel(int i);
+
+    // Memory used by the derived images, in bytes (the image is not counted).
+    size_t bytes() const;
+    // Releases the derived images, they are computed again when needed.
+    void release();
+
+   private:
+    cv::Mat img;
+    // maxSize -> resized image and resize factor
+    map<int, pair<cv::Mat, double>> pyramid;
+    // (width, height) -> resized image
+    map<pair<int, int>, cv::Mat> thumbnails;
+    cv::Mat grayImg;
+    vector<cv::Mat> channels;
+};
+
 /* ---------------------------------- PETRI --------------------------------- */
 PetriDish getPetriDish(const cv::Mat &img);
+PetriDish getPetriDish(const cv::Mat &img, const ImprocConfig &config);
+PetriDish getPetriDish(PlateContext &picture);
 PetriDish getPetriDishWithRoi(const cv::Mat &ast_picture, const cv::Rect2i roi);
 void calcDominantColor(const cv::Mat &img, int* hsv);
 bool isGrowthMediumBlood(const cv::Mat &ast_crop);
+bool isGrowthMediumBlood(PlateContext &crop);
 
 /* --------------------------------- PELLETS -------------------------------- */
 vector<Circle> find_atb_pellets(const cv::Mat &img);
+vector<Circle> find_atb_pellets(const cv::Mat &img, const ImprocConfig &config);
+vector<Circle> find_atb_pellets(PlateContext &plate);
 cv::Mat cutOnePelletInImage(const cv::Mat &img, const Circle &circle,
                             bool clone = false);
 vector<cv::Mat> cutPelletsInImage(const cv::Mat &img, vector<Circle> &circles);
@@ -241,14 +408,57 @@ vector<cv::Rect> inhibition_disks_ROIs(const vector<Circle> &circles,
                                        const cv::Mat &img, float max_diam);
 vector<cv::Rect> inhibition_disks_ROIs(const vector<Circle> &circles, int nrows,
                                        int ncols, float max_diam);
-InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
-                                                vector<Circle> &circles);
+// state, if not null, receives the intermediate results needed to update the
+// preprocessing (update_inhib_diam_preprocessing).
+InhibDiamPreprocResult inhib_diam_preprocessing(
+    PetriDish petri, vector<Circle> &circles,
+    InhibPreprocState *state = nullptr);
+InhibDiamPreprocResult inhib_diam_preprocessing(
+    PetriDish petri, vector<Circle> &circles, const ImprocConfig &config,
+    InhibPreprocState *state = nullptr);
 InhibDiamPreprocResult inhib_diam_preprocessing(cv::Mat cropped_plate_img,
                                                 bool isRound,
                                                 vector<Circle> &circles);
-InhibDisk measureOneDiameter(InhibDiamPreprocResult inhib_preproc,
+// plate is the context of a cropped Petri dish image.
+InhibDiamPreprocResult inhib_diam_preprocessing(
+    PlateContext &plate, bool isRound, const vector<Circle> &circles,
+    InhibPreprocState *state = nullptr);
+// Largest relative change of the scale of the plate (mean pellet radius) for
+// which update_inhib_diam_preprocessing keeps the previous preprocessed pixels.
+const float MAX_INHIB_PREPROC_UPDATE_SCALE_CHANGE = 0.01;
+
+/* Updates preproc, the preprocessing of petri, after pellets were added, moved
+ * or removed: circles are all the pellets of the plate.
+ *
+ * Only the image around the changed pellets and the local k-means of the ROIs
+ * that changed are computed again. If the scale of the plate (mean pellet
+ * radius) and the preprocessed ROI do not change, the result is the same as
+ * inhib_diam_preprocessing(petri, circles) with the same configuration.
+ * If the scale changes by less than MAX_INHIB_PREPROC_UPDATE_SCALE_CHANGE and
+ * the pellets stay in the preprocessed ROI, the image keeps its previous
+ * resolution and ROI and only the values of a millimeter are updated.
+ * Otherwise, or if state is empty, the preprocessing is run from scratch.
+ *
+ * state is the state of preproc (see inhib_diam_preprocessing), it is
+ * replaced by the state of the updated preprocessing. */
+InhibDiamPreprocResult update_inhib_diam_preprocessing(
+    const InhibDiamPreprocResult &preproc, InhibPreprocState &state,
+    PetriDish petri, const vector<Circle> &circles);
+InhibDiamPreprocResult update_inhib_diam_preprocessing(
+    const InhibDiamPreprocResult &preproc, InhibPreprocState &state,
+    PetriDish petri, const vector<Circle> &circles,
+    const ImprocConfig &config);
+InhibDiamPreprocResult update_inhib_diam_preprocessing(
+    const InhibDiamPreprocResult &preproc, InhibPreprocState &state,
+    PlateContext &plate, bool isRound, const vector<Circle> &circles);
+InhibPreprocTimings getInhibPreprocTimings();
+void resetInhibPreprocTimings();
+InhibDisk measureOneDiameter(const InhibDiamPreprocResult &inhib_preproc,
                              int pellet_idx, InhibMeasureMode mode);
-vector<InhibDisk> measureDiameters(InhibDiamPreprocResult inhib_preproc);
+vector<InhibDisk> measureDiameters(
+    const InhibDiamPreprocResult &inhib_preproc);
+vector<InhibDisk> measureDiameters(const InhibDiamPreprocResult &inhib_preproc,
+                                   const ImprocConfig &config);
 
 /// DEBUG ===============
 vector<float> radial_profile(const cv::Mat &img, PROFILE_TYPE type,
@@ -256,11 +466,18 @@ vector<float> radial_profile(const cv::Mat &img, PROFILE_TYPE type,
 vector<float> radial_profile(const InhibDiamPreprocResult &preproc,
                              unsigned int num, PROFILE_TYPE type,
                              float th_value = 0);
+RadialProfiles radial_profiles(const cv::Mat &img,
+                               const vector<PROFILE_TYPE> &types,
+                               int px_per_mm, float th_value = 0);
+RadialProfiles radial_profiles(const InhibDiamPreprocResult &preproc,
+                               unsigned int num,
+                               const vector<PROFILE_TYPE> &types,
+                               float th_value = 0);
 
 inline void throw_custom_exception(const string &s) {
     throw astimp::Exception::generic(s);
 }
-float calcDiameterReadingSensibility(InhibDiamPreprocResult preproc,
+float calcDiameterReadingSensibility(const InhibDiamPreprocResult &preproc,
                                      int pellet_idx);
 }  // namespace astimp
 
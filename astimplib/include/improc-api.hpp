@@ -41,10 +41,82 @@ struct PelletsAndPxPerMm {
     float original_img_px_per_mm;
 };
 
+// Reading of a whole plate picture.
+struct PlateReading {
+    // Petri dish in the picture
+    cv::Rect boundingBox;
+    bool isRound;
+    // pellets, in the coordinates of the cropped Petri dish
+    vector<Pellet> pellets;
+    float original_img_px_per_mm;
+    // true if the geometry and labels of a previous reading were reused
+    // (rereadPlate), false if the plate was analysed from scratch
+    bool registered;
+};
+
+// Re-reading of a plate (rereadPlate): the pellets of the previous reading
+// are searched around its bounding box, enlarged on each side by this
+// fraction of its size,
+const float REREAD_SEARCH_MARGIN = 0.1;
+// with a registration on images of at most this size (longest side, px).
+const int REREAD_REGISTRATION_SIZE = 512;
+// A pellet is found if it is at most at this distance (mm) from its
+// expected position, the registration fails if less than this fraction of
+// the pellets are found.
+const float REREAD_MAX_PELLET_OFFSET_MM = 1.0;
+const float REREAD_MIN_FOUND_PELLETS = 0.75;
+
+// Counters of the cache of the images read by path.
+struct ImgCacheStats {
+    // images found in the cache, up to date
+    size_t hits;
+    // images read from their file (not cached, or modified since)
+    size_t misses;
+    // images removed from the cache to stay within the budget
+    size_t evictions;
+    // images in the cache and their total size in bytes
+    size_t entries;
+    size_t bytes;
+    // budget of the cache in bytes
+    size_t maxBytes;
+};
+
+// Default budget of the image cache: a few full resolution pictures.
+const size_t DEFAULT_IMG_CACHE_MAX_BYTES = 256 * 1024 * 1024;
+
+// Sets the budget of the image cache in bytes, the least recently used images
+// are evicted to fit in it. Images larger than the budget are not cached,
+// zero disables the cache.
+void setImgCacheMaxBytes(size_t maxBytes);
+ImgCacheStats getImgCacheStats();
+// Resets hits, misses and evictions.
+void resetImgCacheStats();
+// Removes the image of a path from the cache.
+void invalidateImgCache(const string &path);
+// Removes all the images from the cache.
+void invalidateImgCache();
+
+// The functions below take the image either as:
+// - the path of an image file (the decoded images are cached, see
+//   setImgCacheMaxBytes; a modified file is read again),
+// - the content of an image file (jpeg, png...), decoded in memory,
+// - a decoded BGR image.
+
+// Reads an image file into a BGR image, through the image cache.
+// Throws an exception if that fails.
+cv::Mat readImage(const string &path);
+
+// Decodes the content of an image file into a BGR image.
+// Throws an exception if that fails.
+cv::Mat decodeImage(const vector<uchar> &encodedImg);
+
 //! DEPRECATED: use findPetriDishWithRoi instead
 cv::Rect findPetriDish(const string &astPicturePath);
 
 PetriDish findPetriDishWithRoi(const string &astPicturePath, cv::Rect2i roi);
+PetriDish findPetriDishWithRoi(const vector<uchar> &encodedAstPicture,
+                               cv::Rect2i roi);
+PetriDish findPetriDishWithRoi(const cv::Mat &astPicture, cv::Rect2i roi);
 
 // Note: findPellet, findPelletFromApproxCoordinates, and findPellets
 // always use InhibMeasureMode=INSCRIBED.
@@ -52,22 +124,123 @@ PetriDish findPetriDishWithRoi(const string &astPicturePath, cv::Rect2i roi);
 // INSCRIBED or CIRCUMSCRIBED.
 Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
                   const string &croppedPetriImgPath, bool isRound = false);
+Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
+                  const vector<uchar> &encodedCroppedPetriImg,
+                  bool isRound = false);
+Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
+                  const cv::Mat &croppedPetriImg, bool isRound = false);
 
 Pellet findPelletFromApproxCoordinates(const float centerX, const float centerY,
                                        const vector<Circle> &otherCircles,
                                        const string &croppedPetriImgPath,
                                        float mm_per_px);
+Pellet findPelletFromApproxCoordinates(
+    const float centerX, const float centerY,
+    const vector<Circle> &otherCircles,
+    const vector<uchar> &encodedCroppedPetriImg, float mm_per_px);
+Pellet findPelletFromApproxCoordinates(const float centerX, const float centerY,
+                                       const vector<Circle> &otherCircles,
+                                       const cv::Mat &croppedPetriImg,
+                                       float mm_per_px);
 
 PelletsAndPxPerMm findPellets(const string &croppedPetriImgPath,
                               bool isRound = false);
+PelletsAndPxPerMm findPellets(const vector<uchar> &encodedCroppedPetriImg,
+                              bool isRound = false);
+PelletsAndPxPerMm findPellets(const cv::Mat &croppedPetriImg,
+                              bool isRound = false);
 
 // Measures the diameter of the pellet at index pelletIdx in allCircles.
 // Do not use this method in a loop to measure all diameters, because
-// it runs preprocessing on each call (slow).
+// it runs preprocessing on each call (slow): use a PlateSession instead.
 InhibDisk measureOnePelletDiameter(const string &croppedPetriImgPath,
                                    const vector<Circle> &allCircles,
                                    int pelletIdx, InhibMeasureMode mode,
                                    bool isRound = false);
+InhibDisk measureOnePelletDiameter(const vector<uchar> &encodedCroppedPetriImg,
+                                   const vector<Circle> &allCircles,
+                                   int pelletIdx, InhibMeasureMode mode,
+                                   bool isRound = false);
+InhibDisk measureOnePelletDiameter(const cv::Mat &croppedPetriImg,
+                                   const vector<Circle> &allCircles,
+                                   int pelletIdx, InhibMeasureMode mode,
+                                   bool isRound = false);
+
+// Reads a whole plate picture: crop of the Petri dish, pellets, labels and
+// inhibition diameters.
+PlateReading readPlate(const string &astPicturePath);
+PlateReading readPlate(const vector<uchar> &encodedAstPicture);
+PlateReading readPlate(const cv::Mat &astPicture);
+
+// Reads a plate again, in a new picture taken later (e.g. after a longer
+// incubation). The new picture is registered against the pellets of the
+// previous reading (translation only), which are reused with their labels:
+// only the inhibition diameters are measured. If the registration fails
+// (plate rotated or moved too far, pellets not found), the plate is read from
+// scratch, see PlateReading::registered.
+PlateReading rereadPlate(const string &astPicturePath,
+                         const PlateReading &previous);
+PlateReading rereadPlate(const vector<uchar> &encodedAstPicture,
+                         const PlateReading &previous);
+PlateReading rereadPlate(const cv::Mat &astPicture,
+                         const PlateReading &previous);
+
+/* Image, pellets and preprocessing of one cropped Petri dish, to edit its
+ * pellets one at a time.
+ *
+ * The preprocessing of the inhibition zones depends on all the pellets: it
+ * is run on first use and kept until the pellets change. Measuring several
+ * pellets, or one pellet in both modes, costs one preprocessing. When the
+ * pellets change, the preprocessing is updated around the changed pellets
+ * only (see update_inhib_diam_preprocessing). */
+class PlateSession {
+   public:
+    // circles are the pellets already found in the image.
+    PlateSession(const string &croppedPetriImgPath,
+                 const vector<Circle> &circles, bool isRound = false);
+    PlateSession(const vector<uchar> &encodedCroppedPetriImg,
+                 const vector<Circle> &circles, bool isRound = false);
+    PlateSession(const cv::Mat &croppedPetriImg, const vector<Circle> &circles,
+                 bool isRound = false);
+
+    const cv::Mat &image() const { return plate.image(); }
+    const vector<Circle> &circles() const { return pellets; }
+    bool isRound() const { return round; }
+
+    // Replaces the pellets, the preprocessing is updated on next use.
+    void setCircles(const vector<Circle> &circles);
+
+    // Preprocessing of the image for the current pellets.
+    const InhibDiamPreprocResult &preprocessing();
+
+    // Adds a pellet manually found at circle and returns its label and
+    // diameter (INSCRIBED). The pellet is the last one of circles().
+    Pellet findPellet(const Circle &circle);
+    // Same as findPellet, the pellet is searched around the approximate
+    // coordinates of its center.
+    Pellet findPelletFromApproxCoordinates(float centerX, float centerY,
+                                           float mm_per_px);
+
+    // Measures the diameter of the pellet at index pelletIdx in circles().
+    InhibDisk measureOnePelletDiameter(int pelletIdx, InhibMeasureMode mode);
+
+    // Memory used by the images derived from the image (gray levels...) and
+    // kept for the next preprocessings, in bytes.
+    size_t cachedBytes() const { return plate.bytes(); }
+    // Releases the derived images, they are computed again when needed.
+    void releaseCache() { plate.release(); }
+
+   private:
+    PlateContext plate;
+    vector<Circle> pellets;
+    bool round;
+    // false until preproc is computed, it is then updated when the pellets
+    // differ from the ones it was computed for
+    bool hasPreproc;
+    InhibDiamPreprocResult preproc;
+    // intermediate results of preproc, to update it
+    InhibPreprocState preprocState;
+};
 
 float getPelletDiamInMm();
 
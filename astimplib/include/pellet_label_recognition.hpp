@@ -27,6 +27,9 @@ using namespace std;
 
 namespace astimp {
 
+// Side in pixels of the (square) pellet images given as input to the model.
+const size_t PELLET_IMG_SIZE = 64;
+
 // A template image of a pellet label text.
 struct Label_template {
     string text;
@@ -72,16 +75,49 @@ Label_match getOnePelletText(const cv::Mat &pelletImg);
 // Returns the texts on the pellet images.
 vector<Label_match> getPelletsText(const vector<cv::Mat> &pelletImages);
 
+// Counters of the TFLite interpreter pool used for label recognition.
+struct InterpreterPoolStats {
+    // interpreters created since the pool was (re)initialized
+    size_t created;
+    // acquisitions served by an idle interpreter of the pool
+    size_t hits;
+    // acquisitions that had to wait for an interpreter to be released
+    size_t waits;
+    // model invocations on more than one pellet
+    size_t batchedInvokes;
+    // batches refused by the model, the pellets are then labeled one at a
+    // time
+    size_t batchFallbacks;
+};
+
 class PelletLabelRecognitionUsingML {
    public:
     // Returns the TFLite model inputs, one vector per each pellet image.
     static vector<vector<float> > getPelletModelInputs(
         const vector<cv::Mat> &pelletImages);
 
+    // Writes the TFLite model inputs of the pellet images in [begin, end)
+    // one after the other in inputs, which must have room for them.
+    static void fillPelletModelInputs(const vector<cv::Mat> &pelletImages,
+                                      size_t begin, size_t end,
+                                      float *inputs);
+
     static Label_match getOnePelletText(const cv::Mat &pelletImg);
 
     static vector<Label_match> getPelletsText(
         const vector<cv::Mat> &pelletImages);
+
+    // Loads the model and prepares the interpreter pool.
+    // Calling this is optional, the pool is otherwise created on first use.
+    // poolSize is the max number of interpreters, if zero the value of
+    // ImprocConfig::Labels.interpreterPoolSize is used.
+    static void initInterpreterPool(size_t poolSize = 0);
+
+    // Waits for the interpreters in use to be released and frees the model
+    // and all the interpreters. The pool can be used again afterwards.
+    static void shutdownInterpreterPool();
+
+    static InterpreterPoolStats getInterpreterPoolStats();
 };
 
 }  // namespace astimp
@@ -0,0 +1,99 @@
+// Copyright 2019 Copyright 2019 The ASTapp Consortium
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    <http://www.apache.org/licenses/LICENSE-2.0>
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+
+#ifndef ASTAPP_PETRI_DISH_RIG_HPP
+#define ASTAPP_PETRI_DISH_RIG_HPP
+
+#include <mutex>
+
+#include "astimp.hpp"
+
+using namespace std;
+
+namespace astimp {
+
+// The border of the Petri dish is found at its calibrated place if its edge
+// score is at least this fraction of the score in the calibration picture,
+const float RIG_MIN_SCORE_RATIO = 0.7;
+// and if it is not better aligned with the edges of the picture when moved by
+// more than RIG_MAX_SHIFT pixels (up to RIG_SHIFT_SEARCH pixels, at the
+// resolution of the GrabCut of getPetriDish).
+const int RIG_MAX_SHIFT = 1;
+const int RIG_SHIFT_SEARCH = 3;
+
+// Counters of a PetriDishRig.
+struct RigStats {
+    // pictures whose Petri dish was found at its calibrated place
+    size_t fastPath;
+    // pictures cropped with getPetriDish (check failed, or not calibrated)
+    size_t grabCut;
+    // calibrations replaced after a failed check
+    size_t recalibrations;
+};
+
+/* Crop of the Petri dish in pictures taken on a fixed stand, where the dish is
+ * always at about the same place.
+ *
+ * The rig is calibrated with the Petri dish found by getPetriDish (GrabCut) in
+ * a picture. In the next pictures the border of the dish (the ellipse
+ * inscribed in its bounding box if it is round, the bounding box otherwise) is
+ * checked with an edge score: the mean gradient along the border relative to
+ * the mean gradient of the picture. If the check passes the calibrated
+ * bounding box is used, otherwise the dish is cropped with getPetriDish and
+ * the rig is calibrated again with it.
+ *
+ * A rig can be shared by several threads. */
+class PetriDishRig {
+   public:
+    // The first picture calibrates the rig.
+    PetriDishRig() {}
+    // Calibrated with a picture of the rig.
+    explicit PetriDishRig(const cv::Mat &astPicture);
+
+    PetriDishRig(const PetriDishRig &) = delete;
+    PetriDishRig &operator=(const PetriDishRig &) = delete;
+
+    // Calibrates the rig with the Petri dish of a picture, found by
+    // getPetriDish, and returns it.
+    PetriDish calibrate(const cv::Mat &astPicture);
+    bool isCalibrated();
+    // Calibrated bounding box of the Petri dish (empty if not calibrated).
+    cv::Rect boundingBox();
+
+    // Crops the Petri dish in a picture of the rig.
+    PetriDish getPetriDish(const cv::Mat &astPicture);
+
+    RigStats stats();
+    void resetStats();
+
+   private:
+    struct Calibration {
+        bool done;
+        cv::Size pictureSize;
+        cv::Rect boundingBox;
+        bool isRound;
+        float score;
+    };
+
+    void setCalibration(const cv::Mat &astPicture, const PetriDish &petri);
+
+    mutex mtx;
+    Calibration calibration{false, cv::Size(), cv::Rect(), false, 0};
+    RigStats counters{0, 0, 0};
+};
+
+}  // namespace astimp
+
+#endif  // ASTAPP_PETRI_DISH_RIG_HPP
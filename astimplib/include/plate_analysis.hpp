@@ -0,0 +1,141 @@
+// Copyright 2019 Copyright 2019 The ASTapp Consortium
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    <http://www.apache.org/licenses/LICENSE-2.0>
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef ASTAPP_PLATE_ANALYSIS_HPP
+#define ASTAPP_PLATE_ANALYSIS_HPP
+
+#include <condition_variable>
+#include <deque>
+#include <future>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+
+#include "astimp.hpp"
+#include "pellet_label_recognition.hpp"
+
+using namespace std;
+
+namespace astimp {
+
+// Result of the analysis of one plate by a PlateAnalysisPool.
+struct PlateAnalysis {
+    // index of the plate, in the order of submission
+    size_t index;
+    // false if the analysis failed, error then holds the reason
+    bool ok;
+    string error;
+    // cropped Petri dish
+    PetriDish petri;
+    // pellets found in petri.img
+    vector<Circle> circles;
+    // labels and inhibition zones of the pellets, in the order of circles
+    vector<Label_match> labels;
+    vector<InhibDisk> disks;
+    // value of 1 millimeter in pixels in the image of the plate (zero if no
+    // pellet was found)
+    float pxPerMm;
+    // preprocessing used to measure the inhibition zones (empty if no pellet
+    // was found, or if the pool does not keep the images)
+    InhibDiamPreprocResult preproc;
+};
+
+/* Analyzes plates in a pool of threads: crop of the Petri dish, pellets, labels
+ * and inhibition diameters.
+ *
+ * The label recognition of all the workers is done by one more thread, that
+ * batches together the pellets of the plates waiting for their labels.
+ *
+ * Plates are submitted with submit, submitPath or submitBytes, and the results
+ * are retrieved with next, in the order the plates are finished. The errors of
+ * a plate are reported in its result, they do not stop the pool. */
+class PlateAnalysisPool {
+   public:
+    // workers is the number of threads analysing the plates (one per hardware
+    // thread if zero). The plates are analysed with a copy of config.
+    // If keepImages is false, the results hold no image (petri.img and
+    // preproc are left empty), so that their memory is released as soon as
+    // a plate is finished.
+    explicit PlateAnalysisPool(int workers = 0, bool keepImages = true);
+    PlateAnalysisPool(int workers, const ImprocConfig &config,
+                      bool keepImages = true);
+    // Waits for the plates being analysed and joins the threads. Plates not
+    // yet started are dropped.
+    ~PlateAnalysisPool();
+
+    PlateAnalysisPool(const PlateAnalysisPool &) = delete;
+    PlateAnalysisPool &operator=(const PlateAnalysisPool &) = delete;
+
+    // Queues the image of a plate (BGR). The pool holds a reference to the
+    // image data: it must not be modified until the plate result is returned.
+    // Returns the index of the plate.
+    size_t submit(const cv::Mat &img);
+    // Queues the image file of a plate, it is read by the worker.
+    size_t submitPath(const string &path);
+    // Queues an encoded image file (jpeg, png...) of a plate, the data is
+    // copied and decoded by the worker.
+    size_t submitBytes(const uchar *data, size_t size);
+
+    // Waits for a plate to be finished and moves its result in result.
+    // Returns false, without waiting, if all the submitted plates were
+    // already returned.
+    bool next(PlateAnalysis &result);
+
+    // Number of plates submitted and not yet returned by next.
+    size_t inFlight();
+
+    size_t numWorkers() const { return workers.size(); }
+
+   private:
+    struct Job {
+        size_t index;
+        cv::Mat img;
+        string path;
+        vector<uchar> encoded;
+    };
+    struct LabelRequest {
+        vector<cv::Mat> pellets;
+        promise<vector<Label_match>> labels;
+    };
+
+    void start(int numWorkers);
+    size_t push(Job job);
+    void workerLoop();
+    void labelLoop();
+    PlateAnalysis analyze(const Job &job);
+    future<vector<Label_match>> requestLabels(vector<cv::Mat> pellets);
+
+    const ImprocConfig config;
+    const bool keepImages;
+
+    mutex mtx;
+    condition_variable jobAvailable;
+    condition_variable resultAvailable;
+    condition_variable labelRequestAvailable;
+    deque<Job> jobs;
+    deque<PlateAnalysis> results;
+    deque<LabelRequest> labelRequests;
+    size_t submitted{0};
+    size_t returned{0};
+    bool stopWorkers{false};
+    bool stopLabels{false};
+
+    vector<thread> workers;
+    thread labeller;
+};
+
+}  // namespace astimp
+
+#endif  // ASTAPP_PLATE_ANALYSIS_HPP
@@ -17,6 +17,8 @@
 #ifndef ASTAPP_UTILS_HPP
 #define ASTAPP_UTILS_HPP
 
+#include <functional>
+#include <memory>
 #include <vector>
 
 #include "astimp.hpp"
@@ -34,10 +36,75 @@ cv::Rect getBoundingRectFromCircle(cv::Point2f center, float radius);
  *center rounded as integers The matrix has size (s,s)*/
 vector<vector<uint>> r_matrix(int s);
 
+/*@Brief The pixels of a square image of side s grouped by their radial
+ *distance from the center, as given by r_matrix(s). Pixels farther than s/2
+ *from the center are left out. */
+struct RadialIndex {
+    int size;
+    // Pixel coordinates (x: column, y: row) sorted by radius. Pixels at the
+    // same radius are in row-major order.
+    vector<cv::Point> pixels;
+    // The pixels at radius r are pixels[radiusBegin[r], radiusBegin[r + 1])
+    vector<uint> radiusBegin;
+};
+
+/*@Brief Return the radial index of a square image of side s.
+ *The indexes are cached and shared, only the most recently used ones are
+ *kept. This function is thread safe. */
+shared_ptr<const RadialIndex> getRadialIndex(int s);
+
 vector<float> first_neighbour_distance(const vector<astimp::Circle> &circles);
 
 vector<int> masked_k_means(cv::Mat img, int k);
 
+/*@Brief Optimal 2-means clustering of integer values given their histogram
+ *(hist[v] is the number of occurrences of v).
+ *Returns the two centers (rounded means of the clusters) in ascending order.
+ *The split minimizes the sum of the squared distances to the centers; among
+ *equivalent splits the lowest one is chosen. If all the values are equal,
+ *both centers are equal to that value. */
+vector<int> histogram_2_means(const vector<uint> &hist);
+
+/*@Brief Fit a step function to the profile [first, last): the profile is
+ *approximated by lv before the step and by hv from the step on.
+ *Returns the position of the step (relative to first) giving the lowest mean
+ *square error, 0 meaning that the whole profile is fitted by hv. If mse is
+ *not null, it receives the mean square error of the fit.
+ *Each squared error is truncated to an integer before being summed.
+ *The sums are exact. The previous search summed through a float and lost the
+ *low bits of sums above 2^24 (more than 258 samples at 255^2): both give the
+ *same results below that, which covers the profiles measured with the
+ *default Inhibition.preprocImg_px_per_mm (at most 191 samples are fitted when
+ *the pictures are not upsampled). */
+size_t fitStepFunction(vector<float>::const_iterator first,
+                       vector<float>::const_iterator last, float lv, float hv,
+                       double *mse = nullptr);
+
+/*@Brief Call f(i) for every i in [0, n), in parallel with cv::parallel_for_.
+ *At most maxThreads calls run at the same time (no limit if zero).
+ *If some calls throw, the exception of the smallest index is rethrown once all
+ *the calls are done, as a serial loop would.
+ *The calls see the configuration of the calling thread (see ScopedConfig). */
+void parallel_for_each_index(size_t n, int maxThreads,
+                             const function<void(size_t)> &f);
+
+/*@Brief Set the state of the OpenCV RNG of the calling thread (cv::theRNG())
+ *for the lifetime of the object. The previous state is restored on
+ *destruction. */
+class ScopedRNGState {
+   public:
+    explicit ScopedRNGState(uint64_t state) : previous(cv::theRNG().state) {
+        cv::theRNG().state = state;
+    }
+    ~ScopedRNGState() { cv::theRNG().state = previous; }
+
+    ScopedRNGState(const ScopedRNGState &) = delete;
+    ScopedRNGState &operator=(const ScopedRNGState &) = delete;
+
+   private:
+    uint64_t previous;
+};
+
 // Return the smallest element of a non empty vector.
 template <typename T>
 T vector_min(const vector<T> &v) {
@@ -16,8 +16,12 @@
 
 #include "astimp.hpp"
 
+#include <algorithm>
+#include <cfloat>
+#include <chrono>
 #include <cmath>
 #include <limits>
+#include <mutex>
 // #include <algorithm>    // std::minmax
 // #include <array>        // std::array
 // #include <functional>   // std::minus
@@ -56,9 +60,19 @@ struct GrabCutResult {
         : contour(contour), boundingbox(boundingbox){};
 };
 
+struct CircleFitResult {
+    // store the circle fit results
+    cv::Rect boundingbox;
+    // fraction of the fitted circle lying on an edge of the picture, in [0,1]
+    float confidence;
+    CircleFitResult(cv::Rect boundingbox, float confidence)
+        : boundingbox(boundingbox), confidence(confidence){};
+};
+
 ResizedImage resizeLongestDimension(cv::Mat img, uint maxSize);
-GrabCutResult petri_bb_grabcut(cv::Mat ast_picture, bool useRoi = false,
+GrabCutResult petri_bb_grabcut(PlateContext &picture, bool useRoi = false,
                                cv::Rect2i roi = cv::Rect2i{0, 0, 0, 0});
+CircleFitResult petri_bb_circle_fit(PlateContext &picture);
 typedef cv::Point3_<uint8_t> Pixel;
 
 // TODO ----------------- REMOVE THIS BLOCK ----------------------- */
@@ -79,9 +93,21 @@ typedef cv::Point3_<uint8_t> Pixel;
 
 ImprocConfig improcConfig;
 
-const ImprocConfig *getConfig() { return &improcConfig; }
+// configuration of the innermost ScopedConfig of the thread, if any
+static thread_local const ImprocConfig *threadConfig = nullptr;
+
+const ImprocConfig *getConfig() {
+    return threadConfig != nullptr ? threadConfig : &improcConfig;
+}
 
 ImprocConfig *getConfigWritable() { return &improcConfig; }
+
+ScopedConfig::ScopedConfig(const ImprocConfig &config)
+    : local(config), previous(threadConfig) {
+    threadConfig = &local;
+}
+
+ScopedConfig::~ScopedConfig() { threadConfig = previous; }
 // class DebugOutput {
 // public:
 //     DebugOutput() {};
@@ -103,6 +129,53 @@ ResizedImage resizeLongestDimension(cv::Mat img, uint maxSize) {
     }
 }
 
+const cv::Mat &PlateContext::resized(int maxSize, double *scale) {
+    auto it = pyramid.find(maxSize);
+    if (it == pyramid.end()) {
+        ResizedImage rimg = resizeLongestDimension(img, maxSize);
+        it = pyramid.emplace(maxSize, make_pair(rimg.img, rimg.scale)).first;
+    }
+    if (scale != nullptr) *scale = it->second.second;
+    return it->second.first;
+}
+
+const cv::Mat &PlateContext::resized(const cv::Size &size) {
+    cv::Mat &thumbnail = thumbnails[make_pair(size.width, size.height)];
+    if (thumbnail.empty()) cv::resize(img, thumbnail, size, 0, 0);
+    return thumbnail;
+}
+
+const cv::Mat &PlateContext::gray() {
+    if (grayImg.empty()) cv::cvtColor(img, grayImg, cv::COLOR_BGR2GRAY);
+    return grayImg;
+}
+
+const cv::Mat &PlateContext::channel(int i) {
+    if (img.channels() == 1) return img;
+    if (channels.empty()) channels.resize(img.channels());
+    if (channels[i].empty()) cv::extractChannel(img, channels[i], i);
+    return channels[i];
+}
+
+size_t PlateContext::bytes() const {
+    // resized copies may be the image itself
+    auto owned = [this](const cv::Mat &m) {
+        return m.data == img.data ? 0 : m.total() * m.elemSize();
+    };
+    size_t total = owned(grayImg);
+    for (const auto &level : pyramid) total += owned(level.second.first);
+    for (const auto &thumbnail : thumbnails) total += owned(thumbnail.second);
+    for (const cv::Mat &c : channels) total += owned(c);
+    return total;
+}
+
+void PlateContext::release() {
+    pyramid.clear();
+    thumbnails.clear();
+    grayImg.release();
+    channels.clear();
+}
+
 vector<cv::Point> getGrabCutContour(cv::Mat mask) {
     typedef uint8_t Pixel;
 
@@ -139,16 +212,29 @@ vector<cv::Point> getGrabCutContour(cv::Mat mask) {
     return contours[index];
 }
 
+// Seed of the RNG used by the grabCut of petri_bb_grabcut.
+const uint64_t GRABCUT_RNG_SEED = 4294967295;
+
+// Parameters of the circle fit of petri_bb_circle_fit: Canny and accumulator
+// thresholds of the Hough transform, and radius range of the Petri dish
+// (fraction of the shortest side of the picture).
+const double PETRI_CIRCLE_CANNY_THRESHOLD = 60;
+const double PETRI_CIRCLE_ACCUMULATOR_THRESHOLD = 20;
+const double PETRI_CIRCLE_MIN_RADIUS = 0.25;
+const double PETRI_CIRCLE_MAX_RADIUS = 0.55;
+// A point of the circle is on an edge if the gradient magnitude is at least
+// this ratio of the mean magnitude of the picture.
+const float PETRI_CIRCLE_EDGE_RATIO = 2;
+
 // TODO use const reference in arguments
-GrabCutResult petri_bb_grabcut(cv::Mat ast_picture, bool useRoi,
+GrabCutResult petri_bb_grabcut(PlateContext &picture, bool useRoi,
                                cv::Rect2i roi) {
     cv::Rect2f rect;
 
-    ResizedImage rimg =
-        resizeLongestDimension(ast_picture, getConfig()->PetriDish.MaxSize);
-    cv::Mat img = rimg.img;
+    double scale;
+    const cv::Mat &img =
+        picture.resized(getConfig()->PetriDish.MaxSize, &scale);
     cv::Rect boundingBox;
-    double scale = rimg.scale;
 
     if (useRoi) {
         // the boundingbox is specified by the user
@@ -205,15 +291,18 @@ GrabCutResult petri_bb_grabcut(cv::Mat ast_picture, bool useRoi,
     // cv::rectangle(dbg, rect, color, 1);
     // cv::imshow("display",dbg); cv::waitKey(0);
 
-    // Initialize the opencv random function's seed
-    // for consistency of cropping result
     cv::Mat mask, bgModel, fgModel;
 
-    cv::theRNG().state = 4294967295;
+    {
+        // grabCut draws from the RNG of the calling thread: seed it for this
+        // call only, for consistency of cropping result. The RNG state of the
+        // thread is restored afterwards.
+        ScopedRNGState rngState(GRABCUT_RNG_SEED);
 
-    // EXECUTE GRUBCUT (init with rect)
-    grabCut(img, mask, rect, bgModel, fgModel, getConfig()->PetriDish.gcIters,
-            cv::GC_INIT_WITH_RECT);
+        // EXECUTE GRUBCUT (init with rect)
+        grabCut(img, mask, rect, bgModel, fgModel,
+                getConfig()->PetriDish.gcIters, cv::GC_INIT_WITH_RECT);
+    }
 
     vector<cv::Point> contour = getGrabCutContour(mask);
 
@@ -241,20 +330,125 @@ GrabCutResult petri_bb_grabcut(cv::Mat ast_picture, bool useRoi,
     return GrabCutResult(contour, boundingBox);
 }
 
+CircleFitResult petri_bb_circle_fit(PlateContext &picture) {
+    /* @brief fit a circle on the border of a round Petri dish.
+     * The circle is found by a Hough transform of the resized picture, its
+     * confidence is the fraction of the points of the circle lying on a strong
+     * edge of the picture (gradient magnitude above PETRI_CIRCLE_EDGE_RATIO
+     * times the mean magnitude, within one pixel of the circle). */
+
+    double scale;
+    cv::Mat gray;
+    cv::cvtColor(picture.resized(getConfig()->PetriDish.MaxSize, &scale), gray,
+                 cv::COLOR_BGR2GRAY);
+    cv::GaussianBlur(gray, gray, cv::Size(5, 5), 0);
+
+    const int minSide = min(gray.cols, gray.rows);
+    vector<cv::Vec3f> circles;
+    cv::HoughCircles(gray, circles, cv::HOUGH_GRADIENT, 1, minSide,
+                     PETRI_CIRCLE_CANNY_THRESHOLD,
+                     PETRI_CIRCLE_ACCUMULATOR_THRESHOLD,
+                     (int)(PETRI_CIRCLE_MIN_RADIUS * minSide),
+                     (int)(PETRI_CIRCLE_MAX_RADIUS * minSide));
+    if (circles.empty()) {
+        throw astimp::Exception::generic("No Petri dish circle found",
+                                         __FILE__, __LINE__);
+    }
+    // the circles are sorted by number of votes
+    const cv::Point2f center(circles[0][0], circles[0][1]);
+    const float radius = circles[0][2];
+
+    cv::Mat dx, dy, magnitude;
+    cv::Sobel(gray, dx, CV_32F, 1, 0);
+    cv::Sobel(gray, dy, CV_32F, 0, 1);
+    cv::magnitude(dx, dy, magnitude);
+    const float minEdge = PETRI_CIRCLE_EDGE_RATIO * cv::mean(magnitude)[0];
+
+    const int n = max(16, (int)(2 * CV_PI * radius));
+    int onEdge = 0;
+    for (int i = 0; i < n; i++) {
+        const double t = 2 * CV_PI * i / n;
+        bool found = false;
+        for (float r = radius - 1; r <= radius + 1 && !found; r++) {
+            const int x = (int)round(center.x + r * cos(t));
+            const int y = (int)round(center.y + r * sin(t));
+            if (x < 0 || y < 0 || x >= magnitude.cols || y >= magnitude.rows) {
+                continue;
+            }
+            found = magnitude.at<float>(y, x) >= minEdge;
+        }
+        if (found) onEdge++;
+    }
+
+    // bounding box of the circle in the original image, clipped to it
+    cv::Rect boundingBox(
+        (int)round((center.x - radius) / scale),
+        (int)round((center.y - radius) / scale), (int)round(2 * radius / scale),
+        (int)round(2 * radius / scale));
+    boundingBox &=
+        cv::Rect(0, 0, picture.image().cols, picture.image().rows);
+    if (boundingBox.area() == 0) {
+        throw astimp::Exception::generic("No Petri dish circle found",
+                                         __FILE__, __LINE__);
+    }
+
+    return CircleFitResult(boundingBox, (float)onEdge / n);
+}
+
 cv::Mat cropPetriDish(const cv::Mat &ast_picture, cv::Rect boundingBox) {
     return ast_picture(boundingBox).clone();
 }
 
+static PetriDish getPetriDishGrabCut(PlateContext &picture) {
+    GrabCutResult gcres = petri_bb_grabcut(picture);
+
+    return PetriDish(cropPetriDish(picture.image(), gcres.boundingbox),
+                     gcres.boundingbox, is_circle(gcres.contour, 1.1));
+}
+
 PetriDish getPetriDish(const cv::Mat &ast_picture) {
+    PlateContext picture(ast_picture);
+    return getPetriDish(picture);
+}
+
+PetriDish getPetriDish(PlateContext &picture) {
     /* @Brief get the Petri dish in the image.
      * The Petri dish is assumed to be the largest (possibly only) object in the
      * picture against a uniform background. The Petri dish is considered to be
-     * entirely in the picture and not touching the image borders. */
+     * entirely in the picture and not touching the image borders.
+     *
+     * The Petri dish is found with the engine of the PetriDish.cropEngine
+     * setting: GrabCut (any shape), a circle fit (round dishes only), or a
+     * circle fit with a fallback to GrabCut if its confidence is lower than
+     * PetriDish.circleFitMinConfidence. */
+
+    const CROP_ENGINE engine = getConfig()->PetriDish.cropEngine;
+    if (engine == CROP_GRABCUT) return getPetriDishGrabCut(picture);
+
+    if (engine == CROP_AUTO) {
+        try {
+            CircleFitResult fit = petri_bb_circle_fit(picture);
+            if (fit.confidence >=
+                getConfig()->PetriDish.circleFitMinConfidence) {
+                return PetriDish(
+                    cropPetriDish(picture.image(), fit.boundingbox),
+                    fit.boundingbox, true);
+            }
+        } catch (astimp::Exception::generic &) {
+            // no circle, the dish may not be round
+        }
+        return getPetriDishGrabCut(picture);
+    }
 
-    GrabCutResult gcres = petri_bb_grabcut(ast_picture);
+    CircleFitResult fit = petri_bb_circle_fit(picture);
+    return PetriDish(cropPetriDish(picture.image(), fit.boundingbox),
+                     fit.boundingbox, true);
+}
 
-    return PetriDish(cropPetriDish(ast_picture, gcres.boundingbox),
-                     gcres.boundingbox, is_circle(gcres.contour, 1.1));
+PetriDish getPetriDish(const cv::Mat &ast_picture,
+                       const ImprocConfig &config) {
+    ScopedConfig scope(config);
+    return getPetriDish(ast_picture);
 }
 
 PetriDish getPetriDishWithRoi(const cv::Mat &ast_picture,
@@ -276,7 +470,8 @@ PetriDish getPetriDishWithRoi(const cv::Mat &ast_picture,
             __FILE__, __LINE__);
     }
 
-    GrabCutResult gcres = petri_bb_grabcut(ast_picture, true, roi);
+    PlateContext picture(ast_picture);
+    GrabCutResult gcres = petri_bb_grabcut(picture, true, roi);
 
     return PetriDish(cropPetriDish(ast_picture, gcres.boundingbox),
                      gcres.boundingbox, is_circle(gcres.contour, 1.1));
@@ -363,6 +558,11 @@ void calcDominantColor(const cv::Mat &img, int* hsv) {
 }
 
 bool isGrowthMediumBlood(const cv::Mat &ast_crop) {
+    PlateContext crop(ast_crop);
+    return isGrowthMediumBlood(crop);
+}
+
+bool isGrowthMediumBlood(PlateContext &crop) {
     /* Determine if the growth medium of an AST picture is blood enriched (HM-F).
     *
     * return boolean:
@@ -373,13 +573,9 @@ bool isGrowthMediumBlood(const cv::Mat &ast_crop) {
     *   img: the cropped bgr Petri-dish image of an antibiogram picture.
     */
 
-    // resize image
-    cv::Mat resized_img;
-    cv::resize(ast_crop, resized_img , cv::Size2i(50,50), 0,0);
-
-    // get dominant color
+    // get dominant color of the resized image
     int hsv[3];
-    calcDominantColor(resized_img, hsv);
+    calcDominantColor(crop.resized(cv::Size2i(50,50)), hsv);
     int h = hsv[0];
     int s = hsv[1];
     int v = hsv[2];
@@ -429,30 +625,38 @@ bool isCircleOutsideImage(const Circle &circle, const cv::Mat &img) {
     return circle_max_x > img.cols || circle_max_y > img.rows;
 }
 
+vector<Circle> find_atb_pellets(const cv::Mat &img,
+                                const ImprocConfig &config) {
+    ScopedConfig scope(config);
+    return find_atb_pellets(img);
+}
+
 vector<Circle> find_atb_pellets(const cv::Mat &img) {
+    PlateContext plate(img);
+    return find_atb_pellets(plate);
+}
+
+vector<Circle> find_atb_pellets(PlateContext &plate) {
     /* @Brief Find the pellets in a cropped ast picture
      *
      * if the image is not grayscale, the blue channel only will be used.
      *
      * A cropped ast pictures displays only the Petri dish (no borders) */
-    cv::Mat imgenorm, imgth, gray;
+    const cv::Mat &img = plate.image();
+    cv::Mat imgeq, imgenorm, imgth;
 
-    // convert the input image to a one-channel image
-    if (img.channels() > 1) {
-        cv::extractChannel(
-            img, gray,
-            0);  // select the blule channel, which is more significant here
-    } else {
-        gray = img;
-    }
+    // convert the input image to a one-channel image: select the blue
+    // channel, which is more significant here
+    const cv::Mat &gray = plate.channel(0);
 
     // cv::imshow("display", gray);cv::waitKey(0);
 
     // equalization of the image
-    cv::equalizeHist(gray, gray);
+    // (not in place: gray may share its data with the input image)
+    cv::equalizeHist(gray, imgeq);
 
     // normalization of the image
-    cv::normalize(gray, imgenorm, 0, UCHAR_MAX, cv::NORM_MINMAX);
+    cv::normalize(imgeq, imgenorm, 0, UCHAR_MAX, cv::NORM_MINMAX);
     // cv::imshow("display", gray);cv::waitKey(0);
     // threshold to select the pellets
     cv::threshold(imgenorm, imgth,
@@ -604,35 +808,7 @@ vector<cv::Mat> cutPelletsInImage(const cv::Mat &img, vector<Circle> &circles) {
 /* -------------------------------------------------------------------------- */
 /*                                  DIAMETERS                                 */
 /* -------------------------------------------------------------------------- */
-double squareError(vector<float>::iterator first, vector<float>::iterator last,
-                   float m) {
-    /* @brief calculate the SE of a vector from first to last. Errors are
-    distances from m. first, last Input iterators to the initial and final
-    positions in a sequence. The range used is [first,last), which contains all
-    the elements between first and last, including the element pointed by first
-    but not the element pointed by last
-    m
-      the value with which the error is calculated: error[i] = (x[i] - m)
-    */
-    double se = accumulate(
-        first, last, 0, [m](float x, float y) { return x + pow((y - m), 2); });
-    return se;
-}
-
-double meanSquareError(vector<float>::iterator first,
-                       vector<float>::iterator last, float m) {
-    /* @brief calculate the MSE of a vector from first to last. Errors are
-    distances from m. first, last Input iterators to the initial and final
-    positions in a sequence. The range used is [first,last), which contains all
-    the elements between first and last, including the element pointed by first
-    but not the element pointed by last
-    m
-      the value with which the error is calculated: error[i] = (x[i] - m)
-    */
-    return squareError(first, last, m) / (last - first);
-}
-
-float calcDiameterReadingSensibility(InhibDiamPreprocResult preproc,
+float calcDiameterReadingSensibility(const InhibDiamPreprocResult &preproc,
                                      int pellet_idx) {
     // calc diameter reading sensibility based on inhibition/bacteria contrast
 
@@ -750,7 +926,7 @@ float calcDiameterReadingSensibility(InhibDiamPreprocResult preproc,
     return drs;
 }
 
-InhibDisk measureOneInscribedDiameter(InhibDiamPreprocResult preproc,
+InhibDisk measureOneInscribedDiameter(const InhibDiamPreprocResult &preproc,
                                       int pellet_idx) {
     vector<int> kmcl = preproc.km_centers_local[pellet_idx];
 
@@ -824,20 +1000,10 @@ InhibDisk measureOneInscribedDiameter(InhibDiamPreprocResult preproc,
             // log("\tfull inhibition","");
             // log("\tdata_start",*data_start);
         } else {
-            mse = meanSquareError(data_start, y_count.end(), hv);
-            size_t non_pellet_px = y_count.size() - pellet_r_px;
-            for (size_t px_i = 1; px_i < y_count.size() - pellet_r_px; px_i++) {
-                double inhib_err =
-                    squareError(data_start, data_start + px_i, lv);
-                double bacteria_err =
-                    squareError(data_start + px_i, y_count.end(), hv);
-                double curr_mse = (inhib_err + bacteria_err) / non_pellet_px;
-                if (curr_mse < mse) {
-                    // This is the lowest error we've found so far.
-                    mse = curr_mse;
-                    inhib_r_px = px_i;
-                }
-            }
+            // Find the step between inhibition (lv) and bacteria (hv) that
+            // best fits the profile.
+            inhib_r_px =
+                fitStepFunction(data_start, y_count.end(), lv, hv, &mse);
             inhib_r_px += pellet_r_px;
         }
         inhib_diam_mm = float(inhib_r_px * 2) / preproc.px_per_mm;
@@ -862,7 +1028,7 @@ InhibDisk measureOneInscribedDiameter(InhibDiamPreprocResult preproc,
     return InhibDisk{inhib_diam_mm, (float)confidence};
 }
 
-InhibDisk measureOneCircumscribedDiameter(InhibDiamPreprocResult ip,
+InhibDisk measureOneCircumscribedDiameter(const InhibDiamPreprocResult &ip,
                                           int pellet_idx) {
     /* @brief Measures the inhibition diameter of one pellet.
      *
@@ -979,8 +1145,8 @@ end:
     return InhibDisk{diameter, rms};
 }
 
-InhibDisk measureOneDiameter(InhibDiamPreprocResult preproc, int pellet_idx,
-                             InhibMeasureMode mode) {
+InhibDisk measureOneDiameter(const InhibDiamPreprocResult &preproc,
+                             int pellet_idx, InhibMeasureMode mode) {
     switch (mode) {
         case CIRCUMSCRIBED:
             return measureOneCircumscribedDiameter(preproc, pellet_idx);
@@ -990,6 +1156,31 @@ InhibDisk measureOneDiameter(InhibDiamPreprocResult preproc, int pellet_idx,
     }
 }
 
+// Seed of the RNG used by the local k-means of the first ROI of a plate,
+// the n-th ROI uses LOCAL_KMEANS_RNG_SEED + n.
+const uint64_t LOCAL_KMEANS_RNG_SEED = 4294967295;
+// Seed of the RNG used by the global k-means of a plate.
+const uint64_t GLOBAL_KMEANS_RNG_SEED = 1234567;
+
+static mutex inhibPreprocTimingsMutex;
+static InhibPreprocTimings inhibPreprocTimings{};
+
+// Milliseconds elapsed since start.
+static double elapsed_ms(chrono::steady_clock::time_point start) {
+    return chrono::duration<double, milli>(chrono::steady_clock::now() - start)
+        .count();
+}
+
+InhibPreprocTimings getInhibPreprocTimings() {
+    lock_guard<mutex> lock(inhibPreprocTimingsMutex);
+    return inhibPreprocTimings;
+}
+
+void resetInhibPreprocTimings() {
+    lock_guard<mutex> lock(inhibPreprocTimingsMutex);
+    inhibPreprocTimings = InhibPreprocTimings{};
+}
+
 InhibDiamPreprocResult inhib_diam_preprocessing(cv::Mat cropped_plate_img,
                                                 bool isRound,
                                                 vector<Circle> &circles) {
@@ -1002,71 +1193,58 @@ InhibDiamPreprocResult inhib_diam_preprocessing(cv::Mat cropped_plate_img,
 }
 
 InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
-                                                vector<Circle> &circles) {
-    // TODO(Marco): Split this method into multiple, perhaps using a class.
-    // TODO: refactoring could probably improve the performances
-
-    /* @brief create an image that is optimal for inhibition diameter
-     * measurement
-     *
-     * the input image must be BGR cropped image of a Petri dish.
-     *
-     * This image is cropped rescaled and resized in so that it can be used for
-     * the measurement of the inibition diameters.
-     */
+                                                vector<Circle> &circles,
+                                                const ImprocConfig &config,
+                                                InhibPreprocState *state) {
+    ScopedConfig scope(config);
+    return inhib_diam_preprocessing(petri, circles, state);
+}
 
-    cv::Mat img;
-    if (astimp::getConfig()->PetriDish.growthMedium == MEDIUM_BLOOD) {
-        // copy green channel into red channel
-        int fromto[] = {0, 0, 1, 1, 1, 2};
-        img = petri.img.clone();
-        cv::mixChannels(&petri.img, 1, &img, 1, fromto, 3);
-    } else {
-        // copy blue channel into red channel
-        img = petri.img;
+// Geometry of the preprocessing of a plate, it depends on the pellets (and the
+// size of the image) only.
+struct InhibPreprocGeometry {
+    // value of 1 millimeter in pixels in the plate image
+    float original_img_px_per_mm;
+    // ROI of the plate image that is preprocessed
+    cv::Rect bbox;
+    // value of 1 millimeter in pixels in the preprocessed image
+    float px_per_mm;
+    float resize_f;
+    int mbKernelSize;
+    // maximum inhibition radius in pixels in the plate image
+    float max_inib_r;
+    int pad;
+
+    bool operator==(const InhibPreprocGeometry &y) const {
+        return original_img_px_per_mm == y.original_img_px_per_mm &&
+               bbox == y.bbox && px_per_mm == y.px_per_mm &&
+               resize_f == y.resize_f && mbKernelSize == y.mbKernelSize &&
+               max_inib_r == y.max_inib_r && pad == y.pad;
     }
-    // cv::imshow("display", img); cv::waitKey(0);
+};
 
-    cv::Mat crop, std, temp, crop_color, debug;
+static InhibPreprocGeometry inhib_preproc_geometry(
+    const cv::Size &imgSize, bool isRound, const vector<Circle> &circles) {
+    InhibPreprocGeometry geometry;
     auto inhibConfig = getConfig()->Inhibition;
     float original_img_px_per_mm = 1.0 / get_mm_per_px(circles);
+    geometry.original_img_px_per_mm = original_img_px_per_mm;
 
-    // convert the input image to a one-channel image
-    cv::cvtColor(img, img, cv::COLOR_BGR2GRAY);
-
+    // get a list of the centers of the pellets
     vector<cv::Point2f> centers(circles.size(), cv::Point2f(0, 0));
-    vector<cv::Point2f> new_centers(circles.size(), cv::Point2f(0, 0));
     vector<float> radii(circles.size(), 0);
-    vector<Circle> new_circles(circles.size(), Circle{cv::Point2f(0, 0), 0});
-
-    // Normalize
-    cv::normalize(img, img, UCHAR_MAX, 0, cv::NORM_MINMAX);
-
-    // erase label text
-    for (size_t i = 0; i < circles.size(); i++) {
-        cv::circle(img, circles[i].center, circles[i].radius,
-                   cv::Scalar(UCHAR_MAX), cv::FILLED, 0, 0);
-    }
-    // cv::imshow("display", img); cv::waitKey(0);
-
-    // get a list of the centers of the pellets
     for (size_t i = 0; i < centers.size(); i++) {
         centers[i] = circles[i].center;
         radii[i] = circles[i].radius;
     }
 
     // find the ROI that includes all the pellets centers
-    cv::Rect bbox, bbox_strict;
+    cv::Rect bbox;
     float max_r = vector_min(radii);
     float total_roi_border =
         max_r + original_img_px_per_mm *
                     astimp::getConfig()->PetriDish.borderPelletDistance_in_mm;
-    if (!petri.isRound) {
-        bbox_strict = cv::boundingRect(centers);
-        bbox_strict.x -= max_r;
-        bbox_strict.y -= max_r;
-        bbox_strict.height += round(2 * max_r);
-        bbox_strict.width += round(2 * max_r);
+    if (!isRound) {
         bbox = cv::boundingRect(centers);
         // enlarge the ROI so that it includes the whole images of the pellets
 
@@ -1090,8 +1268,8 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
 
         // Calculate the bouding box the smallest circle centered in
         // the image center, which includes all the pellets
-        float image_cx = img.cols / 2;
-        float image_cy = img.rows / 2;
+        float image_cx = imgSize.width / 2;
+        float image_cy = imgSize.height / 2;
         mec_radius = -1;
         mec_center = cv::Point2f(image_cx, image_cy);
         for (size_t i = 0; i < centers.size(); i++) {
@@ -1104,19 +1282,12 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
         mec_radius = sqrt(mec_radius);
         mec_radius += total_roi_border;
         bbox = getBoundingRectFromCircle(mec_center, mec_radius);
-        mec_radius += max_r;
-        bbox_strict = getBoundingRectFromCircle(mec_center, mec_radius);
         // log("mec_radius",max_dist_from_center);
     }
-
-    cv::Mat crop_strict;
-    img(bbox).copyTo(crop);
-    img(bbox_strict).copyTo(crop_strict);  // for k-means only
-    // cv::imshow("display",crop_strict); cv::waitKey(0);
-    // cv::imshow("display",crop); cv::waitKey(0);
+    geometry.bbox = bbox;
 
     //* Calculate rescaling factor
-    float px_per_mm = astimp::getConfig()->Inhibition.preprocImg_px_per_mm;
+    float px_per_mm = inhibConfig.preprocImg_px_per_mm;
     float resize_f;
     if (px_per_mm < original_img_px_per_mm) {
         resize_f = ((float)px_per_mm) / original_img_px_per_mm;
@@ -1124,13 +1295,8 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
         px_per_mm = original_img_px_per_mm;
         resize_f = 1;
     }
-    // float rescaled_size = inhibConfig.stdImageSize;
-    // float resize_f = 1;
-    // float px_per_mm = original_img_px_per_mm;
-    // if (inhibConfig.resizeStdImage) {
-    //     resize_f = rescaled_size / max(crop.rows, crop.cols);
-    //     px_per_mm *= resize_f;
-    // }
+    geometry.px_per_mm = px_per_mm;
+    geometry.resize_f = resize_f;
 
     //* BLUR (for noise reduction)
     // median blur kernel size
@@ -1139,39 +1305,67 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
     if (mbKernelSize % 2 == 0) {
         mbKernelSize = mbKernelSize + 1;
     }
-    cv::Mat tempBlurImg;
-    cv::medianBlur(crop, tempBlurImg, mbKernelSize);
-    tempBlurImg.copyTo(crop);
-    cv::medianBlur(crop_strict, tempBlurImg, mbKernelSize);
-    tempBlurImg.copyTo(crop_strict);
-    // cv::imshow("display", tempBlurImg); cv::waitKey(0);
-
-    // MASK DISH BODERS WITH UCHAR_MAX for global k-means
-    crop_strict.copyTo(temp);
-    if (petri.isRound) {
-        // remove data outside the minimum enclosing circle
-        cv::Mat mask = cv::Mat::zeros(crop_strict.size(), CV_8U);
-        cv::circle(mask,
-                   cv::Point2f(crop_strict.cols / 2, crop_strict.rows / 2),
-                   crop_strict.rows / 2, cv::Scalar(255), cv::FILLED);
-        // cv::imshow("display",mask); cv::waitKey(0);
-        temp = cv::Mat::ones(crop.size(), CV_8U) * UCHAR_MAX;
-        cv::bitwise_and(crop_strict, crop_strict, temp, mask);
-    }
-    // crop_strict.copyTo(temp);
-    // cv::imshow("display",crop); cv::waitKey(0);
-    // cv::imshow("display",temp); cv::waitKey(0);
+    geometry.mbKernelSize = mbKernelSize;
 
     //* Calculate padding
     float max_inib_r =
         inhibConfig.maxInhibitionDiameter / 2 * original_img_px_per_mm;
+    geometry.max_inib_r = max_inib_r;
+    // pad the ROI with the size of the maximum inhibition radius
+    geometry.pad = (int)round((max_inib_r + 1 * px_per_mm) *
+                              resize_f);  // add one millimeter for safety
+    return geometry;
+}
+
+// Gray levels of the plate image in roi.
+static cv::Mat plate_gray_levels(const cv::Mat &plateImg, const cv::Rect &roi) {
+    cv::Mat img = plateImg(roi);
+    if (astimp::getConfig()->PetriDish.growthMedium == MEDIUM_BLOOD) {
+        // copy green channel into red channel
+        int fromto[] = {0, 0, 1, 1, 1, 2};
+        cv::Mat mixed = img.clone();
+        cv::mixChannels(&img, 1, &mixed, 1, fromto, 3);
+        img = mixed;
+    }
+    // convert the input image to a one-channel image
+    cv::Mat gray;
+    cv::cvtColor(img, gray, cv::COLOR_BGR2GRAY);
+    return gray;
+}
+
+// Paints the pellets white in gray, an image of the plate whose top left
+// corner is at origin in the plate image (this erases the label text).
+static void paint_pellets(cv::Mat &gray, const cv::Point &origin,
+                          const vector<Circle> &circles) {
+    for (const Circle &circle : circles) {
+        cv::circle(gray, cv::Point(circle.center) - origin, circle.radius,
+                   cv::Scalar(UCHAR_MAX), cv::FILLED, 0, 0);
+    }
+}
+
+// Preprocessing of a plate from its median blurred image (state.blurred).
+// The local k-means of the ROIs whose pixels are the same in previous (of
+// state previousState) are not run again.
+static InhibDiamPreprocResult inhib_diam_preprocessing_from_blurred(
+    bool isRound, const vector<Circle> &circles,
+    const InhibPreprocGeometry &geometry, InhibPreprocState &state,
+    const InhibDiamPreprocResult *previous,
+    const InhibPreprocState *previousState,
+    chrono::steady_clock::time_point start) {
+    auto inhibConfig = getConfig()->Inhibition;
+    const cv::Mat &crop = state.blurred;
+    const float original_img_px_per_mm = geometry.original_img_px_per_mm;
+    const float px_per_mm = geometry.px_per_mm;
+    const float resize_f = geometry.resize_f;
+    const int pad = geometry.pad;
+    cv::Mat std, temp;
 
     //* Map levels in [0,1]
     cv::normalize(crop, temp, 1, 0, cv::NORM_MINMAX, CV_32F);
 
     // MASK plastic borders
     cv::Mat mask;
-    if (petri.isRound) {
+    if (isRound) {
         // mask data outside the minimum enclosing circle
         mask = cv::Mat::zeros(temp.size(), CV_8U);
         cv::circle(mask, cv::Point2f(temp.cols / 2, temp.rows / 2),
@@ -1186,34 +1380,39 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
 
     //* MASK PELLETS WITH -1
     // make pellet pixels value -1
+    const float minPelletIntensity =
+        ((float)inhibConfig.minPelletIntensity) / UCHAR_MAX;
     for (int y = 0; y < std.rows; y++) {
+        float *row = std.ptr<float>(y);
         for (int x = 0; x < std.cols; x++) {
-            int minPelletIntensity =
-                astimp::getConfig()->Inhibition.minPelletIntensity;
-            if (std.at<float>(y, x) >=
-                ((float)minPelletIntensity) / UCHAR_MAX) {
-                std.at<float>(y, x) = -1;
+            if (row[x] >= minPelletIntensity) {
+                row[x] = -1;
             }
         }
     }
     // cv::imshow("display", std); cv::waitKey(0);
 
     //* Rescale the image (before padding)
-    cv::resize(std, std, cv::Size(0, 0), resize_f, resize_f);
+    if (!state.downscaled) {
+        cv::resize(std, std, cv::Size(0, 0), resize_f, resize_f);
+    }
 
     //* Apply PADDING:
     // pad the ROI with the size of the maximum inhibition radius
-    int pad = (int)round((max_inib_r + 1 * px_per_mm) *
-                         resize_f);  // add one millimeter for safety
     cv::copyMakeBorder(std, std, pad, pad, pad, pad, cv::BORDER_CONSTANT, -1);
     // cv::imshow("display", std); cv::waitKey(0);
 
     //* Calculate new circles in std image
-    for (size_t i = 0; i < centers.size(); i++) {
-        new_centers[i].x = (centers[i].x - bbox.x) * resize_f + pad;
-        new_centers[i].y = (centers[i].y - bbox.y) * resize_f + pad;
+    const cv::Rect &bbox = geometry.bbox;
+    vector<cv::Point2f> new_centers(circles.size(), cv::Point2f(0, 0));
+    vector<Circle> new_circles(circles.size(), Circle{cv::Point2f(0, 0), 0});
+    vector<float> radii(circles.size(), 0);
+    for (size_t i = 0; i < circles.size(); i++) {
+        new_centers[i].x = (circles[i].center.x - bbox.x) * resize_f + pad;
+        new_centers[i].y = (circles[i].center.y - bbox.y) * resize_f + pad;
         new_circles[i].center = new_centers[i];
-        new_circles[i].radius = ((radii[i]) * resize_f);
+        new_circles[i].radius = ((circles[i].radius) * resize_f);
+        radii[i] = circles[i].radius;
     }
 
     /* Mask pixels which are closer to the border of the plate
@@ -1224,10 +1423,10 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
      * Here a std_stric image is produced, where the exernal pixels are masked.
      * this image is used only in the local k-means calculation.
      */
-    max_r *= resize_f;
+    float max_r = vector_min(radii) * resize_f;
     mask = cv::Mat::zeros(std.size(), CV_8U);
     cv::Mat std_strict = cv::Mat::ones(std.size(), CV_32F) * -1;
-    if (petri.isRound) {
+    if (isRound) {
         float mec_radius;
         cv::Point2f mec_center;
         // remove data outside the minimum enclosing circle
@@ -1237,7 +1436,7 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
         // cv::imshow("display",mask); cv::waitKey(0);
         cv::bitwise_and(std, std, std_strict, mask);
     } else {
-        bbox_strict = cv::boundingRect(new_centers);
+        cv::Rect bbox_strict = cv::boundingRect(new_centers);
         bbox_strict.x -= max_r;
         bbox_strict.y -= max_r;
         bbox_strict.height += round(2 * max_r);
@@ -1251,16 +1450,23 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
 
     //* GLOBAL K-MEANS
     //* get the intensity thresholds of bacteria and inhibition by k-means
-    float km_resize_f = 150.0 / max(temp.rows, temp.cols);
+    float km_resize_f = 150.0 / max(bbox.width, bbox.height);
     vector<int> km_centers;
     std_strict.copyTo(temp);
     cv::resize(temp, temp, cv::Size(0, 0), km_resize_f, km_resize_f);
-    km_centers = masked_k_means(temp, 2);
+    auto global_kmeans_start = chrono::steady_clock::now();
+    {
+        // Seed the RNG used by k-means for this call only, so that the result
+        // does not depend on what the thread ran before.
+        ScopedRNGState rngState(GLOBAL_KMEANS_RNG_SEED);
+        km_centers = masked_k_means(temp, 2);
+    }
+    double global_kmeans_ms = elapsed_ms(global_kmeans_start);
 
     //* get the inhibition ROIs centered on each pellet (added 2 mm for better
     // reading)
     vector<cv::Rect> inhib_ROIs = inhibition_disks_ROIs(
-        new_circles, std, (max_inib_r + 2 * px_per_mm) * resize_f);
+        new_circles, std, (geometry.max_inib_r + 2 * px_per_mm) * resize_f);
 
     //* local k-means: Cluster pellets vs. inhibition vs. bacteria for
     //* each individual antibiotic.
@@ -1268,29 +1474,54 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
         vector<vector<int>>(inhib_ROIs.size(), vector<int>(2, 0));
     vector<int> km_thresholds_local = vector<int>(inhib_ROIs.size(), 0);
 
-    cv::Mat selection;
     //* calculate k-means local values
-    for (size_t i = 0; i < inhib_ROIs.size(); i++) {
-        auto roi = inhib_ROIs[i];
+    auto localKmeans = [&](size_t i) {
+        // Seed the RNG used by k-means for this ROI only, so that the result
+        // does not depend on the order in which the ROIs are processed.
+        ScopedRNGState rngState(LOCAL_KMEANS_RNG_SEED + i);
+
         //* select the roi pixel, remove border (value < 0)
-        std_strict(roi).copyTo(temp);
+        cv::Mat roi_img;
+        std_strict(inhib_ROIs[i]).copyTo(roi_img);
 
         // resize for speed
-        if (max(temp.rows, temp.cols) > 150) {
-            km_resize_f = 150.0 / max(temp.rows, temp.cols);
-            cv::resize(temp, temp, cv::Size(0, 0), km_resize_f, km_resize_f);
+        if (max(roi_img.rows, roi_img.cols) > 150) {
+            float roi_resize_f = 150.0 / max(roi_img.rows, roi_img.cols);
+            cv::resize(roi_img, roi_img, cv::Size(0, 0), roi_resize_f,
+                       roi_resize_f);
         }
 
         // apply k-means to positive valued pixels
-        vector<int> this_km_centers = masked_k_means(temp, 2);
+        km_centers_local[i] = masked_k_means(roi_img, 2);
+    };
 
-        // log(">>> km[0]", this_km_centers[0]);
-        // log(">>> km[1]", this_km_centers[1]);
-        // log(">>> km[2]", this_km_centers[2]);
+    // the k-means of a ROI (same index, same seed) with the same pixels as in
+    // the previous preprocessing gives the same result
+    vector<size_t> changedROIs;
+    for (size_t i = 0; i < inhib_ROIs.size(); i++) {
+        if (previous != nullptr && i < previous->ROIs.size() &&
+            previous->ROIs[i] == inhib_ROIs[i] &&
+            previousState->kmeansImg.size() == std_strict.size() &&
+            cv::norm(previousState->kmeansImg(inhib_ROIs[i]),
+                     std_strict(inhib_ROIs[i]), cv::NORM_INF) == 0) {
+            km_centers_local[i] = previous->km_centers_local[i];
+        } else {
+            changedROIs.push_back(i);
+        }
+    }
+    auto local_kmeans_start = chrono::steady_clock::now();
+    if (inhibConfig.parallelLocalKmeans) {
+        parallel_for_each_index(
+            changedROIs.size(), inhibConfig.localKmeansThreads,
+            [&](size_t k) { localKmeans(changedROIs[k]); });
+    } else {
+        for (size_t i : changedROIs) localKmeans(i);
+    }
+    double local_kmeans_ms = elapsed_ms(local_kmeans_start);
 
-        // store the result
-        km_centers_local[i] = this_km_centers;
-        float drs = inhibConfig.diameterReadingSensibility;
+    float drs = inhibConfig.diameterReadingSensibility;
+    for (size_t i = 0; i < inhib_ROIs.size(); i++) {
+        const vector<int> &this_km_centers = km_centers_local[i];
         km_thresholds_local[i] =
             this_km_centers[0] +
             (this_km_centers[1] - this_km_centers[0]) * (1 - drs);
@@ -1311,24 +1542,230 @@ InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
     }
     // cv::imshow("display", std_white_pellets); cv::waitKey(0);
 
+    {
+        lock_guard<mutex> lock(inhibPreprocTimingsMutex);
+        inhibPreprocTimings.calls++;
+        inhibPreprocTimings.totalMs += elapsed_ms(start);
+        inhibPreprocTimings.globalKmeansMs += global_kmeans_ms;
+        inhibPreprocTimings.localKmeansMs += local_kmeans_ms;
+        inhibPreprocTimings.localKmeansROIs += changedROIs.size();
+    }
+
     // extract the radial profiles
-    return InhibDiamPreprocResult(
+    InhibDiamPreprocResult result(
         std_white_pellets, new_circles, inhib_ROIs, km_centers,
         (km_centers[1] + km_centers[0]) / 2, km_centers_local,
         km_thresholds_local, resize_f, pad, px_per_mm, original_img_px_per_mm);
+    state.kmeansImg = std_strict;
+    return result;
+}
+
+InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri,
+                                                vector<Circle> &circles,
+                                                InhibPreprocState *state) {
+    PlateContext plate(petri.img);
+    return inhib_diam_preprocessing(plate, petri.isRound, circles, state);
+}
+
+InhibDiamPreprocResult inhib_diam_preprocessing(PlateContext &plate,
+                                                bool isRound,
+                                                const vector<Circle> &circles,
+                                                InhibPreprocState *keptState) {
+    // TODO(Marco): Split this method into multiple, perhaps using a class.
+    // TODO: refactoring could probably improve the performances
+
+    /* @brief create an image that is optimal for inhibition diameter
+     * measurement
+     *
+     * the input image must be BGR cropped image of a Petri dish.
+     *
+     * This image is cropped rescaled and resized in so that it can be used for
+     * the measurement of the inibition diameters.
+     */
+
+    auto start = chrono::steady_clock::now();
+
+    const cv::Mat &plateImg = plate.image();
+    InhibPreprocGeometry geometry =
+        inhib_preproc_geometry(plateImg.size(), isRound, circles);
+
+    // the gray levels of the standard medium are kept by the context
+    cv::Mat gray =
+        getConfig()->PetriDish.growthMedium == MEDIUM_BLOOD
+            ? plate_gray_levels(plateImg,
+                                cv::Rect(0, 0, plateImg.cols, plateImg.rows))
+            : plate.gray();
+
+    // Normalize (same as cv::normalize, the scale and the shift are kept to
+    // normalize parts of the image in update_inhib_diam_preprocessing)
+    InhibPreprocState state;
+    double smin, smax;
+    cv::minMaxIdx(gray, &smin, &smax);
+    state.grayScale =
+        UCHAR_MAX * (smax - smin > DBL_EPSILON ? 1. / (smax - smin) : 0);
+    state.grayShift = -smin * state.grayScale;
+
+    if (getConfig()->Inhibition.downscaleFirst) {
+        // resample the crop (a view of the gray levels) to the scale of the
+        // preprocessed image, the area interpolation averages the noise
+        cv::Mat crop;
+        cv::resize(gray(geometry.bbox), crop, cv::Size(0, 0),
+                   geometry.resize_f, geometry.resize_f, cv::INTER_AREA);
+        crop.convertTo(crop, -1, state.grayScale, state.grayShift);
+
+        // erase label text
+        vector<Circle> scaled(circles);
+        for (Circle &circle : scaled) {
+            circle.center = (circle.center - cv::Point2f(geometry.bbox.tl())) *
+                            geometry.resize_f;
+            circle.radius *= geometry.resize_f;
+        }
+        paint_pellets(crop, cv::Point(0, 0), scaled);
+
+        //* BLUR (for noise reduction), with the kernel scaled to the
+        // resampled image (rounded down to an odd size)
+        int kernelSize = (int)round(geometry.mbKernelSize * geometry.resize_f);
+        if (kernelSize % 2 == 0) kernelSize--;
+        if (kernelSize >= 3) {
+            cv::medianBlur(crop, state.blurred, kernelSize);
+        } else {
+            state.blurred = crop;
+        }
+        state.downscaled = true;
+    } else {
+        cv::Mat img;
+        gray.convertTo(img, -1, state.grayScale, state.grayShift);
+
+        // erase label text
+        paint_pellets(img, cv::Point(0, 0), circles);
+        // cv::imshow("display", img); cv::waitKey(0);
+
+        cv::Mat crop;
+        img(geometry.bbox).copyTo(crop);
+        // cv::imshow("display",crop); cv::waitKey(0);
+
+        //* BLUR (for noise reduction)
+        cv::medianBlur(crop, state.blurred, geometry.mbKernelSize);
+        // cv::imshow("display", state.blurred); cv::waitKey(0);
+    }
+
+    state.plateCircles = circles;
+    state.bbox = geometry.bbox;
+    state.medianBlurSize = geometry.mbKernelSize;
+    InhibDiamPreprocResult result = inhib_diam_preprocessing_from_blurred(
+        isRound, circles, geometry, state, nullptr, nullptr, start);
+    if (keptState != nullptr) *keptState = move(state);
+    return result;
+}
+
+InhibDiamPreprocResult update_inhib_diam_preprocessing(
+    const InhibDiamPreprocResult &preproc, InhibPreprocState &state,
+    PetriDish petri, const vector<Circle> &circles,
+    const ImprocConfig &config) {
+    ScopedConfig scope(config);
+    return update_inhib_diam_preprocessing(preproc, state, petri, circles);
+}
+
+// rect enlarged by margin on each side
+static cv::Rect enlarged(const cv::Rect &rect, int margin) {
+    return cv::Rect(rect.x - margin, rect.y - margin, rect.width + 2 * margin,
+                    rect.height + 2 * margin);
+}
+
+InhibDiamPreprocResult update_inhib_diam_preprocessing(
+    const InhibDiamPreprocResult &preproc, InhibPreprocState &state,
+    PetriDish petri, const vector<Circle> &circles) {
+    PlateContext plate(petri.img);
+    return update_inhib_diam_preprocessing(preproc, state, plate,
+                                           petri.isRound, circles);
+}
+
+InhibDiamPreprocResult update_inhib_diam_preprocessing(
+    const InhibDiamPreprocResult &preproc, InhibPreprocState &keptState,
+    PlateContext &plate, bool isRound, const vector<Circle> &circles) {
+    auto start = chrono::steady_clock::now();
+    const InhibPreprocState &previous = keptState;
+    const cv::Mat &plateImg = plate.image();
+    if (previous.blurred.empty() || previous.plateCircles.empty() ||
+        circles.empty() || previous.downscaled ||
+        getConfig()->Inhibition.downscaleFirst) {
+        // the downscaled preprocessing is cheap, it is not updated
+        return inhib_diam_preprocessing(plate, isRound, circles, &keptState);
+    }
+
+    InhibPreprocGeometry geometry = inhib_preproc_geometry(
+        plateImg.size(), isRound, previous.plateCircles);
+    if (geometry.bbox != previous.bbox ||
+        geometry.mbKernelSize != previous.medianBlurSize) {
+        // not computed with the current configuration
+        return inhib_diam_preprocessing(plate, isRound, circles, &keptState);
+    }
+    InhibPreprocGeometry newGeometry =
+        inhib_preproc_geometry(plateImg.size(), isRound, circles);
+    if (!(newGeometry == geometry)) {
+        // a change of scale or ROI changes all the pixels, small changes of
+        // the scale only change the millimeters
+        float scaleChange = newGeometry.original_img_px_per_mm /
+                                geometry.original_img_px_per_mm -
+                            1;
+        if (fabs(scaleChange) > MAX_INHIB_PREPROC_UPDATE_SCALE_CHANGE ||
+            (newGeometry.bbox & geometry.bbox) != newGeometry.bbox) {
+            return inhib_diam_preprocessing(plate, isRound, circles,
+                                            &keptState);
+        }
+        geometry.original_img_px_per_mm = newGeometry.original_img_px_per_mm;
+        geometry.px_per_mm =
+            newGeometry.original_img_px_per_mm * geometry.resize_f;
+    }
+
+    // pellets removed (or moved from) and added (or moved to)
+    vector<Circle> changed(previous.plateCircles);
+    for (const Circle &circle : circles) {
+        auto it = find(changed.begin(), changed.end(), circle);
+        if (it != changed.end()) {
+            changed.erase(it);
+        } else {
+            changed.push_back(circle);
+        }
+    }
+
+    // compute the blurred image again around the changed pellets only
+    InhibPreprocState state = previous;
+    state.plateCircles = circles;
+    state.blurred = previous.blurred.clone();
+    const cv::Rect crop(0, 0, state.blurred.cols, state.blurred.rows);
+    const int margin = geometry.mbKernelSize / 2;
+    for (const Circle &circle : changed) {
+        // pixels painted by the pellet, in the crop
+        const int r = (int)circle.radius;
+        cv::Rect painted = cv::Rect(cv::Point(circle.center) - cv::Point(r, r),
+                                    cv::Size(2 * r + 1, 2 * r + 1)) -
+                           state.bbox.tl();
+        // pixels whose median changes, and the pixels needed to compute it
+        cv::Rect window = enlarged(painted, margin + 1) & crop;
+        if (window.area() == 0) continue;
+        cv::Rect source = enlarged(window, margin) & crop;
+
+        cv::Rect plateSource = source + state.bbox.tl();
+        cv::Mat gray = plate_gray_levels(plateImg, plateSource);
+        gray.convertTo(gray, -1, state.grayScale, state.grayShift);
+        paint_pellets(gray, plateSource.tl(), circles);
+        cv::Mat blurred;
+        cv::medianBlur(gray, blurred, geometry.mbKernelSize);
+        blurred(window - source.tl()).copyTo(state.blurred(window));
+    }
+
+    InhibDiamPreprocResult result = inhib_diam_preprocessing_from_blurred(
+        isRound, circles, geometry, state, &preproc, &previous, start);
+    keptState = move(state);
+    return result;
 }
 
 vector<float> radial_profile(const InhibDiamPreprocResult &preproc,
                              unsigned int num, PROFILE_TYPE type,
                              float th_value) {
     /* @Brief return the radial intensity profile of the num-th pellet */
-    if (num >= preproc.ROIs.size()) {
-        // check that num is a valid index
-        throw astimp::Exception::generic("num of pellet out of range", __FILE__,
-                                         __LINE__);
-    }
-    return astimp::radial_profile(preproc.img(preproc.ROIs[num]), type,
-                                  preproc.px_per_mm, th_value);
+    return radial_profiles(preproc, num, {type}, th_value).profiles[0];
 }
 
 vector<float> radial_profile(const cv::Mat &img, PROFILE_TYPE type,
@@ -1348,6 +1785,31 @@ vector<float> radial_profile(const cv::Mat &img, PROFILE_TYPE type,
      *  - PROFILE_SWITCH: if at a given radius the intensity is higher than th_v
      * for a sufficent number of pixels the profile value is 255, otherwise 0.
      * */
+    return radial_profiles(img, {type}, px_per_mm, th_value).profiles[0];
+}
+
+RadialProfiles radial_profiles(const InhibDiamPreprocResult &preproc,
+                               unsigned int num,
+                               const vector<PROFILE_TYPE> &types,
+                               float th_value) {
+    /* @Brief return the radial intensity profiles of the num-th pellet */
+    if (num >= preproc.ROIs.size()) {
+        // check that num is a valid index
+        throw astimp::Exception::generic("num of pellet out of range", __FILE__,
+                                         __LINE__);
+    }
+    return astimp::radial_profiles(preproc.img(preproc.ROIs[num]), types,
+                                   preproc.px_per_mm, th_value);
+}
+
+RadialProfiles radial_profiles(const cv::Mat &img,
+                               const vector<PROFILE_TYPE> &types,
+                               int px_per_mm, float th_value) {
+    /* @Brief return the radial intensity profiles of an image, one per
+     * requested type, computed in a single pass over the image.
+     *
+     * See radial_profile for the profile types.
+     * */
 
     // check that the image is of type CV_32F
     if (img.channels() != 1 || img.depth() != CV_32F) {
@@ -1355,19 +1817,23 @@ vector<float> radial_profile(const cv::Mat &img, PROFILE_TYPE type,
             "wrong image type. Expected 1 channel CV_32F", __FILE__, __LINE__);
     }
 
-    if (type < 0 || type > PROFILE_MAXAVERAGE) {
-        throw astimp::Exception::generic("wrong type for radial profile",
-                                         __FILE__, __LINE__);
+    for (PROFILE_TYPE type : types) {
+        if (type < 0 || type > PROFILE_MAXAVERAGE) {
+            throw astimp::Exception::generic("wrong type for radial profile",
+                                             __FILE__, __LINE__);
+        }
     }
+    bool needs_intensities =
+        find(types.begin(), types.end(), PROFILE_MAXAVERAGE) != types.end();
 
     uint n = img.rows;
-    vector<vector<uint>> R = r_matrix(n);
+    shared_ptr<const RadialIndex> index = getRadialIndex(n);
 
-    // profile is the output variable, the radial profile.
+    // profiles are the output variables, the radial profiles.
     // The index is interpreted as radius in pixel.
-    // To each radius value, profile associates a y value which meaning depends
-    // on the chosen profile_type
-    vector<float> profile(n / 2 + 1, 0);
+    // To each radius value, a profile associates a y value which meaning
+    // depends on the profile type
+    vector<vector<float>> profiles(types.size(), vector<float>(n / 2 + 1, 0));
 
     // Intensity values of all the pixels at a given radius (in pixel)
     vector<vector<float>> intensities_by_r(n / 2 + 1, vector<float>());
@@ -1378,85 +1844,96 @@ vector<float> radial_profile(const cv::Mat &img, PROFILE_TYPE type,
     float val;  // current pixel value
     size_t r;   // current radius
 
-    // iteration over all the pixels
-    for (size_t i = 0; i < n; i++) {
-        for (size_t j = 0; j < n; j++) {
-            r = R[i][j];
-            if (r > n / 2)
-                continue;  // radius must not be > than half image size
-            val = img.at<float>(i, j);
+    // iteration over all the pixels, radius by radius
+    for (r = 0; r <= n / 2; r++) {
+        for (uint k = index->radiusBegin[r]; k < index->radiusBegin[r + 1];
+             k++) {
+            const cv::Point &px = index->pixels[k];
+            val = img.at<float>(px.y, px.x);
             if (val < 0) continue;  // skip negative values
-            switch (type) {
-                case PROFILE_MEAN:
-                    profile[r] = profile[r] + val;
-                    break;
-                case PROFILE_MAX:
-                    if (val > profile[r]) profile[r] = val;
-                    break;
-                case PROFILE_MAXAVERAGE:
-                    intensities_by_r[r].push_back(val);
-                    break;
-                case PROFILE_SWITCH:
-                    if (val > th_value) profile[r] = profile[r] + 1;
-                    break;
+            for (size_t t = 0; t < types.size(); t++) {
+                vector<float> &profile = profiles[t];
+                switch (types[t]) {
+                    case PROFILE_MEAN:
+                        profile[r] = profile[r] + val;
+                        break;
+                    case PROFILE_MAX:
+                        if (val > profile[r]) profile[r] = val;
+                        break;
+                    case PROFILE_MAXAVERAGE:
+                        break;
+                    case PROFILE_SWITCH:
+                        if (val > th_value) profile[r] = profile[r] + 1;
+                        break;
+                }
             }
+            if (needs_intensities) intensities_by_r[r].push_back(val);
             counts[r] = counts[r] + 1;
         }
     }
 
-    // calculation of the profile
+    if (needs_intensities) {
+        // sort ascending, the largest values are averaged
+        for (size_t r = 0; r < intensities_by_r.size(); r++) {
+            sort(intensities_by_r[r].begin(), intensities_by_r[r].end());
+        }
+    }
+
+    // calculation of the profiles
     size_t px_per_mm_int = (size_t)round(px_per_mm);
-    switch (type) {
-        case PROFILE_MEAN:
-            for (size_t i = 0; i < profile.size(); i++) {
-                profile[i] = profile[i] / counts[i];
-            }
-            break;
-        case PROFILE_MAX:
-            break;
-        case PROFILE_MAXAVERAGE:
-            //* average the largest values
-            profile[0] = intensities_by_r[0][0];  // r=0 there is only one pixel
-            for (size_t r = 1; r < profile.size(); r++) {
-                // number of elements to average
-                uint average_size =
-                    (uint)min((int)intensities_by_r[r].size(), 2 * px_per_mm);
-                average_size = max(average_size, (uint)1);  // avoid sz == 0
-                // sort descending (high to low)
-                sort(intensities_by_r[r].begin(), intensities_by_r[r].end());
-                // average over the sz first values
-                profile[r] =
-                    accumulate(intensities_by_r[r].rbegin(),
-                               intensities_by_r[r].rbegin() + average_size,
-                               0.0) /
-                    average_size;
-            }
-            break;
-        case PROFILE_SWITCH:
-            for (size_t i = 0; i < profile.size(); i++) {
-                if (i < px_per_mm_int) {
-                    profile[i] = 1;
-                } else if (profile[i] > 2 * px_per_mm) {
-                    // if the bacteria pixels in this circle occupy more than
-                    // the distance specified in the right member of the
-                    // inequality.
-                    profile[i] = 1;
-                } else if (profile[i] > px_per_mm) {
-                    profile[i] = profile[i] / (2 * px_per_mm);
-                } else {
-                    profile[i] = 0;
+    for (size_t t = 0; t < types.size(); t++) {
+        vector<float> &profile = profiles[t];
+        switch (types[t]) {
+            case PROFILE_MEAN:
+                for (size_t i = 0; i < profile.size(); i++) {
+                    profile[i] = profile[i] / counts[i];
                 }
-            }
-            break;
-    }
+                break;
+            case PROFILE_MAX:
+                break;
+            case PROFILE_MAXAVERAGE:
+                //* average the largest values
+                for (size_t r = 0; r < profile.size(); r++) {
+                    // all the pixels at this radius are masked
+                    if (counts[r] == 0) continue;
+                    // number of elements to average
+                    uint average_size = (uint)min(
+                        (int)intensities_by_r[r].size(), 2 * px_per_mm);
+                    average_size =
+                        max(average_size, (uint)1);  // avoid sz == 0
+                    // average over the sz largest values
+                    profile[r] =
+                        accumulate(intensities_by_r[r].rbegin(),
+                                   intensities_by_r[r].rbegin() + average_size,
+                                   0.0) /
+                        average_size;
+                }
+                break;
+            case PROFILE_SWITCH:
+                for (size_t i = 0; i < profile.size(); i++) {
+                    if (i < px_per_mm_int) {
+                        profile[i] = 1;
+                    } else if (profile[i] > 2 * px_per_mm) {
+                        // if the bacteria pixels in this circle occupy more
+                        // than the distance specified in the right member of
+                        // the inequality.
+                        profile[i] = 1;
+                    } else if (profile[i] > px_per_mm) {
+                        profile[i] = profile[i] / (2 * px_per_mm);
+                    } else {
+                        profile[i] = 0;
+                    }
+                }
+                break;
+        }
 
-    // rescale to uint8 to be coherent among all profile types
-    for (size_t i = 0; i < profile.size(); i++) {
-        profile[i] = profile[i] * UCHAR_MAX;
+        // rescale to uint8 to be coherent among all profile types
+        for (size_t i = 0; i < profile.size(); i++) {
+            profile[i] = profile[i] * UCHAR_MAX;
+        }
     }
 
-    // return vector<float>(3,0);
-    return profile;
+    return RadialProfiles{types, profiles, counts};
 }
 vector<cv::Rect> inhibition_disks_ROIs(const vector<Circle> &circles,
                                        const cv::Mat &img, float max_diam) {
@@ -1524,7 +2001,8 @@ vector<cv::Rect> inhibition_disks_ROIs(const vector<Circle> &circles, int nrows,
     return out;
 }
 
-vector<InhibDisk> measureDiameters(InhibDiamPreprocResult inhib_preproc) {
+vector<InhibDisk> measureDiameters(
+    const InhibDiamPreprocResult &inhib_preproc) {
     /*
         @brief Measure the inhibition disks on a cropped image of a petri dish.
 
@@ -1536,15 +2014,29 @@ vector<InhibDisk> measureDiameters(InhibDiamPreprocResult inhib_preproc) {
       */
 
     vector<InhibDisk> disks(inhib_preproc.circles.size());
-    cv::Mat crop;
 
-    for (size_t i = 0; i < disks.size(); i++) {
+    // The pellets are independent: each one is measured in its own slot of
+    // disks, so the order of the results does not depend on the scheduling.
+    auto measure = [&](size_t i) {
         disks[i] = measureOneInscribedDiameter(inhib_preproc, i);
+    };
+    const auto &settings = getConfig()->Inhibition;
+    if (settings.parallelMeasurement) {
+        parallel_for_each_index(disks.size(), settings.measurementThreads,
+                                measure);
+    } else {
+        for (size_t i = 0; i < disks.size(); i++) measure(i);
     }
 
     return disks;
 }
 
+vector<InhibDisk> measureDiameters(const InhibDiamPreprocResult &inhib_preproc,
+                                   const ImprocConfig &config) {
+    ScopedConfig scope(config);
+    return measureDiameters(inhib_preproc);
+}
+
 //// OTHERS
 float get_mm_per_px(const vector<astimp::Circle> &circles) {
     /* @brief Returns how many millimeters are there per pixel.
@@ -16,34 +16,181 @@
 
 #include "improc-api.hpp"
 
+#include <sys/stat.h>
+
+#include <algorithm>
+#include <cmath>
 #include <iostream>
+#include <list>
+#include <mutex>
 #include <opencv2/core/core.hpp>
 #include <opencv2/highgui/highgui.hpp>
+#include <unordered_map>
 
 namespace astimp {
 
+/* Cache of the decoded images, keyed by path.
+ * The least recently used images are evicted when the total size of the
+ * images exceeds the budget. An image is read again if its file was modified
+ * (modification time or size changed) since it was cached. */
 class ImgCache {
    private:
-    cv::Mat img;
-    string imgPath;
+    struct FileVersion {
+        // modification time, with the nanoseconds: a file can be rewritten
+        // several times in a second
+        time_t mtime;
+        long mtimeNsec;
+        off_t size;
+
+        static FileVersion of(const struct stat &fileStat) {
+#ifdef __APPLE__
+            const struct timespec &mtim = fileStat.st_mtimespec;
+#else
+            const struct timespec &mtim = fileStat.st_mtim;
+#endif
+            return FileVersion{mtim.tv_sec, mtim.tv_nsec, fileStat.st_size};
+        }
+
+        bool operator==(const FileVersion &y) const {
+            return mtime == y.mtime && mtimeNsec == y.mtimeNsec &&
+                   size == y.size;
+        }
+    };
+    struct Entry {
+        cv::Mat img;
+        FileVersion version;
+        // position in usage
+        list<string>::iterator usagePos;
+    };
+
+    mutex mtx;
+    unordered_map<string, Entry> entries;
+    // paths, most recently used first
+    list<string> usage;
+    ImgCacheStats counters{0, 0, 0, 0, 0, DEFAULT_IMG_CACHE_MAX_BYTES};
+
+    static size_t imgBytes(const cv::Mat &img) {
+        return img.total() * img.elemSize();
+    }
+
+    // Must be called with the lock held.
+    void eraseLocked(unordered_map<string, Entry>::iterator it) {
+        counters.bytes -= imgBytes(it->second.img);
+        counters.entries--;
+        usage.erase(it->second.usagePos);
+        entries.erase(it);
+    }
+
+    // Must be called with the lock held.
+    void evictLocked() {
+        while (counters.bytes > counters.maxBytes) {
+            eraseLocked(entries.find(usage.back()));
+            counters.evictions++;
+        }
+    }
 
    public:
     // Reads the image and throws an exception if that fails.
     cv::Mat get(const string &path) {
-        if (imgPath != path) {
-            imgPath = path;
-            img = cv::imread(path, cv::IMREAD_COLOR);
+        struct stat fileStat;
+        if (stat(path.c_str(), &fileStat) != 0) {
+            invalidate(path);
+            throw astimp::Exception::generic("Failed to read image", __FILE__,
+                                             __LINE__);
+        }
+        const FileVersion version = FileVersion::of(fileStat);
+
+        {
+            lock_guard<mutex> lock(mtx);
+            auto it = entries.find(path);
+            if (it != entries.end()) {
+                if (it->second.version == version) {
+                    counters.hits++;
+                    usage.splice(usage.begin(), usage, it->second.usagePos);
+                    return it->second.img;
+                }
+                // the file was modified
+                eraseLocked(it);
+            }
+            counters.misses++;
         }
+
+        // read without holding the lock, other threads may use the cache
+        cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
         if (img.empty()) {
             throw astimp::Exception::generic("Failed to read image", __FILE__,
                                              __LINE__);
         }
+
+        lock_guard<mutex> lock(mtx);
+        if (imgBytes(img) > counters.maxBytes) return img;
+        auto it = entries.find(path);
+        if (it != entries.end()) eraseLocked(it);  // read by another thread
+        usage.push_front(path);
+        entries[path] = Entry{img, version, usage.begin()};
+        counters.entries++;
+        counters.bytes += imgBytes(img);
+        evictLocked();
         return img;
     }
+
+    void invalidate(const string &path) {
+        lock_guard<mutex> lock(mtx);
+        auto it = entries.find(path);
+        if (it != entries.end()) eraseLocked(it);
+    }
+
+    void clear() {
+        lock_guard<mutex> lock(mtx);
+        entries.clear();
+        usage.clear();
+        counters.entries = 0;
+        counters.bytes = 0;
+    }
+
+    void setMaxBytes(size_t maxBytes) {
+        lock_guard<mutex> lock(mtx);
+        counters.maxBytes = maxBytes;
+        evictLocked();
+    }
+
+    ImgCacheStats stats() {
+        lock_guard<mutex> lock(mtx);
+        return counters;
+    }
+
+    void resetStats() {
+        lock_guard<mutex> lock(mtx);
+        counters.hits = 0;
+        counters.misses = 0;
+        counters.evictions = 0;
+    }
 };
 
 static ImgCache imgCache;
 
+void setImgCacheMaxBytes(size_t maxBytes) { imgCache.setMaxBytes(maxBytes); }
+
+ImgCacheStats getImgCacheStats() { return imgCache.stats(); }
+
+void resetImgCacheStats() { imgCache.resetStats(); }
+
+void invalidateImgCache(const string &path) { imgCache.invalidate(path); }
+
+void invalidateImgCache() { imgCache.clear(); }
+
+cv::Mat readImage(const string &path) { return imgCache.get(path); }
+
+cv::Mat decodeImage(const vector<uchar> &encodedImg) {
+    cv::Mat img;
+    if (!encodedImg.empty()) img = cv::imdecode(encodedImg, cv::IMREAD_COLOR);
+    if (img.empty()) {
+        throw astimp::Exception::generic("Failed to decode image", __FILE__,
+                                         __LINE__);
+    }
+    return img;
+}
+
 //! DEPRECATED: use findPetriDishWithRoi instead
 cv::Rect findPetriDish(const string &astPicturePath) {
     /* return the bounding box of the petri dish in the image
@@ -57,21 +204,41 @@ cv::Rect findPetriDish(const string &astPicturePath) {
 }
 
 PetriDish findPetriDishWithRoi(const string &astPicturePath, cv::Rect2i roi) {
+    return findPetriDishWithRoi(imgCache.get(astPicturePath), roi);
+}
+
+PetriDish findPetriDishWithRoi(const vector<uchar> &encodedAstPicture,
+                               cv::Rect2i roi) {
+    return findPetriDishWithRoi(decodeImage(encodedAstPicture), roi);
+}
+
+PetriDish findPetriDishWithRoi(const cv::Mat &astPicture, cv::Rect2i roi) {
     /* return the bounding box of the petri dish in the image
      *
-     * - astPicturePath points to a whole AST picture (not cropped)
+     * - astPicture is a whole AST picture (not cropped)
      *
      * - roi defines a rectangle within the picture. The Petri dish should be
      * approximately within this rectangle̦
      */
 
-    cv::Mat srcmat = imgCache.get(astPicturePath);
-    PetriDish petri = getPetriDishWithRoi(srcmat, roi);
+    PetriDish petri = getPetriDishWithRoi(astPicture, roi);
     return petri;
 }
 
 Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
                   const string &croppedPetriImgPath, bool isRound) {
+    return findPellet(circle, otherCircles, imgCache.get(croppedPetriImgPath),
+                      isRound);
+}
+
+Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
+                  const vector<uchar> &encodedCroppedPetriImg, bool isRound) {
+    return findPellet(circle, otherCircles,
+                      decodeImage(encodedCroppedPetriImg), isRound);
+}
+
+Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
+                  const cv::Mat &img, bool isRound) {
     /*
      * @Brief Get the label and diameter of a new pellet
      * which has been manually found.
@@ -82,62 +249,88 @@ Pellet findPellet(const Circle &circle, const vector<Circle> &otherCircles,
      * NOTE: using an empty vactor here will make the detection fail
      * because the inhibition_preprocessing needs to know where the pellets are.
      *
-     * - croppedPetriImgPath points to the image of a cropped Petri dish
+     * - img is the image of a cropped Petri dish
      */
 
-    cv::Mat img = imgCache.get(croppedPetriImgPath);
-    Pellet pellet;
-    pellet.circle = circle;
-    vector<Circle> pellets(otherCircles);
-    pellets.push_back(circle);
-
-    cv::Mat pelletMat = cutOnePelletInImage(img, circle);
-    pellet.labelMatch = getOnePelletText(pelletMat);
-
-    InhibDiamPreprocResult inhib =
-        inhib_diam_preprocessing(img, isRound, pellets);
-    pellet.disk = measureOnePelletDiameter(croppedPetriImgPath, pellets,
-                                           pellets.size() - 1, INSCRIBED);
-    return pellet;
+    PlateSession session(img, otherCircles, isRound);
+    return session.findPellet(circle);
 }
 
 Pellet findPelletFromApproxCoordinates(const float centerX, const float centerY,
                                        const vector<Circle> &otherCircles,
                                        const string &croppedPetriImgPath,
                                        float mm_per_px) {
+    return findPelletFromApproxCoordinates(centerX, centerY, otherCircles,
+                                           imgCache.get(croppedPetriImgPath),
+                                           mm_per_px);
+}
+
+Pellet findPelletFromApproxCoordinates(
+    const float centerX, const float centerY,
+    const vector<Circle> &otherCircles,
+    const vector<uchar> &encodedCroppedPetriImg, float mm_per_px) {
+    return findPelletFromApproxCoordinates(centerX, centerY, otherCircles,
+                                           decodeImage(encodedCroppedPetriImg),
+                                           mm_per_px);
+}
+
+Pellet findPelletFromApproxCoordinates(const float centerX, const float centerY,
+                                       const vector<Circle> &otherCircles,
+                                       const cv::Mat &img, float mm_per_px) {
     /* find a pellet py specifying its approximative center coordinates.
      *
-     * - croppedPetriImgPath points to the image of a cropped Petri dish
+     * - img is the image of a cropped Petri dish
      */
 
-    cv::Mat img = imgCache.get(croppedPetriImgPath);
-    const astimp::Circle c =
-        astimp::searchOnePellet(img, centerX, centerY, mm_per_px);
-
-    return findPellet(c, otherCircles, croppedPetriImgPath);
+    PlateSession session(img, otherCircles);
+    return session.findPelletFromApproxCoordinates(centerX, centerY,
+                                                   mm_per_px);
 }
 
 InhibDisk measureOnePelletDiameter(const string &croppedPetriImgPath,
                                    const vector<Circle> &allCircles,
                                    int pellet_idx, InhibMeasureMode mode,
                                    bool isRound) {
-    vector<Circle> pellets(allCircles);
-    InhibDiamPreprocResult preproc = inhib_diam_preprocessing(
-        imgCache.get(croppedPetriImgPath), isRound, pellets);
-    return measureOneDiameter(preproc, pellet_idx, mode);
+    return measureOnePelletDiameter(imgCache.get(croppedPetriImgPath),
+                                    allCircles, pellet_idx, mode, isRound);
+}
+
+InhibDisk measureOnePelletDiameter(const vector<uchar> &encodedCroppedPetriImg,
+                                   const vector<Circle> &allCircles,
+                                   int pellet_idx, InhibMeasureMode mode,
+                                   bool isRound) {
+    return measureOnePelletDiameter(decodeImage(encodedCroppedPetriImg),
+                                    allCircles, pellet_idx, mode, isRound);
+}
+
+InhibDisk measureOnePelletDiameter(const cv::Mat &img,
+                                   const vector<Circle> &allCircles,
+                                   int pellet_idx, InhibMeasureMode mode,
+                                   bool isRound) {
+    PlateSession session(img, allCircles, isRound);
+    return session.measureOnePelletDiameter(pellet_idx, mode);
 }
 
 PelletsAndPxPerMm findPellets(const string &croppedPetriImgPath, bool isRound) {
+    return findPellets(imgCache.get(croppedPetriImgPath), isRound);
+}
+
+PelletsAndPxPerMm findPellets(const vector<uchar> &encodedCroppedPetriImg,
+                              bool isRound) {
+    return findPellets(decodeImage(encodedCroppedPetriImg), isRound);
+}
+
+PelletsAndPxPerMm findPellets(const cv::Mat &img, bool isRound) {
     /* find the antibiotic disks in a petri dish image
      *
-     * - croppedPetriImgPath points to the image of a cropped Petri dish
+     * - img is the image of a cropped Petri dish
      */
 
-    cv::Mat img = imgCache.get(croppedPetriImgPath);
-    vector<Circle> pellets = find_atb_pellets(img);
+    PlateContext plate(img);
+    vector<Circle> pellets = find_atb_pellets(plate);
 
     InhibDiamPreprocResult inhib =
-        inhib_diam_preprocessing(img, isRound, pellets);
+        inhib_diam_preprocessing(plate, isRound, pellets);
     vector<astimp::InhibDisk> disks = astimp::measureDiameters(inhib);
 
     vector<cv::Mat> cutPellets = cutPelletsInImage(img, pellets);
@@ -154,6 +347,207 @@ PelletsAndPxPerMm findPellets(const string &croppedPetriImgPath, bool isRound) {
     return pelletsAndPxPerMm;
 }
 
+PlateReading readPlate(const string &astPicturePath) {
+    return readPlate(imgCache.get(astPicturePath));
+}
+
+PlateReading readPlate(const vector<uchar> &encodedAstPicture) {
+    return readPlate(decodeImage(encodedAstPicture));
+}
+
+PlateReading readPlate(const cv::Mat &astPicture) {
+    PetriDish petri = getPetriDish(astPicture);
+    PelletsAndPxPerMm pellets = findPellets(petri.img, petri.isRound);
+    return PlateReading{petri.boundingBox, petri.isRound, pellets.pellets,
+                        pellets.original_img_px_per_mm, false};
+}
+
+PlateReading rereadPlate(const string &astPicturePath,
+                         const PlateReading &previous) {
+    return rereadPlate(imgCache.get(astPicturePath), previous);
+}
+
+PlateReading rereadPlate(const vector<uchar> &encodedAstPicture,
+                         const PlateReading &previous) {
+    return rereadPlate(decodeImage(encodedAstPicture), previous);
+}
+
+static float median(vector<float> values) {
+    auto middle = values.begin() + values.size() / 2;
+    nth_element(values.begin(), middle, values.end());
+    return *middle;
+}
+
+/* Finds the shift (in pixels) of the pellets of a previous reading in a new
+ * picture of the same plate. Returns false if they are not found.
+ *
+ * The picture around the previous Petri dish is registered by phase
+ * correlation with a synthetic image of the pellets (white disks), at low
+ * resolution. The pellets are then searched around their expected positions
+ * in the picture, the shift is corrected with their median offset. */
+static bool registerPellets(const cv::Mat &picture,
+                            const PlateReading &previous,
+                            cv::Point2f &shift) {
+    const cv::Rect &bbox = previous.boundingBox;
+    const cv::Rect pictureRect(0, 0, picture.cols, picture.rows);
+    int margin = (int)(REREAD_SEARCH_MARGIN * max(bbox.width, bbox.height));
+    cv::Rect region = cv::Rect(bbox.x - margin, bbox.y - margin,
+                               bbox.width + 2 * margin,
+                               bbox.height + 2 * margin) &
+                      pictureRect;
+    if (region.area() == 0) return false;
+
+    double scale =
+        min(1.0, (double)REREAD_REGISTRATION_SIZE /
+                     max(region.width, region.height));
+    cv::Mat gray;
+    cv::cvtColor(picture(region), gray, cv::COLOR_BGR2GRAY);
+    cv::resize(gray, gray, cv::Size(0, 0), scale, scale, cv::INTER_AREA);
+    gray.convertTo(gray, CV_32F);
+
+    cv::Mat pellets = cv::Mat::zeros(gray.size(), CV_32F);
+    const cv::Point2f offset(bbox.tl() - region.tl());
+    for (const Pellet &pellet : previous.pellets) {
+        cv::circle(pellets, (pellet.circle.center + offset) * scale,
+                   pellet.circle.radius * scale, cv::Scalar(1), cv::FILLED);
+    }
+    cv::Mat window;
+    cv::createHanningWindow(window, gray.size(), CV_32F);
+    cv::Point2d coarseShift = cv::phaseCorrelate(pellets, gray, window);
+    shift = cv::Point2f(coarseShift.x / scale, coarseShift.y / scale);
+
+    const float mm_per_px = 1 / previous.original_img_px_per_mm;
+    const float maxOffset = REREAD_MAX_PELLET_OFFSET_MM / mm_per_px;
+    vector<float> offsetsX, offsetsY;
+    for (const Pellet &pellet : previous.pellets) {
+        cv::Point2f expected =
+            pellet.circle.center + cv::Point2f(bbox.tl()) + shift;
+        cv::Point center((int)round(expected.x), (int)round(expected.y));
+        if (!pictureRect.contains(center)) continue;
+        try {
+            Circle found =
+                searchOnePellet(picture, center.x, center.y, mm_per_px);
+            cv::Point2f pelletOffset = found.center - expected;
+            if (cv::norm(pelletOffset) <= maxOffset) {
+                offsetsX.push_back(pelletOffset.x);
+                offsetsY.push_back(pelletOffset.y);
+            }
+        } catch (const std::exception &) {
+            // not found
+        }
+    }
+    if (offsetsX.empty() ||
+        offsetsX.size() < REREAD_MIN_FOUND_PELLETS * previous.pellets.size()) {
+        return false;
+    }
+    shift += cv::Point2f(median(offsetsX), median(offsetsY));
+    return true;
+}
+
+PlateReading rereadPlate(const cv::Mat &astPicture,
+                         const PlateReading &previous) {
+    cv::Point2f shift;
+    if (previous.pellets.empty() ||
+        !registerPellets(astPicture, previous, shift)) {
+        return readPlate(astPicture);
+    }
+    // the crop is moved by whole pixels, the pellets by the rest
+    const cv::Point cropShift((int)round(shift.x), (int)round(shift.y));
+    const cv::Point2f pelletShift = shift - cv::Point2f(cropShift);
+    cv::Rect bbox = previous.boundingBox + cropShift;
+    if ((bbox & cv::Rect(0, 0, astPicture.cols, astPicture.rows)) != bbox) {
+        return readPlate(astPicture);
+    }
+
+    PetriDish petri(astPicture(bbox), bbox, previous.isRound);
+    vector<Circle> circles;
+    circles.reserve(previous.pellets.size());
+    for (const Pellet &pellet : previous.pellets) {
+        circles.push_back(
+            Circle(pellet.circle.center + pelletShift, pellet.circle.radius));
+    }
+    InhibDiamPreprocResult preproc = inhib_diam_preprocessing(petri, circles);
+    vector<InhibDisk> disks = measureDiameters(preproc);
+
+    PlateReading reading{bbox, previous.isRound, {},
+                         preproc.original_img_px_per_mm, true};
+    reading.pellets.reserve(circles.size());
+    for (size_t i = 0; i < circles.size(); i++) {
+        reading.pellets.push_back(
+            Pellet{circles[i], disks[i], previous.pellets[i].labelMatch});
+    }
+    return reading;
+}
+
+PlateSession::PlateSession(const string &croppedPetriImgPath,
+                           const vector<Circle> &circles, bool isRound)
+    : PlateSession(imgCache.get(croppedPetriImgPath), circles, isRound) {}
+
+PlateSession::PlateSession(const vector<uchar> &encodedCroppedPetriImg,
+                           const vector<Circle> &circles, bool isRound)
+    : PlateSession(decodeImage(encodedCroppedPetriImg), circles, isRound) {}
+
+PlateSession::PlateSession(const cv::Mat &croppedPetriImg,
+                           const vector<Circle> &circles, bool isRound)
+    : plate(croppedPetriImg),
+      pellets(circles),
+      round(isRound),
+      hasPreproc(false) {}
+
+void PlateSession::setCircles(const vector<Circle> &circles) {
+    pellets = circles;
+}
+
+const InhibDiamPreprocResult &PlateSession::preprocessing() {
+    if (!hasPreproc) {
+        preproc =
+            inhib_diam_preprocessing(plate, round, pellets, &preprocState);
+        hasPreproc = true;
+    } else if (preprocState.plateCircles != pellets) {
+        preproc = update_inhib_diam_preprocessing(preproc, preprocState, plate,
+                                                  round, pellets);
+    }
+    return preproc;
+}
+
+Pellet PlateSession::findPellet(const Circle &circle) {
+    /*
+     * @Brief Get the label and diameter of a new pellet
+     * which has been manually found.
+     *
+     * NOTE: the detection fails if the session has no other pellet,
+     * because the inhibition preprocessing needs to know where the pellets
+     * are.
+     */
+
+    Pellet pellet;
+    pellet.circle = circle;
+    pellets.push_back(circle);
+
+    cv::Mat pelletMat = cutOnePelletInImage(plate.image(), circle);
+    pellet.labelMatch = getOnePelletText(pelletMat);
+
+    pellet.disk = measureOnePelletDiameter(pellets.size() - 1, INSCRIBED);
+    return pellet;
+}
+
+Pellet PlateSession::findPelletFromApproxCoordinates(float centerX,
+                                                     float centerY,
+                                                     float mm_per_px) {
+    const Circle c =
+        searchOnePellet(plate.image(), centerX, centerY, mm_per_px);
+    return findPellet(c);
+}
+
+InhibDisk PlateSession::measureOnePelletDiameter(int pelletIdx,
+                                                 InhibMeasureMode mode) {
+    if (pelletIdx < 0 || pelletIdx >= (int)pellets.size()) {
+        throw astimp::Exception::generic("Pellet index out of range",
+                                         __FILE__, __LINE__);
+    }
+    return measureOneDiameter(preprocessing(), pelletIdx, mode);
+}
+
 float getPelletDiamInMm() { return getConfig()->Pellets.DiamInMillimeters; }
 
 }  // namespace astimp
@@ -20,9 +20,9 @@
 
 #include "astimp.hpp"
 
-const size_t IMG_SIZE = 64;
-
 namespace astimp {
+
+const size_t IMG_SIZE = PELLET_IMG_SIZE;
 Label_match getOnePelletText(const cv::Mat &pelletImg) {
     return PelletLabelRecognitionUsingML::getOnePelletText(pelletImg);
 }
@@ -94,19 +94,28 @@ void copyMatToFloatArray(const cv::Mat &mat, float *output) {
     }
 }
 
-// TODO(jakuba): Run recognition on all inputs at once, not one by one.
 vector<vector<float>> PelletLabelRecognitionUsingML::getPelletModelInputs(
     const vector<cv::Mat> &pelletImages) {
     vector<vector<float>> inputsList;
     inputsList.reserve(pelletImages.size());
-    for (const cv::Mat &pelletImage : pelletImages) {
-        cv::Mat pellet = formatPelletForInference(pelletImage);
-        pellet = mapToCommonSpace(pellet);
-        vector<float> inputs(pellet.rows * pellet.cols);
-        copyMatToFloatArray(pellet, &inputs.front());
-        normalize(&inputs.front(), &inputs.back());
+    for (size_t i = 0; i < pelletImages.size(); i++) {
+        vector<float> inputs(IMG_SIZE * IMG_SIZE);
+        fillPelletModelInputs(pelletImages, i, i + 1, &inputs.front());
         inputsList.emplace_back(inputs);
     }
     return inputsList;
 }
+
+void PelletLabelRecognitionUsingML::fillPelletModelInputs(
+    const vector<cv::Mat> &pelletImages, size_t begin, size_t end,
+    float *inputs) {
+    for (size_t i = begin; i < end; i++) {
+        cv::Mat pellet = formatPelletForInference(pelletImages[i]);
+        pellet = mapToCommonSpace(pellet);
+        size_t size = pellet.rows * pellet.cols;
+        copyMatToFloatArray(pellet, inputs);
+        normalize(inputs, inputs + size - 1);
+        inputs += size;
+    }
+}
 }  // namespace astimp
\ No newline at end of file
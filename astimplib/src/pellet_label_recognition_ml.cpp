@@ -17,12 +17,16 @@
 #include <tensorflow/lite/c/c_api.h>
 
 #include <algorithm>
+#include <condition_variable>
 #include <cstddef>
+#include <mutex>
 #include <numeric>
 #include <opencv2/core/mat.hpp>
+#include <thread>
 #include <utility>
 
 #include "astExceptions.hpp"
+#include "astimp.hpp"
 #include "pellet_label_recognition.hpp"
 #include "pellet_label_tflite_model.hpp"
 
@@ -30,41 +34,254 @@ using namespace std;
 
 namespace astimp {
 
-// Runs the model inference. Returns error string on error. Uses the C language,
-// not C++.
-extern "C" const char *runInference(float *inputs, size_t length,
-                                    float *outputs, size_t outputs_length) {
-    TfLiteModel *model = TfLiteModelCreate(PELLET_LABEL_TFLITE_MODEL,
-                                           PELLET_LABEL_TFLITE_MODEL_SIZE);
+// Process-wide pool of ready-to-use TFLite interpreters.
+// All the interpreters share the same model and options, which are created
+// once when the pool is initialized.
+class InterpreterPool {
+   public:
+    static InterpreterPool &instance() {
+        static InterpreterPool pool;
+        return pool;
+    }
+
+    ~InterpreterPool() {
+        // Process exit: do not wait for interpreters still in use.
+        lock_guard<mutex> lock(mtx);
+        destroyIdle();
+    }
+
+    void init(size_t poolSize) {
+        unique_lock<mutex> lock(mtx);
+        available.wait(lock, [this] { return !shuttingDown; });
+        initLocked(poolSize);
+    }
+
+    TfLiteInterpreter *acquire() {
+        unique_lock<mutex> lock(mtx);
+        available.wait(lock, [this] { return !shuttingDown; });
+        if (model == nullptr) {
+            initLocked(0);
+        }
+
+        TfLiteInterpreter *interpreter = nullptr;
+        if (!idle.empty()) {
+            counters.hits++;
+        } else if (counters.created < capacity) {
+            interpreter = createInterpreter();
+        } else {
+            counters.waits++;
+            available.wait(lock, [this] { return !idle.empty(); });
+        }
+        if (interpreter == nullptr) {
+            interpreter = idle.back();
+            idle.pop_back();
+        }
+        inUse++;
+        return interpreter;
+    }
+
+    void release(TfLiteInterpreter *interpreter) {
+        {
+            lock_guard<mutex> lock(mtx);
+            idle.push_back(interpreter);
+            inUse--;
+        }
+        available.notify_all();
+    }
+
+    void shutdown() {
+        unique_lock<mutex> lock(mtx);
+        available.wait(lock, [this] { return !shuttingDown; });
+        shuttingDown = true;
+        available.wait(lock, [this] { return inUse == 0; });
+        destroyIdle();
+        // the next model may accept batches
+        batchSupported = true;
+        shuttingDown = false;
+        lock.unlock();
+        available.notify_all();
+    }
+
+    InterpreterPoolStats stats() {
+        lock_guard<mutex> lock(mtx);
+        return counters;
+    }
+
+    void countBatchedInvoke() {
+        lock_guard<mutex> lock(mtx);
+        counters.batchedInvokes++;
+    }
+
+    bool batchInferenceSupported() {
+        lock_guard<mutex> lock(mtx);
+        return batchSupported;
+    }
+
+    // Called when the input tensor of the model cannot be resized to batches
+    // of more than one pellet: they are labelled one at a time until the pool
+    // is shut down.
+    void disableBatchInference() {
+        lock_guard<mutex> lock(mtx);
+        batchSupported = false;
+        counters.batchFallbacks++;
+    }
+
+   private:
+    mutex mtx;
+    condition_variable available;
+    TfLiteModel *model = nullptr;
+    TfLiteInterpreterOptions *options = nullptr;
+    vector<TfLiteInterpreter *> idle;
+    size_t capacity = 0;
+    size_t inUse = 0;
+    bool shuttingDown = false;
+    bool batchSupported = true;
+    InterpreterPoolStats counters{0, 0, 0, 0, 0};
+
+    InterpreterPool() = default;
+    InterpreterPool(const InterpreterPool &) = delete;
+    InterpreterPool &operator=(const InterpreterPool &) = delete;
+
+    void initLocked(size_t poolSize) {
+        if (model != nullptr) {
+            // already initialized
+            return;
+        }
+        const ImprocConfig *config = getConfig();
+        if (poolSize == 0) {
+            poolSize = max(config->Labels.interpreterPoolSize, 0);
+        }
+        if (poolSize == 0) {
+            poolSize = max(thread::hardware_concurrency(), 1u);
+        }
+
+        model = TfLiteModelCreate(PELLET_LABEL_TFLITE_MODEL,
+                                  PELLET_LABEL_TFLITE_MODEL_SIZE);
+        if (model == nullptr) {
+            throw astimp::Exception::generic("TfLiteModelCreate", __FILE__,
+                                             __LINE__);
+        }
+        options = TfLiteInterpreterOptionsCreate();
+        TfLiteInterpreterOptionsSetNumThreads(
+            options, config->Labels.interpreterNumThreads);
+        capacity = poolSize;
+        counters = InterpreterPoolStats{0, 0, 0, 0, 0};
+    }
+
+    // Must be called with the lock held.
+    TfLiteInterpreter *createInterpreter() {
+        TfLiteInterpreter *interpreter = TfLiteInterpreterCreate(model, options);
+        if (interpreter == nullptr) {
+            throw astimp::Exception::generic("TfLiteInterpreterCreate",
+                                             __FILE__, __LINE__);
+        }
+        if (TfLiteInterpreterAllocateTensors(interpreter) == kTfLiteError) {
+            TfLiteInterpreterDelete(interpreter);
+            throw astimp::Exception::generic(
+                "TfLiteInterpreterAllocateTensors", __FILE__, __LINE__);
+        }
+        counters.created++;
+        return interpreter;
+    }
+
+    // Must be called with the lock held and no interpreter in use.
+    void destroyIdle() {
+        for (TfLiteInterpreter *interpreter : idle) {
+            TfLiteInterpreterDelete(interpreter);
+        }
+        idle.clear();
+        if (options != nullptr) {
+            TfLiteInterpreterOptionsDelete(options);
+            options = nullptr;
+        }
+        if (model != nullptr) {
+            TfLiteModelDelete(model);
+            model = nullptr;
+        }
+        capacity = 0;
+    }
+};
+
+// Holds an interpreter of the pool for the lifetime of the object.
+class InterpreterLease {
+   public:
+    InterpreterLease()
+        : interpreter(InterpreterPool::instance().acquire()){};
+    ~InterpreterLease() { InterpreterPool::instance().release(interpreter); }
 
-    TfLiteInterpreterOptions *options = TfLiteInterpreterOptionsCreate();
-    TfLiteInterpreterOptionsSetNumThreads(options, 2);
-    TfLiteInterpreter *interpreter = TfLiteInterpreterCreate(model, options);
+    TfLiteInterpreter *get() const { return interpreter; }
 
+   private:
+    TfLiteInterpreter *interpreter;
+
+    InterpreterLease(const InterpreterLease &) = delete;
+    InterpreterLease &operator=(const InterpreterLease &) = delete;
+};
+
+// Resizes the input tensor of the model to batchSize pellets if needed.
+// Returns error string on error.
+const char *resizeInputTensor(TfLiteInterpreter *interpreter, int batchSize) {
+    TfLiteTensor *input_tensor =
+        TfLiteInterpreterGetInputTensor(interpreter, 0);
+    if (TfLiteTensorDim(input_tensor, 0) == batchSize) {
+        return nullptr;
+    }
+    vector<int> dims(TfLiteTensorNumDims(input_tensor));
+    dims[0] = batchSize;
+    for (size_t i = 1; i < dims.size(); i++) {
+        dims[i] = TfLiteTensorDim(input_tensor, i);
+    }
+    if (TfLiteInterpreterResizeInputTensor(interpreter, 0, &dims.front(),
+                                           dims.size()) == kTfLiteError) {
+        return "TfLiteInterpreterResizeInputTensor";
+    }
     if (TfLiteInterpreterAllocateTensors(interpreter) == kTfLiteError) {
         return "TfLiteInterpreterAllocateTensors";
     }
+    return nullptr;
+}
 
+// Runs the model on the pellet images in [begin, end) with a single
+// invocation. The input tensor is resized to the batch size if needed and the
+// model inputs are written directly into it. Returns error string on error.
+const char *runInference(TfLiteInterpreter *interpreter,
+                         const vector<cv::Mat> &pelletImages, size_t begin,
+                         size_t end, float *outputs, size_t outputs_length) {
+    int batchSize = (int)(end - begin);
+    const char *error = resizeInputTensor(interpreter, batchSize);
+    if (error != nullptr) {
+        return error;
+    }
+    // the tensors may have been reallocated
     TfLiteTensor *input_tensor =
         TfLiteInterpreterGetInputTensor(interpreter, 0);
-    if (TfLiteTensorCopyFromBuffer(input_tensor, inputs,
-                                   length * sizeof(float)) == kTfLiteError) {
-        return "TfLiteTensorCopyFromBuffer";
+
+    size_t pelletInputSize = PELLET_IMG_SIZE * PELLET_IMG_SIZE;
+    if (TfLiteTensorType(input_tensor) != kTfLiteFloat32 ||
+        TfLiteTensorByteSize(input_tensor) !=
+            batchSize * pelletInputSize * sizeof(float)) {
+        return "Unexpected model input tensor";
     }
+    PelletLabelRecognitionUsingML::fillPelletModelInputs(
+        pelletImages, begin, end,
+        static_cast<float *>(TfLiteTensorData(input_tensor)));
+
     if (TfLiteInterpreterInvoke(interpreter) == kTfLiteError) {
         return "TfLiteInterpreterInvoke";
     }
+    if (batchSize > 1) {
+        InterpreterPool::instance().countBatchedInvoke();
+    }
     const TfLiteTensor *output_tensor =
         TfLiteInterpreterGetOutputTensor(interpreter, 0);
+    if (TfLiteTensorByteSize(output_tensor) != outputs_length * sizeof(float)) {
+        return "Unexpected model output tensor";
+    }
     if (TfLiteTensorCopyToBuffer(output_tensor, outputs,
                                  outputs_length * sizeof(float)) ==
         kTfLiteError) {
         return "TfLiteTensorCopyToBuffer";
     }
-
-    TfLiteInterpreterDelete(interpreter);
-    TfLiteInterpreterOptionsDelete(options);
-    TfLiteModelDelete(model);
     return nullptr;
 }
 
@@ -80,18 +297,41 @@ Label_match getMatch(const vector<float> &outputs) {
     return Label_match(labels_and_confidence);
 }
 
-// TODO(jakuba): Run recognition on all inputs at once, not one by one.
 vector<Label_match> PelletLabelRecognitionUsingML::getPelletsText(
     const vector<cv::Mat> &pelletImages) {
     vector<Label_match> results;
-    vector<float> outputs(PELLET_LABELS.size());
-    for (vector<float> inputs : getPelletModelInputs(pelletImages)) {
-        const char *error = runInference(&inputs.front(), inputs.size(),
+    results.reserve(pelletImages.size());
+    size_t n_labels = PELLET_LABELS.size();
+    size_t maxBatchSize = 1;
+    if (InterpreterPool::instance().batchInferenceSupported()) {
+        maxBatchSize = max(getConfig()->Labels.maxInferenceBatchSize, 1);
+    }
+
+    InterpreterLease lease;
+    vector<float> outputs;
+    size_t begin = 0;
+    while (begin < pelletImages.size()) {
+        size_t end = min(begin + maxBatchSize, pelletImages.size());
+        if (end - begin > 1 &&
+            resizeInputTensor(lease.get(), (int)(end - begin)) != nullptr) {
+            // The model does not accept this batch size:
+            // label one pellet at a time from now on.
+            InterpreterPool::instance().disableBatchInference();
+            maxBatchSize = 1;
+            end = begin + 1;
+        }
+        outputs.resize((end - begin) * n_labels);
+        const char *error = runInference(lease.get(), pelletImages, begin, end,
                                          &outputs.front(), outputs.size());
         if (error != nullptr) {
             throw astimp::Exception::generic(error, __FILE__, __LINE__);
         }
-        results.emplace_back(getMatch(outputs));
+        for (size_t i = 0; i < end - begin; i++) {
+            results.emplace_back(getMatch(
+                vector<float>(outputs.begin() + i * n_labels,
+                              outputs.begin() + (i + 1) * n_labels)));
+        }
+        begin = end;
     }
     return results;
 }
@@ -100,4 +340,16 @@ Label_match PelletLabelRecognitionUsingML::getOnePelletText(
     const cv::Mat &pelletImage) {
     return getPelletsText({std::move(pelletImage)})[0];
 }
+
+void PelletLabelRecognitionUsingML::initInterpreterPool(size_t poolSize) {
+    InterpreterPool::instance().init(poolSize);
+}
+
+void PelletLabelRecognitionUsingML::shutdownInterpreterPool() {
+    InterpreterPool::instance().shutdown();
+}
+
+InterpreterPoolStats PelletLabelRecognitionUsingML::getInterpreterPoolStats() {
+    return InterpreterPool::instance().stats();
+}
 }  // namespace astimp
\ No newline at end of file
@@ -0,0 +1,180 @@
+// Copyright 2019 Copyright 2019 The ASTapp Consortium
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    <http://www.apache.org/licenses/LICENSE-2.0>
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+
+#include "petri_dish_rig.hpp"
+
+#include <cmath>
+
+namespace astimp {
+
+// Gradient magnitude of a picture, at the resolution of the GrabCut of
+// getPetriDish. scale is set to the resize factor.
+static cv::Mat edges(const cv::Mat &astPicture, double &scale) {
+    int maxSize = getConfig()->PetriDish.MaxSize;
+    scale = min(1.0, (double)maxSize / max(astPicture.cols, astPicture.rows));
+    cv::Mat gray, dx, dy, magnitude;
+    cv::cvtColor(astPicture, gray, cv::COLOR_BGR2GRAY);
+    cv::resize(gray, gray, cv::Size(0, 0), scale, scale, cv::INTER_AREA);
+    cv::GaussianBlur(gray, gray, cv::Size(3, 3), 0);
+    cv::Sobel(gray, dx, CV_32F, 1, 0);
+    cv::Sobel(gray, dy, CV_32F, 0, 1);
+    cv::magnitude(dx, dy, magnitude);
+    return magnitude;
+}
+
+// Points of the border of a Petri dish in box: the inscribed ellipse if the
+// dish is round, the box otherwise. One point per pixel of border.
+static vector<cv::Point2f> border(const cv::Rect2f &box, bool isRound) {
+    vector<cv::Point2f> points;
+    if (isRound) {
+        const cv::Point2f center(box.x + box.width / 2, box.y + box.height / 2);
+        const float a = box.width / 2, b = box.height / 2;
+        // Ramanujan's approximation of the perimeter
+        const int n = max(
+            16, (int)(CV_PI * (3 * (a + b) - sqrt((3 * a + b) * (a + 3 * b)))));
+        for (int i = 0; i < n; i++) {
+            double t = 2 * CV_PI * i / n;
+            points.emplace_back(center.x + a * cos(t), center.y + b * sin(t));
+        }
+    } else {
+        for (float x = box.x; x <= box.x + box.width; x++) {
+            points.emplace_back(x, box.y);
+            points.emplace_back(x, box.y + box.height);
+        }
+        for (float y = box.y + 1; y < box.y + box.height; y++) {
+            points.emplace_back(box.x, y);
+            points.emplace_back(box.x + box.width, y);
+        }
+    }
+    return points;
+}
+
+// Mean of the edges along a border moved by shift, relative to the mean of
+// all the edges.
+static float borderScore(const cv::Mat &edges,
+                         const vector<cv::Point2f> &border,
+                         const cv::Point &shift, float meanEdge) {
+    double sum = 0;
+    size_t count = 0;
+    for (const cv::Point2f &point : border) {
+        int x = (int)round(point.x) + shift.x;
+        int y = (int)round(point.y) + shift.y;
+        if (x < 0 || y < 0 || x >= edges.cols || y >= edges.rows) continue;
+        sum += edges.at<float>(y, x);
+        count++;
+    }
+    if (count == 0 || meanEdge <= 0) return 0;
+    return sum / count / meanEdge;
+}
+
+// Edge score of the border of the Petri dish in bbox. If aligned is not
+// null, it is set to false if the border is better aligned with the edges
+// when moved by more than RIG_MAX_SHIFT pixels.
+static float rigScore(const cv::Mat &astPicture, const cv::Rect &bbox,
+                      bool isRound, bool *aligned = nullptr) {
+    double scale;
+    cv::Mat magnitude = edges(astPicture, scale);
+    const float meanEdge = cv::mean(magnitude)[0];
+    const cv::Rect2f box(bbox.x * scale, bbox.y * scale, bbox.width * scale,
+                         bbox.height * scale);
+    const vector<cv::Point2f> points = border(box, isRound);
+
+    const float score =
+        borderScore(magnitude, points, cv::Point(0, 0), meanEdge);
+    if (aligned != nullptr) {
+        *aligned = true;
+        for (int dy = -RIG_SHIFT_SEARCH; dy <= RIG_SHIFT_SEARCH; dy++) {
+            for (int dx = -RIG_SHIFT_SEARCH; dx <= RIG_SHIFT_SEARCH; dx++) {
+                if (abs(dx) <= RIG_MAX_SHIFT && abs(dy) <= RIG_MAX_SHIFT) {
+                    continue;
+                }
+                if (borderScore(magnitude, points, cv::Point(dx, dy),
+                                meanEdge) > score) {
+                    *aligned = false;
+                }
+            }
+        }
+    }
+    return score;
+}
+
+PetriDishRig::PetriDishRig(const cv::Mat &astPicture) {
+    calibrate(astPicture);
+}
+
+void PetriDishRig::setCalibration(const cv::Mat &astPicture,
+                                  const PetriDish &petri) {
+    float score = rigScore(astPicture, petri.boundingBox, petri.isRound);
+    lock_guard<mutex> lock(mtx);
+    calibration = Calibration{true, astPicture.size(), petri.boundingBox,
+                              petri.isRound, score};
+}
+
+PetriDish PetriDishRig::calibrate(const cv::Mat &astPicture) {
+    PetriDish petri = astimp::getPetriDish(astPicture);
+    setCalibration(astPicture, petri);
+    return petri;
+}
+
+bool PetriDishRig::isCalibrated() {
+    lock_guard<mutex> lock(mtx);
+    return calibration.done;
+}
+
+cv::Rect PetriDishRig::boundingBox() {
+    lock_guard<mutex> lock(mtx);
+    return calibration.done ? calibration.boundingBox : cv::Rect();
+}
+
+PetriDish PetriDishRig::getPetriDish(const cv::Mat &astPicture) {
+    Calibration current;
+    {
+        lock_guard<mutex> lock(mtx);
+        current = calibration;
+    }
+
+    if (current.done && current.pictureSize == astPicture.size()) {
+        bool aligned;
+        float score = rigScore(astPicture, current.boundingBox,
+                               current.isRound, &aligned);
+        if (aligned && score >= RIG_MIN_SCORE_RATIO * current.score) {
+            {
+                lock_guard<mutex> lock(mtx);
+                counters.fastPath++;
+            }
+            return PetriDish(astPicture(current.boundingBox).clone(),
+                             current.boundingBox, current.isRound);
+        }
+    }
+
+    PetriDish petri = astimp::getPetriDish(astPicture);
+    setCalibration(astPicture, petri);
+    lock_guard<mutex> lock(mtx);
+    counters.grabCut++;
+    if (current.done) counters.recalibrations++;
+    return petri;
+}
+
+RigStats PetriDishRig::stats() {
+    lock_guard<mutex> lock(mtx);
+    return counters;
+}
+
+void PetriDishRig::resetStats() {
+    lock_guard<mutex> lock(mtx);
+    counters = RigStats{0, 0, 0};
+}
+
+}  // namespace astimp
@@ -0,0 +1,242 @@
+// Copyright 2019 Copyright 2019 The ASTapp Consortium
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    <http://www.apache.org/licenses/LICENSE-2.0>
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include "plate_analysis.hpp"
+
+#include <algorithm>
+#include <opencv2/highgui/highgui.hpp>
+
+namespace astimp {
+
+PlateAnalysisPool::PlateAnalysisPool(int numWorkers, bool keepImages)
+    : config(*getConfig()), keepImages(keepImages) {
+    start(numWorkers);
+}
+
+PlateAnalysisPool::PlateAnalysisPool(int numWorkers,
+                                     const ImprocConfig &config,
+                                     bool keepImages)
+    : config(config), keepImages(keepImages) {
+    start(numWorkers);
+}
+
+void PlateAnalysisPool::start(int numWorkers) {
+    if (numWorkers <= 0) {
+        numWorkers = max(1, (int)thread::hardware_concurrency());
+    }
+    labeller = thread(&PlateAnalysisPool::labelLoop, this);
+    for (int i = 0; i < numWorkers; i++) {
+        workers.emplace_back(&PlateAnalysisPool::workerLoop, this);
+    }
+}
+
+PlateAnalysisPool::~PlateAnalysisPool() {
+    {
+        lock_guard<mutex> lock(mtx);
+        stopWorkers = true;
+        jobs.clear();
+    }
+    jobAvailable.notify_all();
+    for (thread &worker : workers) worker.join();
+
+    // the workers may have waited for labels until now
+    {
+        lock_guard<mutex> lock(mtx);
+        stopLabels = true;
+    }
+    labelRequestAvailable.notify_all();
+    labeller.join();
+}
+
+size_t PlateAnalysisPool::push(Job job) {
+    size_t index;
+    {
+        lock_guard<mutex> lock(mtx);
+        index = job.index = submitted++;
+        jobs.push_back(move(job));
+    }
+    jobAvailable.notify_one();
+    return index;
+}
+
+size_t PlateAnalysisPool::submit(const cv::Mat &img) {
+    return push(Job{0, img, "", {}});
+}
+
+size_t PlateAnalysisPool::submitPath(const string &path) {
+    return push(Job{0, cv::Mat(), path, {}});
+}
+
+size_t PlateAnalysisPool::submitBytes(const uchar *data, size_t size) {
+    return push(Job{0, cv::Mat(), "", vector<uchar>(data, data + size)});
+}
+
+bool PlateAnalysisPool::next(PlateAnalysis &result) {
+    unique_lock<mutex> lock(mtx);
+    resultAvailable.wait(
+        lock, [this]() { return !results.empty() || returned == submitted; });
+    if (results.empty()) return false;
+    result = move(results.front());
+    results.pop_front();
+    returned++;
+    return true;
+}
+
+size_t PlateAnalysisPool::inFlight() {
+    lock_guard<mutex> lock(mtx);
+    return submitted - returned;
+}
+
+void PlateAnalysisPool::workerLoop() {
+    ScopedConfig scope(config);
+    while (true) {
+        Job job;
+        {
+            unique_lock<mutex> lock(mtx);
+            jobAvailable.wait(
+                lock, [this]() { return stopWorkers || !jobs.empty(); });
+            if (stopWorkers) return;
+            job = move(jobs.front());
+            jobs.pop_front();
+        }
+        PlateAnalysis result = analyze(job);
+        job = Job();  // release the input before waiting for the next one
+        {
+            lock_guard<mutex> lock(mtx);
+            results.push_back(move(result));
+        }
+        resultAvailable.notify_all();
+    }
+}
+
+PlateAnalysis PlateAnalysisPool::analyze(const Job &job) {
+    PlateAnalysis result;
+    result.index = job.index;
+    result.ok = true;
+    result.pxPerMm = 0;
+    try {
+        cv::Mat img = job.img;
+        if (!job.path.empty()) {
+            img = cv::imread(job.path, cv::IMREAD_COLOR);
+            if (img.empty()) {
+                throw astimp::Exception::generic(
+                    "Failed to read image " + job.path, __FILE__, __LINE__);
+            }
+        } else if (!job.encoded.empty()) {
+            img = cv::imdecode(job.encoded, cv::IMREAD_COLOR);
+            if (img.empty()) {
+                throw astimp::Exception::generic("Failed to decode image",
+                                                 __FILE__, __LINE__);
+            }
+        }
+
+        result.petri = getPetriDish(img);
+        // images derived from the crop, shared by the next stages
+        PlateContext plate(result.petri.img);
+        result.circles = find_atb_pellets(plate);
+        if (result.circles.empty()) {
+            if (!keepImages) result.petri.img = cv::Mat();
+            return result;
+        }
+
+        // the labels are recognized by the label thread, in the meantime the
+        // inhibition zones are measured
+        vector<cv::Mat> pellets;
+        pellets.reserve(result.circles.size());
+        for (const Circle &circle : result.circles) {
+            pellets.push_back(cutOnePelletInImage(result.petri.img, circle));
+        }
+        future<vector<Label_match>> labels = requestLabels(move(pellets));
+
+        result.preproc = inhib_diam_preprocessing(plate, result.petri.isRound,
+                                                  result.circles);
+        result.pxPerMm = result.preproc.original_img_px_per_mm;
+        result.disks = measureDiameters(result.preproc);
+        result.labels = labels.get();
+        if (!keepImages) {
+            result.petri.img = cv::Mat();
+            result.preproc = InhibDiamPreprocResult();
+        }
+    } catch (const std::exception &e) {
+        result.ok = false;
+        result.error = e.what();
+    } catch (...) {
+        result.ok = false;
+        result.error = "unknown error";
+    }
+    return result;
+}
+
+future<vector<Label_match>> PlateAnalysisPool::requestLabels(
+    vector<cv::Mat> pellets) {
+    LabelRequest request;
+    request.pellets = move(pellets);
+    future<vector<Label_match>> labels = request.labels.get_future();
+    {
+        lock_guard<mutex> lock(mtx);
+        labelRequests.push_back(move(request));
+    }
+    labelRequestAvailable.notify_one();
+    return labels;
+}
+
+void PlateAnalysisPool::labelLoop() {
+    ScopedConfig scope(config);
+    const size_t maxBatchSize =
+        (size_t)max(config.Labels.maxInferenceBatchSize, 1);
+    while (true) {
+        // take the waiting requests, up to maxBatchSize pellets (at least one
+        // request)
+        vector<LabelRequest> batch;
+        size_t batchSize = 0;
+        {
+            unique_lock<mutex> lock(mtx);
+            labelRequestAvailable.wait(lock, [this]() {
+                return stopLabels || !labelRequests.empty();
+            });
+            if (labelRequests.empty()) return;
+            do {
+                batchSize += labelRequests.front().pellets.size();
+                batch.push_back(move(labelRequests.front()));
+                labelRequests.pop_front();
+            } while (!labelRequests.empty() &&
+                     batchSize + labelRequests.front().pellets.size() <=
+                         maxBatchSize);
+        }
+
+        vector<cv::Mat> pellets;
+        pellets.reserve(batchSize);
+        for (const LabelRequest &request : batch) {
+            pellets.insert(pellets.end(), request.pellets.begin(),
+                           request.pellets.end());
+        }
+        vector<Label_match> labels;
+        try {
+            labels = getPelletsText(pellets);
+        } catch (...) {
+            for (LabelRequest &request : batch) {
+                request.labels.set_exception(current_exception());
+            }
+            continue;
+        }
+        auto first = labels.begin();
+        for (LabelRequest &request : batch) {
+            auto last = first + request.pellets.size();
+            request.labels.set_value(vector<Label_match>(first, last));
+            first = last;
+        }
+    }
+}
+
+}  // namespace astimp
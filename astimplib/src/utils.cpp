@@ -20,8 +20,12 @@
 #include "utils.hpp"
 
 #include <array>
+#include <exception>
 #include <cmath>
 #include <iostream>
+#include <list>
+#include <mutex>
+#include <unordered_map>
 #include <opencv2/core.hpp>
 #include <opencv2/imgproc.hpp>
 
@@ -74,6 +78,93 @@ vector<vector<uint>> r_matrix(int s) {
     // cout << temp << endl;
 }
 
+// Max number of radial indexes kept in cache.
+const size_t RADIAL_INDEX_CACHE_SIZE = 64;
+
+void parallel_for_each_index(size_t n, int maxThreads,
+                             const function<void(size_t)> &f) {
+    if (n == 0) return;
+    vector<exception_ptr> errors(n);
+    double nstripes = maxThreads > 0 ? min((size_t)maxThreads, n) : -1;
+    // the tasks run with the configuration of the calling thread
+    const astimp::ImprocConfig *config = astimp::getConfig();
+    cv::parallel_for_(
+        cv::Range(0, (int)n),
+        [&](const cv::Range &range) {
+            astimp::ScopedConfig scope(*config);
+            for (int i = range.start; i < range.end; i++) {
+                try {
+                    f(i);
+                } catch (...) {
+                    errors[i] = current_exception();
+                }
+            }
+        },
+        nstripes);
+    for (const exception_ptr &error : errors) {
+        if (error) rethrow_exception(error);
+    }
+}
+
+shared_ptr<const RadialIndex> buildRadialIndex(int s) {
+    vector<vector<uint>> R = r_matrix(s);
+    uint max_r = s / 2;
+
+    auto index = make_shared<RadialIndex>();
+    index->size = s;
+    // count the pixels at each radius, then place them
+    index->radiusBegin.assign(max_r + 2, 0);
+    for (int i = 0; i < s; i++) {
+        for (int j = 0; j < s; j++) {
+            if (R[i][j] <= max_r) index->radiusBegin[R[i][j] + 1]++;
+        }
+    }
+    for (uint r = 0; r <= max_r; r++) {
+        index->radiusBegin[r + 1] += index->radiusBegin[r];
+    }
+    index->pixels.resize(index->radiusBegin[max_r + 1]);
+    vector<uint> next(index->radiusBegin.begin(), index->radiusBegin.end() - 1);
+    for (int i = 0; i < s; i++) {
+        for (int j = 0; j < s; j++) {
+            if (R[i][j] <= max_r) index->pixels[next[R[i][j]]++] = {j, i};
+        }
+    }
+    return index;
+}
+
+shared_ptr<const RadialIndex> getRadialIndex(int s) {
+    static mutex cacheMutex;
+    // least recently used sizes first
+    static list<int> usage;
+    static unordered_map<int, pair<shared_ptr<const RadialIndex>,
+                                   list<int>::iterator>>
+        cache;
+
+    {
+        lock_guard<mutex> lock(cacheMutex);
+        auto found = cache.find(s);
+        if (found != cache.end()) {
+            usage.splice(usage.end(), usage, found->second.second);
+            return found->second.first;
+        }
+    }
+
+    shared_ptr<const RadialIndex> index = buildRadialIndex(s);
+
+    lock_guard<mutex> lock(cacheMutex);
+    auto found = cache.find(s);
+    if (found != cache.end()) {
+        // another thread built the same index in the meantime
+        return found->second.first;
+    }
+    if (cache.size() >= RADIAL_INDEX_CACHE_SIZE) {
+        cache.erase(usage.front());
+        usage.pop_front();
+    }
+    cache[s] = make_pair(index, usage.insert(usage.end(), s));
+    return index;
+}
+
 vector<vector<float>> distance_matrix_2d(
     const vector<astimp::Circle> &circles) {
     /* return the distance matrix of the Circles centers */
@@ -147,6 +238,22 @@ vector<int> masked_k_means(cv::Mat img, int k) {
     // intensity values in img (a CV_32F image).
     // pixels with value -1 are ignored
     cv::Mat temp = img.reshape(0, 1);
+    const auto &settings = astimp::getConfig()->Inhibition;
+
+    if (settings.kmeansEngine == astimp::KMEANS_HISTOGRAM && k == 2) {
+        // histogram of the non negative values, scaled to [0, 255]
+        vector<uint> hist(UCHAR_MAX + 1, 0);
+        float this_value{};
+        for (int j = 0; j < temp.rows * temp.cols; ++j) {
+            this_value = temp.at<float>(j);
+            if (this_value >= 0) {
+                int v = (int)round(this_value * UCHAR_MAX);
+                hist[min(max(v, 0), UCHAR_MAX)]++;
+            }
+        }
+        return histogram_2_means(hist);
+    }
+
     // temp.convertTo(temp, CV_32F);
     uint non_negative_n = 0;
     // count non negative values
@@ -167,7 +274,7 @@ vector<int> masked_k_means(cv::Mat img, int k) {
         }
     }
     // apply k-means
-    int kmeans_attempts = 10;
+    int kmeans_attempts = max(settings.kmeansNumAttempts, 1);
     cv::Mat labels;
     vector<int> km_centers;
     cv::kmeans(
@@ -181,4 +288,80 @@ vector<int> masked_k_means(cv::Mat img, int k) {
     return km_centers;
 }
 
+vector<int> histogram_2_means(const vector<uint> &hist) {
+    // Two clusters of 1-D values are always separated by a threshold: try
+    // them all with cumulative counts and sums. The squared error of a split
+    // is sum(x^2) - s0^2/n0 - s1^2/n1, so the best split maximizes
+    // s0^2/n0 + s1^2/n1.
+    double n = 0, s = 0;
+    for (size_t v = 0; v < hist.size(); v++) {
+        n += hist[v];
+        s += (double)v * hist[v];
+    }
+
+    double n0 = 0, s0 = 0;
+    double best_score = -1;
+    double best_n0 = 0, best_s0 = 0;
+    for (size_t v = 0; v + 1 < hist.size(); v++) {
+        // values <= v go to the first cluster
+        n0 += hist[v];
+        s0 += (double)v * hist[v];
+        double n1 = n - n0;
+        if (n0 == 0 || n1 == 0) continue;
+        double s1 = s - s0;
+        double score = s0 * s0 / n0 + s1 * s1 / n1;
+        if (score > best_score) {
+            best_score = score;
+            best_n0 = n0;
+            best_s0 = s0;
+        }
+    }
+    if (n < 2) {
+        throw astimp::Exception::generic(
+            "histogram_2_means() needs at least 2 values", __FILE__, __LINE__);
+    }
+    if (best_score < 0) {
+        // all the values are equal
+        int center = cvRound(s / n);
+        return {center, center};
+    }
+
+    return {cvRound(best_s0 / best_n0),
+            cvRound((s - best_s0) / (n - best_n0))};
+}
+
+size_t fitStepFunction(vector<float>::const_iterator first,
+                       vector<float>::const_iterator last, float lv, float hv,
+                       double *mse) {
+    size_t n = last - first;
+    if (n == 0) {
+        throw astimp::Exception::generic(
+            "fitStepFunction() was given an empty profile", __FILE__,
+            __LINE__);
+    }
+
+    // Cumulative square errors from lv and from hv, so that the error of any
+    // step position is obtained in constant time.
+    vector<long long> se_lv(n + 1, 0);
+    vector<long long> se_hv(n + 1, 0);
+    for (size_t i = 0; i < n; i++) {
+        se_lv[i + 1] = se_lv[i] + (long long)pow(first[i] - lv, 2);
+        se_hv[i + 1] = se_hv[i] + (long long)pow(first[i] - hv, 2);
+    }
+
+    size_t step = 0;
+    double best_mse = (double)se_hv[n] / n;
+    for (size_t i = 1; i < n; i++) {
+        double inhib_err = se_lv[i];
+        double bacteria_err = se_hv[n] - se_hv[i];
+        double curr_mse = (inhib_err + bacteria_err) / n;
+        if (curr_mse < best_mse) {
+            best_mse = curr_mse;
+            step = i;
+        }
+    }
+    if (mse != nullptr) *mse = best_mse;
+    return step;
+}
+
 #endif  // ASTIMP_UTILS
\ No newline at end of file
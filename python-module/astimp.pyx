@@ -22,6 +22,8 @@ from opencv_mat import PyMat
 cimport astimplib
 from libcpp.string cimport string
 from collections import namedtuple
+import numpy as np
+import os
 from cython.operator import dereference
 
 from astimp_tools.datamodels import AST, Antibiotic
@@ -59,6 +61,15 @@ class PROFILE_ALGO:
     MAXAVERAGE = astimplib.PROFILE_MAXAVERAGE
     SWITCH = astimplib.PROFILE_SWITCH
 
+class CROP_ENGINE:
+    GRABCUT = astimplib.CROP_GRABCUT
+    CIRCLE_FIT = astimplib.CROP_CIRCLE_FIT
+    AUTO = astimplib.CROP_AUTO
+
+class KMEANS_ENGINE:
+    OPENCV = astimplib.KMEANS_OPENCV
+    HISTOGRAM = astimplib.KMEANS_HISTOGRAM
+
 class INHIB_MEASURE_MODE:
     INSCRIBED = astimplib.INSCRIBED
     CIRCUMSCRIBED = astimplib.CIRCUMSCRIBED
@@ -66,24 +77,36 @@ class INHIB_MEASURE_MODE:
  ######################
  ## astimp wrappers
  ######################
-    
-def find_atb_pellets(nparray):
+
+# The images are RGB arrays (e.g. read with imageio). Arrays in BGR order
+# (e.g. read with cv2.imread) must be given with channel_order="BGR".
+
+def find_atb_pellets(nparray, ImprocConfig config=None, channel_order="RGB"):
     cdef vector[astimplib.Circle] v
     cdef Mat m
     cdef astimplib.Circle c
-    m = np2Mat(nparray)
-    v = astimplib.find_atb_pellets(m)
+    cdef const astimplib.ImprocConfig *c_config = config_ptr(config)
+    m = np2Mat(nparray, channel_order)
+    with nogil:
+        if c_config == NULL:
+            v = astimplib.find_atb_pellets(m)
+        else:
+            v = astimplib.find_atb_pellets(m, c_config[0])
     out = [Circle((c.center.x, c.center.y), c.radius) for c in v]
     return out
 
-def cutOnePelletInImage(nparray, circle):
-    cdef Mat m = np2Mat(nparray)
+def cutOnePelletInImage(nparray, circle, channel_order="RGB"):
+    """image of the pellet at circle, in the channel order of nparray"""
+    cdef Mat m = np2Mat(nparray, channel_order)
     cdef astimplib.Circle c = py2circle(circle)
-    return Mat2np(astimplib.cutOnePelletInImage(m, c, clone=True))
+    cdef Mat pellet
+    with nogil:
+        pellet = astimplib.cutOnePelletInImage(m, c, True)
+    return Mat2np(pellet, channel_order)
 
-def identity(nparray):
-    cdef Mat m = np2Mat(nparray)
-    return Mat2np(m)
+def identity(nparray, channel_order="RGB"):
+    cdef Mat m = np2Mat(nparray, channel_order)
+    return Mat2np(m, channel_order)
 
 def get_mm_per_px(circles):
     cdef vector[astimplib.Circle] ccircles
@@ -93,27 +116,89 @@ def get_mm_per_px(circles):
 
     return astimplib.get_mm_per_px(ccircles)
 
-def getOnePelletText(nparray):
-    cdef Mat m = np2Mat(nparray)
+def getOnePelletText(nparray, channel_order="RGB"):
+    cdef Mat m = np2Mat(nparray, channel_order)
     cdef astimplib.Label_match lm
-    lm = astimplib.getOnePelletText(m)
-    top_label_and_confidence = dereference(lm.labelsAndConfidence.begin())
-    return Pellet_match(top_label_and_confidence.label.decode('UTF-8'),
-        top_label_and_confidence.confidence)
+    with nogil:
+        lm = astimplib.getOnePelletText(m)
+    return label_match_to_py(lm)
+
+def inhib_diam_preprocessing(petri_dish, circles, ImprocConfig config=None, keep_state=False):
+    """preprocessing of the inhibition zones of petri_dish.
 
-def inhib_diam_preprocessing(petri_dish, circles):
+    With keep_state, the result also holds the intermediate images (as large
+    as the image of the plate) that update_inhib_diam_preprocessing needs.
+    """
     cdef astimplib.PetriDish petri_c = petriDish_to_c(petri_dish)
     cdef vector[astimplib.Circle] c_circles
     cdef vector[astimplib.InhibDisk] inhib 
     cdef astimplib.InhibDiamPreprocResult preproc
+    cdef astimplib.InhibPreprocState state
+    cdef astimplib.InhibPreprocState *state_ptr = &state if keep_state else NULL
+    cdef const astimplib.ImprocConfig *c_config = config_ptr(config)
     for pc in circles:
         c_circles.push_back(py2circle(pc))
-    preproc = astimplib.inhib_diam_preprocessing(petri_c,c_circles)
-    return preproc2pyobj(preproc)
-
-def measureDiameters(preproc):
+    with nogil:
+        if c_config == NULL:
+            preproc = astimplib.inhib_diam_preprocessing(petri_c,c_circles,state_ptr)
+        else:
+            preproc = astimplib.inhib_diam_preprocessing(petri_c,c_circles,c_config[0],state_ptr)
+    return preproc2pyobj(preproc, state)
+
+def update_inhib_diam_preprocessing(preproc, petri_dish, circles, ImprocConfig config=None):
+    """updates preproc, the preprocessing of petri_dish, after pellets were
+    added, moved or removed: circles are all the pellets of the plate.
+
+    Only the image around the changed pellets and the local k-means of the
+    ROIs that changed are computed again. The result is the same as
+    inhib_diam_preprocessing(petri_dish, circles) as long as the mean pellet
+    radius does not change; small changes of the radius only update the
+    millimeter scale, larger ones run the preprocessing from scratch (as does
+    a preproc computed without keep_state, e.g. an unpickled one).
+
+    The result keeps its state, to be updated again.
+    """
+    cdef astimplib.InhibDiamPreprocResult p = pyobj2prepoc(preproc)
+    cdef astimplib.InhibPreprocState state
+    if isinstance(preproc, InhibDiamPreproc):
+        state = (<InhibDiamPreproc>preproc).state
+    cdef astimplib.PetriDish petri_c = petriDish_to_c(petri_dish)
+    cdef vector[astimplib.Circle] c_circles
+    cdef astimplib.InhibDiamPreprocResult updated
+    cdef const astimplib.ImprocConfig *c_config = config_ptr(config)
+    for pc in circles:
+        c_circles.push_back(py2circle(pc))
+    with nogil:
+        if c_config == NULL:
+            updated = astimplib.update_inhib_diam_preprocessing(p, state, petri_c, c_circles)
+        else:
+            updated = astimplib.update_inhib_diam_preprocessing(p, state, petri_c, c_circles, c_config[0])
+    return preproc2pyobj(updated, state)
+
+def get_inhib_preproc_timings():
+    """cumulated timings (in ms) of inhib_diam_preprocessing since the last reset"""
+    cdef astimplib.InhibPreprocTimings t = astimplib.getInhibPreprocTimings()
+    return {
+        "calls": t.calls,
+        "totalMs": t.totalMs,
+        "globalKmeansMs": t.globalKmeansMs,
+        "localKmeansMs": t.localKmeansMs,
+        "localKmeansROIs": t.localKmeansROIs,
+    }
+
+def reset_inhib_preproc_timings():
+    astimplib.resetInhibPreprocTimings()
+
+def measureDiameters(preproc, ImprocConfig config=None):
     """measures the diameter of all the inhibition zones (with the default method)"""
-    inhib = astimplib.measureDiameters(pyobj2prepoc(preproc))
+    cdef astimplib.InhibDiamPreprocResult p = pyobj2prepoc(preproc)
+    cdef vector[astimplib.InhibDisk] inhib
+    cdef const astimplib.ImprocConfig *c_config = config_ptr(config)
+    with nogil:
+        if c_config == NULL:
+            inhib = astimplib.measureDiameters(p)
+        else:
+            inhib = astimplib.measureDiameters(p, c_config[0])
     return [InhibDisk(x.diameter,x.confidence) for x in inhib]
 
 def measureOneDiameter(preproc, int pellet_idx, mode=INHIB_MEASURE_MODE.INSCRIBED):
@@ -125,14 +210,44 @@ def measureOneDiameter(preproc, int pellet_idx, mode=INHIB_MEASURE_MODE.INSCRIBE
     - astimp.INHIB_MEASURE_MODE.CIRCUMSCRIBED in order to measure the diameter of 
     the circle that circumscribes the zone of inhibition (used for D-Zones).
     """
-    x = astimplib.measureOneDiameter(pyobj2prepoc(preproc), pellet_idx, mode)
+    cdef astimplib.InhibDiamPreprocResult p = pyobj2prepoc(preproc)
+    cdef astimplib.InhibMeasureMode m = mode
+    cdef astimplib.InhibDisk x
+    with nogil:
+        x = astimplib.measureOneDiameter(p, pellet_idx, m)
     return InhibDisk(x.diameter,x.confidence)
 
 def radial_profile(preproc, num, profile_type, th_value=0):
-    return astimplib.radial_profile(pyobj2prepoc(preproc), num, profile_type, th_value)
+    """radial intensity profile of the num-th pellet.
 
-def calcDiameterReadingSensibility(preproc, pellet_idx):
-    return astimplib.calcDiameterReadingSensibility(pyobj2prepoc(preproc), pellet_idx)
+    profile_type is one of PROFILE_ALGO, or a list of them. In the latter case
+    all the profiles are computed in one pass over the image and returned as a
+    2-D numpy array: one row per requested type, in the same order, plus a last
+    row with the number of pixels at each radius.
+    """
+    cdef astimplib.InhibDiamPreprocResult p = pyobj2prepoc(preproc)
+    cdef unsigned int n = num
+    cdef float th = th_value
+    cdef vector[astimplib.PROFILE_TYPE] types
+    cdef astimplib.RadialProfiles profiles
+    cdef vector[float] profile
+    if isinstance(profile_type, (list, tuple)):
+        for t in profile_type:
+            types.push_back(t)
+        with nogil:
+            profiles = astimplib.radial_profiles(p, n, types, th)
+        return np.array(list(profiles.profiles) + [profiles.counts], dtype=np.float32)
+    cdef astimplib.PROFILE_TYPE pr_type = profile_type
+    with nogil:
+        profile = astimplib.radial_profile(p, n, pr_type, th)
+    return profile
+
+def calcDiameterReadingSensibility(preproc, int pellet_idx):
+    cdef astimplib.InhibDiamPreprocResult p = pyobj2prepoc(preproc)
+    cdef float sensibility
+    with nogil:
+        sensibility = astimplib.calcDiameterReadingSensibility(p, pellet_idx)
+    return sensibility
 
 # def test(preproc):
 #     return Mat2np(pyobj2prepoc(preproc).img)
@@ -141,15 +256,17 @@ def throw_custom_exception(message):
     cdef string s = message.encode('UTF-8')
     astimplib.throw_custom_exception(s)
 
-def searchOnePellet(nparray, center_x, center_y, mm_per_px):
+def searchOnePellet(nparray, center_x, center_y, mm_per_px, channel_order="RGB"):
     """search one pellet in image npadday, around point center.
     center is a list of 2 int [x,y].
     """
     cdef int cx = round(center_x)
     cdef int cy = round(center_y)
-    cdef Mat img = np2Mat(nparray)
+    cdef Mat img = np2Mat(nparray, channel_order)
     cdef float mm_per_px_c = mm_per_px
-    cdef astimplib.Circle circ = astimplib.searchOnePellet(img, center_x, center_y, mm_per_px_c)
+    cdef astimplib.Circle circ
+    with nogil:
+        circ = astimplib.searchOnePellet(img, cx, cy, mm_per_px_c)
     return Circle((circ.center.x, circ.center.y), circ.radius)
 
 def inhibition_disks_ROIs(circles, nparray, max_diam):
@@ -167,45 +284,272 @@ def inhibition_disks_ROIs(circles, nparray, max_diam):
         p_rois.append(Roi(roi.x,roi.y,roi.width,roi.height))
     return p_rois
 
-def getPetriDish(nparray):
-    cdef astimplib.PetriDish pd = astimplib.getPetriDish(
-        astimplib.np2Mat(nparray)
-    )
-    
-    return PetriDish(
-        img=astimplib.Mat2np(pd.img),
-        boundingBox=Roi(pd.boundingBox.x,
-            pd.boundingBox.y,
-            pd.boundingBox.width,
-            pd.boundingBox.height
-            ),
-        isRound=pd.isRound
-    )
-
-def getPetriDishWithRoi(nparray, roi):
+def getPetriDish(nparray, ImprocConfig config=None, channel_order="RGB"):
+    """PetriDish of a picture, its img is RGB whatever the channel order of
+    nparray (it is given back to the other functions as is)"""
+    cdef Mat img = astimplib.np2Mat(nparray, channel_order)
+    cdef astimplib.PetriDish pd
+    cdef const astimplib.ImprocConfig *c_config = config_ptr(config)
+    with nogil:
+        if c_config == NULL:
+            pd = astimplib.getPetriDish(img)
+        else:
+            pd = astimplib.getPetriDish(img, c_config[0])
+    return petriDish_from_c(pd)
+
+def getPetriDishWithRoi(nparray, roi, channel_order="RGB"):
     """roi is a rectangle (x,y,width,height)"""
-    cdef astimplib.PetriDish pd = astimplib.getPetriDishWithRoi(
-        astimplib.np2Mat(nparray), astimplib.Rect(roi[0],roi[1],roi[2],roi[3])
-    )
-    
-    return PetriDish(
-        img=astimplib.Mat2np(pd.img),
-        boundingBox=Roi(pd.boundingBox.x,
-            pd.boundingBox.y,
-            pd.boundingBox.width,
-            pd.boundingBox.height
-            ),
-        isRound=pd.isRound
-    )
-
-def calc_dominant_color(nparray):
+    cdef Mat img = astimplib.np2Mat(nparray, channel_order)
+    cdef astimplib.Rect r = astimplib.Rect(roi[0],roi[1],roi[2],roi[3])
+    cdef astimplib.PetriDish pd
+    with nogil:
+        pd = astimplib.getPetriDishWithRoi(img, r)
+    return petriDish_from_c(pd)
+
+def calc_dominant_color(nparray, channel_order="RGB"):
     cdef int hsv[3]
-    astimplib.calcDominantColor(astimplib.np2Mat(nparray),hsv)
+    cdef Mat img = astimplib.np2Mat(nparray, channel_order)
+    with nogil:
+        astimplib.calcDominantColor(img,hsv)
     return (hsv[0],hsv[1],hsv[2])
 
 
-def is_growth_medium_blood(nparray):
-    return astimplib.isGrowthMediumBlood(astimplib.np2Mat(nparray))
+def is_growth_medium_blood(nparray, channel_order="RGB"):
+    cdef Mat img = astimplib.np2Mat(nparray, channel_order)
+    cdef bint blood
+    with nogil:
+        blood = astimplib.isGrowthMediumBlood(img)
+    return blood
+
+
+cdef class PetriDishRig:
+    """Crop of the Petri dish in pictures taken on a fixed stand.
+
+    The rig is calibrated with the Petri dish found by getPetriDish in a
+    picture (the first one given to get_petri_dish if calibrate is not
+    called). The Petri dish of the next pictures is taken at the calibrated
+    place if its border is found there, otherwise it is cropped again with
+    getPetriDish and the rig is calibrated with it.
+    """
+    cdef astimplib.PetriDishRig *rig
+
+    def __cinit__(self):
+        self.rig = new astimplib.PetriDishRig()
+
+    def __dealloc__(self):
+        del self.rig
+
+    def calibrate(self, nparray, channel_order="RGB"):
+        """Calibrates the rig with a picture, returns its PetriDish."""
+        cdef Mat img = astimplib.np2Mat(nparray, channel_order)
+        cdef astimplib.PetriDish pd
+        with nogil:
+            pd = self.rig.calibrate(img)
+        return petriDish_from_c(pd)
+
+    def get_petri_dish(self, nparray, channel_order="RGB"):
+        """Returns the PetriDish of a picture of the rig."""
+        cdef Mat img = astimplib.np2Mat(nparray, channel_order)
+        cdef astimplib.PetriDish pd
+        with nogil:
+            pd = self.rig.getPetriDish(img)
+        return petriDish_from_c(pd)
+
+    @property
+    def is_calibrated(self):
+        return self.rig.isCalibrated()
+
+    @property
+    def bounding_box(self):
+        """calibrated Roi of the Petri dish (None if not calibrated)"""
+        cdef astimplib.Rect bb
+        if not self.rig.isCalibrated():
+            return None
+        bb = self.rig.boundingBox()
+        return Roi(bb.x, bb.y, bb.width, bb.height)
+
+    @property
+    def stats(self):
+        """number of pictures cropped at the calibrated place (fast_path),
+        with getPetriDish (grab_cut), and of calibrations replaced after a
+        failed check (recalibrations)"""
+        cdef astimplib.RigStats s = self.rig.stats()
+        return {"fast_path": s.fastPath, "grab_cut": s.grabCut,
+                "recalibrations": s.recalibrations}
+
+    def reset_stats(self):
+        self.rig.resetStats()
+
+
+######################
+## batch analysis
+######################
+
+cdef class PlateAnalysisPool:
+    """Pool of C++ threads analysing plates: crop of the Petri dish, pellets,
+    labels and inhibition diameters. The label recognition of the plates is
+    batched.
+
+    Plates are given to submit (an RGB image, the path of an image file or the
+    content of an image file) and the results are returned by next, in the
+    order the plates are finished.
+
+    If keep_images is False, the images of the plates (crop, preprocessing) are
+    released by the workers as soon as the plates are finished.
+    """
+    cdef astimplib.PlateAnalysisPool *pool
+    # index -> submitted image or path, kept until the plate is returned
+    cdef dict inputs
+
+    def __cinit__(self, int workers=0, ImprocConfig config=None, bint keep_images=True):
+        if config is None:
+            self.pool = new astimplib.PlateAnalysisPool(workers, keep_images)
+        else:
+            self.pool = new astimplib.PlateAnalysisPool(workers, config.config[0], keep_images)
+        self.inputs = {}
+
+    def __dealloc__(self):
+        # waits for the plates being analysed
+        with nogil:
+            del self.pool
+
+    @property
+    def workers(self):
+        return self.pool.numWorkers()
+
+    @property
+    def in_flight(self):
+        """number of plates submitted and not yet returned by next"""
+        return self.pool.inFlight()
+
+    def submit(self, plate, channel_order="RGB"):
+        """Queues a plate, returns its index.
+        plate is an image (of channel order channel_order), the path of an
+        image file (str or path-like) or the content of an image file
+        (bytes-like)."""
+        cdef Mat m
+        cdef size_t index
+        cdef const unsigned char[::1] data
+        if isinstance(plate, (str, os.PathLike)):
+            index = self.pool.submitPath(os.fsencode(plate))
+        elif isinstance(plate, (bytes, bytearray, memoryview)):
+            # the data is copied by the pool
+            data = plate
+            if data.shape[0] == 0:
+                raise ValueError("empty image file content")
+            index = self.pool.submitBytes(&data[0], data.shape[0])
+            plate = None
+        else:
+            # the Mat may borrow the array memory: the array is kept alive
+            m = np2Mat(plate, channel_order)
+            index = self.pool.submit(m)
+        self.inputs[index] = plate
+        return index
+
+    def next(self, bint compact=False):
+        """Waits for a plate to be finished and returns its PlateResult (or
+        its PlateRecord if compact is True), or None if all the submitted
+        plates were already returned."""
+        cdef astimplib.PlateAnalysis r
+        cdef bint found
+        cdef size_t i
+        with nogil:
+            found = self.pool.next(r)
+        if not found:
+            return None
+        source = self.inputs.pop(r.index)
+        if not isinstance(source, (str, os.PathLike)):
+            source = None if compact else source
+        if compact:
+            if not r.ok:
+                return PlateRecord(r.index, source, False, r.error.decode('UTF-8'),
+                                   None, None, 0, [])
+            pellets = []
+            for i in range(r.circles.size()):
+                label = label_match_to_py(r.labels[i])
+                pellets.append(PelletRecord(
+                    (r.circles[i].center.x, r.circles[i].center.y),
+                    r.circles[i].radius, label.text, label.confidence,
+                    r.disks[i].diameter, r.disks[i].confidence))
+            bb = r.petri.boundingBox
+            return PlateRecord(r.index, source, True, None,
+                               Roi(bb.x, bb.y, bb.width, bb.height),
+                               r.petri.isRound, r.pxPerMm, pellets)
+        if not r.ok:
+            return PlateResult(r.index, source, r.error.decode('UTF-8'))
+        result = PlateResult(r.index, source)
+        result.petriDish = petriDish_from_c(r.petri)
+        result.circles = [Circle((c.center.x, c.center.y), c.radius) for c in r.circles]
+        result.labels = [label_match_to_py(lm) for lm in r.labels]
+        result.inhibitions = [InhibDisk(d.diameter, d.confidence) for d in r.disks]
+        if r.circles.size() > 0:
+            result.preproc = preproc2pyobj(r.preproc)
+        return result
+
+def analyze_stream(plates, int workers=0, int max_in_flight=0, bint ordered=False,
+                   bint compact=True, ImprocConfig config=None, channel_order="RGB"):
+    """Analyzes a stream of plates in a pool of C++ threads, with a bounded
+    memory use.
+
+    plates is an iterable (possibly a lazy one) of image file paths, of image
+    file contents (bytes) or of images (of channel order channel_order). It is
+    consumed as the plates are analysed: at most max_in_flight plates (2 per
+    worker if zero) are submitted and not yet yielded at any time, the files
+    are read and decoded ahead by the workers.
+
+    Yields a PlateRecord per plate if compact is True (no image is kept, the
+    memory used does not depend on the number of plates), a PlateResult
+    otherwise. The plates are yielded in the input order if ordered is True,
+    as soon as they are finished otherwise (see index). The errors are
+    reported in the results, they are not raised.
+    """
+    pool = PlateAnalysisPool(workers, config, keep_images=not compact)
+    if max_in_flight <= 0:
+        max_in_flight = 2 * pool.workers
+    plates = iter(plates)
+    exhausted = False
+    finished = {}  # ordered mode: plates waiting for the previous ones
+    next_index = 0
+    while True:
+        while not exhausted and pool.in_flight + len(finished) < max_in_flight:
+            try:
+                plate = next(plates)
+            except StopIteration:
+                exhausted = True
+                break
+            pool.submit(plate, channel_order)
+            del plate
+        result = pool.next(compact)
+        if result is None:
+            return
+        if not ordered:
+            yield result
+            continue
+        finished[result.index] = result
+        del result
+        while next_index in finished:
+            yield finished.pop(next_index)
+            next_index += 1
+
+def analyze_batch(images_or_paths, int workers=0, ImprocConfig config=None,
+                  channel_order="RGB"):
+    """Analyzes plates in a pool of C++ threads (see PlateAnalysisPool), the
+    GIL is released while they run.
+
+    images_or_paths is an iterable of images (of channel order channel_order)
+    or of image file paths.
+    Yields a PlateResult per plate, as soon as the plate is finished: the order
+    is not the one of images_or_paths, see PlateResult.index. The errors are
+    reported in the results, they are not raised.
+    """
+    pool = PlateAnalysisPool(workers, config)
+    for image_or_path in images_or_paths:
+        pool.submit(image_or_path, channel_order)
+    while True:
+        result = pool.next()
+        if result is None:
+            return
+        yield result
 
 
 # --------------------------------- CLASSES --------------------------------
@@ -302,6 +646,45 @@ class PetriDish:
       self.boundingBox = boundingBox
       self.isRound = isRound
 
+PelletRecord = namedtuple("PelletRecord", ["center", "radius", "label",
+    "label_confidence", "diameter", "diameter_confidence"])
+PelletRecord.__doc__ = """Pellet of a PlateRecord. center and radius are in the
+coordinates of the cropped Petri dish, diameter is the inhibition diameter."""
+
+PlateRecord = namedtuple("PlateRecord", ["index", "source", "ok", "error",
+    "boundingBox", "isRound", "px_per_mm", "pellets"])
+PlateRecord.__doc__ = """Compact result of the analysis of a plate by
+analyze_stream, without images. boundingBox is the Petri dish in the original
+image, pellets is a list of PelletRecord. source is the path of the image file
+(None if the plate was not given by path)."""
+
+class PlateResult:
+    """Result of the analysis of a plate by analyze_batch.
+
+    index is the position of the plate in the input, source the submitted
+    image or path. If the analysis failed, ok is False and error holds the
+    reason.
+    """
+    def __init__(self, index, source, error=None):
+        self.index = index
+        self.source = source
+        self.ok = error is None
+        self.error = error
+        self.petriDish = None
+        self.circles = []
+        self.labels = []
+        self.inhibitions = []
+        self.preproc = None
+
+    @property
+    def crop(self):
+        return self.petriDish.img if self.petriDish is not None else None
+
+    def __repr__(self):
+        if not self.ok:
+            return "PlateResult(index={}, error={!r})".format(self.index, self.error)
+        return "PlateResult(index={}, {} pellets)".format(self.index, len(self.circles))
+
 cdef astimplib.PetriDish petriDish_to_c(petri):
     cdef astimplib.PetriDish petri_c
     petri_c.img = astimplib.np2Mat(petri.img)
@@ -310,6 +693,23 @@ cdef astimplib.PetriDish petriDish_to_c(petri):
     petri_c.isRound = petri.isRound
     return petri_c
 
+cdef petriDish_from_c(astimplib.PetriDish pd):
+    return PetriDish(
+        img=astimplib.Mat2np(pd.img),
+        boundingBox=Roi(pd.boundingBox.x,
+            pd.boundingBox.y,
+            pd.boundingBox.width,
+            pd.boundingBox.height
+            ),
+        isRound=pd.isRound
+    )
+
+cdef label_match_to_py(astimplib.Label_match lm):
+    """the most confident label of a match"""
+    top_label_and_confidence = dereference(lm.labelsAndConfidence.begin())
+    return Pellet_match(top_label_and_confidence.label.decode('UTF-8'),
+        top_label_and_confidence.confidence)
+
 cdef astimplib.Circle py2circle(pc):
     cdef astimplib.Circle c_circle = astimplib.Circle()
     c_circle.center = astimplib.Point2f(pc.center[0], pc.center[1])
@@ -340,23 +740,92 @@ class PyPreproc:
         self.px_per_mm = px_per_mm
         self.original_img_px_per_mm = original_img_px_per_mm
 
-cdef preproc2pyobj( astimplib.InhibDiamPreprocResult idpr):
-    # transform a C object InhibDiamPreprocResult into python namedtuple
-    return PyPreproc(
-        Mat2np(idpr.img),
-        [Circle((c.center.x, c.center.y), c.radius) for c in idpr.circles],
-        [Roi(r.x, r.y, r.height, r.width) for r in idpr.ROIs],
-        idpr.km_centers,
-        idpr.km_threshold,
-        idpr.km_centers_local,
-        idpr.km_thresholds_local,
-        idpr.scale_factor,
-        idpr.pad,
-        idpr.px_per_mm,
-        idpr.original_img_px_per_mm,
-    )
+cdef class InhibDiamPreproc:
+    """Result of inhib_diam_preprocessing.
+
+    It holds the C++ object, which is given back to the measurement functions
+    without any conversion. The attributes are read-only, img is a read-only
+    view of the preprocessed image.
+
+    The intermediate images of the preprocessing (state) are only kept when
+    requested (keep_state of inhib_diam_preprocessing), they are not pickled.
+    """
+    cdef astimplib.InhibDiamPreprocResult result
+    cdef astimplib.InhibPreprocState state
+
+    @property
+    def img(self):
+        ary = Mat2np(self.result.img)
+        ary.flags.writeable = False
+        return ary
+    @property
+    def circles(self):
+        return [Circle((c.center.x, c.center.y), c.radius) for c in self.result.circles]
+    @property
+    def ROIs(self):
+        return [Roi(r.x, r.y, r.width, r.height) for r in self.result.ROIs]
+    @property
+    def km_centers(self):
+        return self.result.km_centers
+    @property
+    def km_threshold(self):
+        return self.result.km_threshold
+    @property
+    def km_centers_local(self):
+        return self.result.km_centers_local
+    @property
+    def km_thresholds_local(self):
+        return self.result.km_thresholds_local
+    @property
+    def scale_factor(self):
+        return self.result.scale_factor
+    @property
+    def pad(self):
+        return self.result.pad
+    @property
+    def px_per_mm(self):
+        return self.result.px_per_mm
+    @property
+    def original_img_px_per_mm(self):
+        return self.result.original_img_px_per_mm
+
+    def __reduce__(self):
+        return (_inhib_diam_preproc_from_state, (
+            np.array(self.img),
+            self.circles,
+            self.ROIs,
+            self.km_centers,
+            self.km_threshold,
+            self.km_centers_local,
+            self.km_thresholds_local,
+            self.scale_factor,
+            self.pad,
+            self.px_per_mm,
+            self.original_img_px_per_mm,
+        ))
+
+def _inhib_diam_preproc_from_state(*state):
+    """rebuilds a pickled InhibDiamPreproc"""
+    cdef InhibDiamPreproc p = InhibDiamPreproc.__new__(InhibDiamPreproc)
+    p.result = pyobj2prepoc(PyPreproc(*state))
+    # the image borrows the memory of a temporary array
+    p.result.img = p.result.img.clone()
+    return p
+
+cdef preproc2pyobj( astimplib.InhibDiamPreprocResult idpr, astimplib.InhibPreprocState state=astimplib.InhibPreprocState()):
+    # wrap a C object InhibDiamPreprocResult into a python object (no copy)
+    cdef InhibDiamPreproc p = InhibDiamPreproc.__new__(InhibDiamPreproc)
+    p.result = idpr
+    p.state = state
+    return p
 
 cdef astimplib.InhibDiamPreprocResult pyobj2prepoc(idpr):
+    # InhibDiamPreproc objects already hold the C object: only the headers
+    # are copied, not the image data.
+    if isinstance(idpr, InhibDiamPreproc):
+        return (<InhibDiamPreproc>idpr).result
+
+    # other objects with the same attributes (e.g. PyPreproc from old pickles)
     cdef astimplib.InhibDiamPreprocResult out
     cdef vector[astimplib.Circle] c_circles
     # cdef astimplib.Circle c_circle
@@ -388,10 +857,31 @@ cdef astimplib.InhibDiamPreprocResult pyobj2prepoc(idpr):
  ######################
 
 cdef class ImprocConfig:
+    """The configuration of astimp.
+
+    astimp.config is the process default configuration. The functions of this
+    module release the GIL and can run in several threads at once: do not
+    change the default configuration while they are running. Use instead
+    copies of it (see copy), given to the functions with their config argument
+    or installed in one thread with LocalConfig.
+    """
     cdef astimplib.ImprocConfig *config
+    # the configuration, if it is a copy owned by this object
+    cdef astimplib.ImprocConfig *owned
 
     def __cinit__(self):
         self.config = astimplib.getConfigWritable()
+        self.owned = NULL
+
+    def __dealloc__(self):
+        del self.owned
+
+    def copy(self):
+        """Returns an independent copy of this configuration"""
+        cdef ImprocConfig c = ImprocConfig.__new__(ImprocConfig)
+        c.owned = new astimplib.ImprocConfig(self.config[0])
+        c.config = c.owned
+        return c
 
     @property
     def PetriDish_gcBorder(self):
@@ -400,6 +890,22 @@ cdef class ImprocConfig:
     def PetriDish_gcBorder(self,d):
         self.config[0].PetriDish.gcBorder = d
 
+    @property
+    def PetriDish_cropEngine(self):
+        return self.config[0].PetriDish.cropEngine
+    @PetriDish_cropEngine.setter
+    def PetriDish_cropEngine(self,d):
+        if d not in (CROP_ENGINE.GRABCUT, CROP_ENGINE.CIRCLE_FIT, CROP_ENGINE.AUTO):
+            raise  ValueError("unknown crop engine.")
+        self.config[0].PetriDish.cropEngine = d
+
+    @property
+    def PetriDish_circleFitMinConfidence(self):
+        return self.config[0].PetriDish.circleFitMinConfidence
+    @PetriDish_circleFitMinConfidence.setter
+    def PetriDish_circleFitMinConfidence(self,d):
+        self.config[0].PetriDish.circleFitMinConfidence = d
+
     @property
     def PetriDish_borderPelletDistance_in_mm(self):
         return self.config[0].PetriDish.borderPelletDistance_in_mm
@@ -476,6 +982,126 @@ cdef class ImprocConfig:
         if (0<0) or (d>255):
             raise  ValueError("sensibility value must be in [0,255].")
         self.config[0].Inhibition.minPelletIntensity = d
+
+    @property
+    def Inhibition_kmeansNumAttempts(self):
+        return self.config[0].Inhibition.kmeansNumAttempts
+    @Inhibition_kmeansNumAttempts.setter
+    def Inhibition_kmeansNumAttempts(self,d:int):
+        if d<1:
+            raise  ValueError("the number of attempts must be >= 1.")
+        self.config[0].Inhibition.kmeansNumAttempts = d
+
+    @property
+    def Inhibition_kmeansEngine(self):
+        return self.config[0].Inhibition.kmeansEngine
+    @Inhibition_kmeansEngine.setter
+    def Inhibition_kmeansEngine(self,d):
+        if d not in (KMEANS_ENGINE.OPENCV, KMEANS_ENGINE.HISTOGRAM):
+            raise  ValueError("unknown k-means engine.")
+        self.config[0].Inhibition.kmeansEngine = d
+
+    @property
+    def Inhibition_parallelMeasurement(self):
+        return self.config[0].Inhibition.parallelMeasurement
+    @Inhibition_parallelMeasurement.setter
+    def Inhibition_parallelMeasurement(self,d:bool):
+        self.config[0].Inhibition.parallelMeasurement = d
+
+    @property
+    def Inhibition_measurementThreads(self):
+        return self.config[0].Inhibition.measurementThreads
+    @Inhibition_measurementThreads.setter
+    def Inhibition_measurementThreads(self,d:int):
+        if d<0:
+            raise  ValueError("the number of threads must be >= 0.")
+        self.config[0].Inhibition.measurementThreads = d
+
+    @property
+    def Inhibition_parallelLocalKmeans(self):
+        return self.config[0].Inhibition.parallelLocalKmeans
+    @Inhibition_parallelLocalKmeans.setter
+    def Inhibition_parallelLocalKmeans(self,d:bool):
+        self.config[0].Inhibition.parallelLocalKmeans = d
+
+    @property
+    def Inhibition_localKmeansThreads(self):
+        return self.config[0].Inhibition.localKmeansThreads
+    @Inhibition_localKmeansThreads.setter
+    def Inhibition_localKmeansThreads(self,d:int):
+        if d<0:
+            raise  ValueError("the number of threads must be >= 0.")
+        self.config[0].Inhibition.localKmeansThreads = d
+
+    @property
+    def Inhibition_downscaleFirst(self):
+        return self.config[0].Inhibition.downscaleFirst
+    @Inhibition_downscaleFirst.setter
+    def Inhibition_downscaleFirst(self, value):
+        self.config[0].Inhibition.downscaleFirst = value
     
 
+cdef const astimplib.ImprocConfig *config_ptr(ImprocConfig config):
+    """the C++ configuration of config, or NULL if config is None"""
+    if config is None:
+        return NULL
+    return config.config
+
+cdef class LocalConfig:
+    """Context manager that overrides the configuration in the calling thread.
+
+    In the with block, the functions of this module called by this thread use a
+    copy of base (by default, the configuration in use by the thread) with the
+    given parameters changed. The other threads are not affected.
+
+    with astimp.LocalConfig(PetriDish_growthMedium=astimp.MEDIUM_TYPE.BLOOD) as cfg:
+        petri = astimp.getPetriDish(img)
+
+    cfg is the overriding configuration, it can be changed in the with block.
+    The with block must end in the thread where it started.
+    """
+    cdef astimplib.ScopedConfig *scope
+    cdef ImprocConfig base
+    cdef dict params
+    cdef ImprocConfig current
+
+    def __cinit__(self):
+        self.scope = NULL
+
+    def __init__(self, ImprocConfig base=None, **params):
+        self.base = base
+        self.params = params
+
+    def __dealloc__(self):
+        del self.scope
+
+    def __enter__(self):
+        if self.scope != NULL:
+            raise RuntimeError("LocalConfig is already in use")
+        if self.base is None:
+            self.scope = new astimplib.ScopedConfig(astimplib.getConfig()[0])
+        else:
+            self.scope = new astimplib.ScopedConfig(self.base.config[0])
+        self.current = ImprocConfig.__new__(ImprocConfig)
+        self.current.config = self.scope.config()
+        try:
+            for name, value in self.params.items():
+                setattr(self.current, name, value)
+        except:
+            self._release()
+            raise
+        return self.current
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+        return False
+
+    cdef _release(self):
+        # cfg keeps the last values of the configuration, in its own copy
+        self.current.owned = new astimplib.ImprocConfig(self.scope.config()[0])
+        self.current.config = self.current.owned
+        self.current = None
+        del self.scope
+        self.scope = NULL
+
 config = ImprocConfig()
\ No newline at end of file
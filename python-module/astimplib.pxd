@@ -36,7 +36,9 @@ cdef extern from "core/types.hpp" namespace "cv":
     float y
 
 
-cdef extern from "astimp.hpp" namespace "astimp":
+# The functions are declared nogil so that the wrappers can release the GIL
+# while the C++ code runs.
+cdef extern from "astimp.hpp" namespace "astimp" nogil:
     cdef cppclass PetriDish:
       Mat img
       Rect boundingBox
@@ -61,6 +63,10 @@ cdef extern from "astimp.hpp" namespace "astimp":
       float px_per_mm
       InhibDiamPreprocResult() except +
       float original_img_px_per_mm
+
+    cdef cppclass InhibPreprocState:
+      vector[Circle] plateCircles
+      InhibPreprocState() except +
       
     cdef cppclass InhibDisk:
       float diameter
@@ -72,10 +78,31 @@ cdef extern from "astimp.hpp" namespace "astimp":
       PROFILE_SWITCH
       PROFILE_MAXAVERAGE
 
+    cdef cppclass InhibPreprocTimings:
+      size_t calls
+      double totalMs
+      double globalKmeansMs
+      double localKmeansMs
+      size_t localKmeansROIs
+
+    cdef cppclass RadialProfiles:
+      vector[PROFILE_TYPE] types
+      vector[vector[float]] profiles
+      vector[float] counts
+
     cdef enum MEDIUM_TYPE:
       MEDIUM_HM
       MEDIUM_BLOOD
 
+    cdef enum CROP_ENGINE:
+      CROP_GRABCUT
+      CROP_CIRCLE_FIT
+      CROP_AUTO
+
+    cdef enum KMEANS_ENGINE:
+      KMEANS_OPENCV
+      KMEANS_HISTOGRAM
+
     cdef enum InhibMeasureMode:
       INSCRIBED
       CIRCUMSCRIBED
@@ -91,17 +118,23 @@ cdef extern from "astimp.hpp" namespace "astimp":
                                              float max_diam) except +
 
     InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri, vector[Circle] &circles) except +
-    vector[InhibDisk] measureDiameters(InhibDiamPreprocResult inhib_preproc) except +
-    InhibDisk measureOneDiameter(InhibDiamPreprocResult inhib_preproc, int pellet_idx, InhibMeasureMode mode) except +
+    InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri, vector[Circle] &circles, InhibPreprocState *state) except +
+    InhibDiamPreprocResult update_inhib_diam_preprocessing(const InhibDiamPreprocResult &preproc, InhibPreprocState &state, PetriDish petri, const vector[Circle] &circles) except +
+    InhibDiamPreprocResult update_inhib_diam_preprocessing(const InhibDiamPreprocResult &preproc, InhibPreprocState &state, PetriDish petri, const vector[Circle] &circles, const ImprocConfig &config) except +
+    InhibPreprocTimings getInhibPreprocTimings() except +
+    void resetInhibPreprocTimings() except +
+    vector[InhibDisk] measureDiameters(const InhibDiamPreprocResult &inhib_preproc) except +
+    InhibDisk measureOneDiameter(const InhibDiamPreprocResult &inhib_preproc, int pellet_idx, InhibMeasureMode mode) except +
     ImprocConfig * getConfigWritable() except +
     vector[float] radial_profile(InhibDiamPreprocResult preproc, unsigned int num, PROFILE_TYPE pr_type, float th_value) except +
+    RadialProfiles radial_profiles(const InhibDiamPreprocResult &preproc, unsigned int num, const vector[PROFILE_TYPE] &types, float th_value) except +
     void throw_custom_exception(const string &s) except +
     Circle searchOnePellet(const Mat &img, int center_x, int center_y, float mm_per_px)  except +
-    float calcDiameterReadingSensibility(InhibDiamPreprocResult preproc, int pellet_idx) except +
+    float calcDiameterReadingSensibility(const InhibDiamPreprocResult &preproc, int pellet_idx) except +
     void calcDominantColor(const Mat &img, int* hsv) except +
     bool isGrowthMediumBlood(const Mat &ast_crop) except +
     
-cdef extern from "pellet_label_recognition.hpp" namespace "astimp":
+cdef extern from "pellet_label_recognition.hpp" namespace "astimp" nogil:
     cdef struct LabelAndConfidence:
       string label
       float confidence
@@ -115,6 +148,8 @@ cdef struct PetriDishSettings:
     int MaxSize 
     float gcBorder
     int gcIters
+    CROP_ENGINE cropEngine
+    float circleFitMinConfidence
     int SideInMillimeters
     int DiameterInMillimeters
     int borderPelletDistance_in_mm
@@ -133,10 +168,69 @@ cdef struct InhibitionSettings:
     int minInhibToBacteriaIntensityDiff
     float diameterReadingSensibility
     int minPelletIntensity
-
-cdef extern from "astimp.hpp" namespace "astimp":
+    int kmeansNumAttempts
+    KMEANS_ENGINE kmeansEngine
+    bool parallelMeasurement
+    int measurementThreads
+    bool parallelLocalKmeans
+    int localKmeansThreads
+    bool downscaleFirst
+
+cdef extern from "astimp.hpp" namespace "astimp" nogil:
   cdef cppclass ImprocConfig:
+    ImprocConfig() except +
+    ImprocConfig(const ImprocConfig &) except +
     PetriDishSettings PetriDish
     PelletsSettings Pellets
     InhibitionSettings Inhibition
 
+  cdef cppclass ScopedConfig:
+    ScopedConfig(const ImprocConfig &config) except +
+    ImprocConfig * config()
+
+  const ImprocConfig * getConfig() except +
+
+  PetriDish getPetriDish(const Mat &img, const ImprocConfig &config) except +
+  vector[Circle] find_atb_pellets(const Mat &img, const ImprocConfig &config) except +
+  InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri, vector[Circle] &circles, const ImprocConfig &config) except +
+  InhibDiamPreprocResult inhib_diam_preprocessing(PetriDish petri, vector[Circle] &circles, const ImprocConfig &config, InhibPreprocState *state) except +
+  vector[InhibDisk] measureDiameters(const InhibDiamPreprocResult &inhib_preproc, const ImprocConfig &config) except +
+
+
+cdef extern from "petri_dish_rig.hpp" namespace "astimp" nogil:
+  cdef cppclass RigStats:
+    size_t fastPath
+    size_t grabCut
+    size_t recalibrations
+
+  cdef cppclass PetriDishRig:
+    PetriDishRig() except +
+    PetriDish calibrate(const Mat &astPicture) except +
+    bool isCalibrated() except +
+    Rect boundingBox() except +
+    PetriDish getPetriDish(const Mat &astPicture) except +
+    RigStats stats() except +
+    void resetStats() except +
+
+
+cdef extern from "plate_analysis.hpp" namespace "astimp" nogil:
+  cdef cppclass PlateAnalysis:
+    size_t index
+    bool ok
+    string error
+    PetriDish petri
+    vector[Circle] circles
+    vector[Label_match] labels
+    vector[InhibDisk] disks
+    float pxPerMm
+    InhibDiamPreprocResult preproc
+
+  cdef cppclass PlateAnalysisPool:
+    PlateAnalysisPool(int workers, bool keepImages) except +
+    PlateAnalysisPool(int workers, const ImprocConfig &config, bool keepImages) except +
+    size_t submit(const Mat &img) except +
+    size_t submitPath(const string &path) except +
+    size_t submitBytes(const unsigned char *data, size_t size) except +
+    bool next(PlateAnalysis &result) except +
+    size_t inFlight() except +
+    size_t numWorkers()
@@ -11,15 +11,31 @@ cdef extern from "core/core.hpp":
   cdef int CV_32F
 
 cdef extern from "core/core.hpp" namespace "cv":
+  cdef cppclass UMatData:
+    # number of Mat headers referencing the data
+    int refcount
+
   cdef cppclass Mat:
     Mat() except +
+    Mat(int rows, int cols, int type, void* data, size_t step) except +
     void create(int, int, int)
+    Mat clone() except +
+    void release()
     void* data
+    UMatData* u
     int rows
     int cols
     int channels()
     int depth()
+    bint empty()
     size_t elemSize()
+    size_t elemSize1()
+    size_t step1(int i)
+
+cdef extern from "imgproc.hpp" namespace "cv":
+  enum:
+    COLOR_RGB2BGR
+  void cvtColor(const Mat &src, Mat &dst, int code) except +
 
 # For Buffer usage
 cdef extern from "Python.h":
@@ -28,7 +44,24 @@ cdef extern from "Python.h":
     int PyBuffer_FillInfo(Py_buffer *view, PyObject *obj, void *buf, Py_ssize_t len, int readonly, int infoflags)
     enum:
         PyBUF_FULL_RO
+        PyBUF_WRITABLE
+
+# Converts a numpy array into a cv::Mat.
+# When possible the Mat borrows the array memory (no copy): the array must then
+# stay alive as long as the Mat is used. channel_order ("RGB" or "BGR") is the
+# order of the channels of 3 channel arrays, the Mat is always BGR.
+cdef Mat np2Mat(np.ndarray ary, str channel_order=*)
 
-cdef Mat np2Mat(np.ndarray ary)
+# Converts a cv::Mat into a numpy array.
+# The array shares the Mat data and holds a reference to it. Mats borrowing
+# memory they do not own are copied. The array is read-only unless it holds the
+# only reference to the Mat data: the data may be shared with other Mats (for
+# example an image cached by the library). channel_order ("RGB" or "BGR") is the
+# channel order of the returned 3 channel arrays: RGB arrays are views of the
+# BGR data with reversed channels.
+cdef object Mat2np(Mat mat, str channel_order=*)
 
-cdef object Mat2np(Mat mat)
+cdef class MatOwner:
+    cdef Mat mat
+    cdef Py_ssize_t shape[3]
+    cdef Py_ssize_t strides[3]
@@ -1,53 +1,66 @@
 import numpy as np
 cimport numpy as np  # for np.ndarray
-from libc.string cimport memcpy
 from opencv_mat cimport *
 
 # inspired and adapted from http://makerwannabe.blogspot.ch/2013/09/calling-opencv-functions-via-cython.html
 
-cdef Mat np2Mat3D(np.ndarray ary):
-    assert ary.ndim==3 and ary.shape[2]==3, "ASSERT::3channel RGB only!!"
-    ary = np.dstack((ary[...,2], ary[...,1], ary[...,0])) #RGB -> BGR
+CHANNEL_ORDERS = ("RGB", "BGR")
+
+cdef bint is_borrowable(np.ndarray ary):
+    # a Mat can use the array memory if the pixels of each row are contiguous
+    # (rows may be padded)
+    if ary.ndim == 3 and ary.strides[2] != ary.itemsize:
+        return False
+    return (ary.strides[1] == ary.itemsize * (ary.shape[2] if ary.ndim == 3 else 1)
+            and ary.strides[0] > 0)
 
-    cdef np.ndarray[np.uint8_t, ndim=3, mode ='c'] np_buff = np.ascontiguousarray(ary, dtype=np.uint8)
-    cdef unsigned int* im_buff = <unsigned int*> np_buff.data
-    cdef int r = ary.shape[0]
-    cdef int c = ary.shape[1]
+cdef Mat borrow(np.ndarray ary, int mat_type):
+    # Mat header on the array memory, the array must outlive the Mat
+    return Mat(ary.shape[0], ary.shape[1], mat_type, <void*> ary.data, ary.strides[0])
+
+cdef Mat np2Mat3D(np.ndarray ary, str channel_order="RGB"):
+    assert ary.ndim==3 and ary.shape[2]==3, "ASSERT::3channel RGB only!!"
     cdef Mat m
-    m.create(r, c, CV_8UC3)
-    memcpy(m.data, im_buff, r*c*3)
+    if ary.dtype != np.uint8:
+        # a converted copy is needed anyway, it is not kept alive by the caller
+        ary = np.ascontiguousarray(ary, dtype=np.uint8)
+        m = np2Mat3D(ary, channel_order)
+        return m if m.u != NULL else m.clone()
+    if channel_order == "BGR":
+        if is_borrowable(ary):
+            return borrow(ary, CV_8UC3)
+        return borrow(np.ascontiguousarray(ary), CV_8UC3).clone()
+    # RGB data: borrow it if it is a channel-reversed view of BGR data
+    # (e.g. an array returned by Mat2np), otherwise convert it once
+    cdef np.ndarray bgr = ary[..., ::-1]
+    if is_borrowable(bgr):
+        return borrow(bgr, CV_8UC3)
+    if not is_borrowable(ary):
+        ary = np.ascontiguousarray(ary)
+    cvtColor(borrow(ary, CV_8UC3), m, COLOR_RGB2BGR)
     return m
 
 cdef Mat np2Mat2D(np.ndarray ary):
     assert ary.ndim==2 , "ASSERT::1 channel grayscale only!!"
-
-    cdef np.ndarray[np.uint8_t, ndim=2, mode ='c'] np_buff = np.ascontiguousarray(ary, dtype=np.uint8)
-    cdef unsigned int* im_buff = <unsigned int*> np_buff.data
-    cdef int r = ary.shape[0]
-    cdef int c = ary.shape[1]
-    cdef Mat m
-    m.create(r, c, CV_8UC1)
-    memcpy(m.data, im_buff, r*c)
-    return m
+    assert ary.dtype==np.uint8, "ASSERT dtype=uint8"
+    if is_borrowable(ary):
+        return borrow(ary, CV_8UC1)
+    return borrow(np.ascontiguousarray(ary), CV_8UC1).clone()
 
 cdef Mat np2Mat2D_F32(np.ndarray ary):
     assert ary.ndim==2 , "ASSERT::1 channel grayscale only!!"
     assert ary.dtype==np.float32, "ASSERT dtype=float32"
-
-    cdef np.ndarray[np.float32_t, ndim=2, mode ='c'] np_buff = np.ascontiguousarray(ary, dtype=np.float32)
-    cdef float* im_buff = <float*> np_buff.data
-    cdef int r = ary.shape[0]
-    cdef int c = ary.shape[1]
-    cdef Mat m
-    m.create(r, c, CV_32FC1)
-    memcpy(m.data, im_buff, r*c*sizeof(float)) # 4 is the size of 
-    return m
+    if is_borrowable(ary):
+        return borrow(ary, CV_32FC1)
+    return borrow(np.ascontiguousarray(ary), CV_32FC1).clone()
 
 def npto32ftonp(nparr):
     assert nparr.dtype == np.float32, "array dtype must be float32"
     return Mat2np(np2Mat2D_F32(nparr))
 
-cdef Mat np2Mat(np.ndarray ary):
+cdef Mat np2Mat(np.ndarray ary, str channel_order="RGB"):
+    if channel_order not in CHANNEL_ORDERS:
+        raise ValueError("channel order must be one of {}".format(CHANNEL_ORDERS))
     cdef Mat out
     if ary.ndim == 2:
         if ary.dtype == np.float32:
@@ -57,40 +70,76 @@ cdef Mat np2Mat(np.ndarray ary):
         else:
             raise TypeError("array data type is not valid")
     elif ary.ndim == 3:
-        out = np2Mat3D(ary)
+        out = np2Mat3D(ary, channel_order)
     return out
 
 
-cdef object Mat2np(Mat m):
-    # Create buffer to transfer data from m.data
-    cdef Py_buffer buf_info
-    # Define the size / len of data
-    cdef size_t len = m.rows*m.cols*m.elemSize()#m.channels()*sizeof(CV_8UC3)
-    # Fill buffer
-    PyBuffer_FillInfo(&buf_info, NULL, m.data, len, 1, PyBUF_FULL_RO)
-    # Get Pyobject from buffer data
-    Pydata  = PyMemoryView_FromBuffer(&buf_info)
-
-    # Create ndarray with data
-    # the dimension of the output array is 2 if the image is grayscale
-    if m.channels() >1 :
-        shape_array = (m.rows, m.cols, m.channels())
-    else:
-        shape_array = (m.rows, m.cols)
-
-    if m.depth() == CV_32F :
-        ary = np.ndarray(shape=shape_array, buffer=Pydata, order='c', dtype=np.float32)
-    else :
-    #8-bit image
-        ary = np.ndarray(shape=shape_array, buffer=Pydata, order='c', dtype=np.uint8)
-    
-    if m.channels() == 3:
-        # BGR -> RGB
-        ary = np.dstack((ary[...,2], ary[...,1], ary[...,0]))
-
-    # Convert to numpy array
-    pyarr = np.asarray(ary)
-    return pyarr
+cdef class MatOwner:
+    """Holds a reference to a cv::Mat and exposes its data through the buffer
+    protocol, so that numpy arrays can share the Mat memory."""
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        # only data that no other Mat references can be written
+        cdef bint readonly = self.mat.u == NULL or self.mat.u.refcount != 1
+        if readonly and flags & PyBUF_WRITABLE:
+            raise BufferError("the Mat data is shared, it is read-only")
+        cdef int ndim = 3 if self.mat.channels() > 1 else 2
+        cdef Py_ssize_t itemsize = self.mat.elemSize1()
+        self.shape[0] = self.mat.rows
+        self.shape[1] = self.mat.cols
+        self.shape[2] = self.mat.channels()
+        self.strides[0] = self.mat.step1(0) * itemsize
+        self.strides[1] = self.mat.elemSize()
+        self.strides[2] = itemsize
+
+        if self.mat.depth() == CV_32F:
+            buffer.format = 'f'
+        elif self.mat.depth() == CV_8U:
+            buffer.format = 'B'
+        else:
+            raise TypeError("Mat depth {} is not supported".format(self.mat.depth()))
+        buffer.buf = self.mat.data
+        buffer.obj = self
+        buffer.itemsize = itemsize
+        buffer.len = self.shape[0] * self.shape[1] * self.shape[2] * itemsize
+        buffer.ndim = ndim
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+        buffer.readonly = readonly
+        buffer.internal = NULL
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+
+cdef object Mat2np(Mat m, str channel_order="RGB"):
+    if channel_order not in CHANNEL_ORDERS:
+        raise ValueError("channel order must be one of {}".format(CHANNEL_ORDERS))
+    if m.empty():
+        # the dimension of the output array is 2 if the image is grayscale
+        if m.channels() > 1:
+            shape_array = (m.rows, m.cols, m.channels())
+        else:
+            shape_array = (m.rows, m.cols)
+        dtype = np.float32 if m.depth() == CV_32F else np.uint8
+        return np.empty(shape_array, dtype=dtype)
+
+    if m.u == NULL:
+        # the Mat does not own its data (it borrows it from elsewhere, for
+        # example a numpy array): copy it so that the array can outlive it
+        m = m.clone()
+
+    cdef MatOwner owner = MatOwner.__new__(MatOwner)
+    owner.mat = m
+    # the owner keeps the only reference of this function
+    m.release()
+    ary = np.asarray(owner)
+
+    if owner.mat.channels() == 3 and channel_order == "RGB":
+        # BGR -> RGB, as a view
+        ary = ary[..., ::-1]
+    return ary
 
 
 def np2Mat2np(nparray):
@@ -107,9 +156,12 @@ def np2Mat2np(nparray):
 
 cdef class PyMat:
     cdef Mat mat
+    # the array whose memory may be borrowed by mat
+    cdef object base
 
     def __cinit__(self, np_mat):
+        self.base = np_mat
         self.mat = np2Mat(np_mat)
 
     def get_mat(self):
-        return Mat2np(self.mat)
\ No newline at end of file
+        return Mat2np(self.mat)
@@ -56,6 +56,18 @@ img_path = "../tests/images/test0.jpg"
 with logged_action("read image"):
     im_np = np.array(imread(img_path))
 
+with logged_action("numpy <-> cv::Mat round trip"):
+    assert np.array_equal(opencv_mat.np2Mat2np(im_np), im_np)
+    # the Mat is still referenced by np2Mat2np when the array is created
+    assert not opencv_mat.np2Mat2np(im_np).flags.writeable
+    # copy of the borrowed memory, only referenced by the array
+    bgr_copy = astimp.identity(np.ascontiguousarray(im_np[:, :, ::-1]), channel_order="BGR")
+    assert bgr_copy.flags.writeable
+    gray = np.ascontiguousarray(im_np[:, :, 2])
+    gray_before = gray.copy()
+    astimp.find_atb_pellets(gray)  # borrows gray, must not modify it
+    assert np.array_equal(gray, gray_before)
+
 with logged_action("AST object"):
     ast = astimp.AST(im_np)
     for i in range(len(ast.circles)):
@@ -64,6 +76,17 @@ with logged_action("AST object"):
 with logged_action("crop Petri dish"):
     crop = astimp.cropPetriDish(im_np)
 
+with logged_action("BGR input"):
+    bgr = np.ascontiguousarray(im_np[:, :, ::-1])
+    petri_rgb = astimp.getPetriDish(im_np)
+    petri_bgr = astimp.getPetriDish(bgr, channel_order="BGR")
+    assert np.array_equal(petri_bgr.img, petri_rgb.img)
+    crop_bgr = np.ascontiguousarray(petri_rgb.img[:, :, ::-1])
+    pellets_bgr = astimp.find_atb_pellets(crop_bgr, channel_order="BGR")
+    pellets_rgb = astimp.find_atb_pellets(petri_rgb.img)
+    assert [(c.center, c.radius) for c in pellets_bgr] == \
+        [(c.center, c.radius) for c in pellets_rgb]
+
 with logged_action("find pellets"):
     circles = astimp.find_atb_pellets(crop)
     pellets = [astimp.cutOnePelletInImage(crop, circle) for circle in circles]
@@ -79,7 +102,71 @@ with logged_action("preprocessing"):
 
 with logged_action("measure diameters"):
     disks = astimp.measureDiameters(preproc)
+
+with logged_action("pickle preprocessing"):
+    import pickle
+    preproc2 = pickle.loads(pickle.dumps(preproc))
+    assert np.array_equal(preproc2.img, preproc.img)
+    assert [d.diameter for d in astimp.measureDiameters(preproc2)] == \
+        [d.diameter for d in disks]
+
+with logged_action("update preprocessing"):
+    kept = astimp.inhib_diam_preprocessing(crop, circles, keep_state=True)
+    updated = astimp.update_inhib_diam_preprocessing(kept, crop, circles)
+    assert np.array_equal(updated.img, preproc.img)
+    # without the intermediate results, the preprocessing is run again
+    updated = astimp.update_inhib_diam_preprocessing(preproc2, crop, circles)
+    assert [d.diameter for d in astimp.measureDiameters(updated)] == \
+        [d.diameter for d in disks]
     
 # print()
 # for disk in disks:
 #     print(disk.diameter, disk.confidence)
+
+with logged_action("local configuration"):
+    petri = astimp.getPetriDish(im_np)
+    petri_circles = astimp.find_atb_pellets(petri.img)
+    petri_preproc = astimp.inhib_diam_preprocessing(petri, petri_circles)
+    default_diam = astimp.config.Pellets_DiamInMillimeters
+    half = astimp.config.copy()
+    half.Pellets_DiamInMillimeters = default_diam / 2
+    assert astimp.config.Pellets_DiamInMillimeters == default_diam
+    with astimp.LocalConfig(Pellets_DiamInMillimeters=default_diam / 2) as cfg:
+        assert cfg.Pellets_DiamInMillimeters == default_diam / 2
+        local_disks = astimp.measureDiameters(petri_preproc)
+    assert [d.diameter for d in local_disks] == \
+        [d.diameter for d in astimp.measureDiameters(petri_preproc, half)]
+
+with logged_action("fixed rig"):
+    rig = astimp.PetriDishRig()
+    assert not rig.is_calibrated
+    rig.calibrate(im_np)
+    rig_petri = rig.get_petri_dish(im_np)
+    bb = lambda r: (r.x, r.y, r.width, r.height)
+    assert bb(rig_petri.boundingBox) == bb(petri.boundingBox)
+    assert bb(rig.bounding_box) == bb(petri.boundingBox)
+    assert rig.stats == {"fast_path": 1, "grab_cut": 0, "recalibrations": 0}
+
+with logged_action("batch analysis"):
+    batch = [im_np, img_path, "../tests/images/foo.jpg"]
+    results = sorted(astimp.analyze_batch(batch, workers=2), key=lambda r: r.index)
+    assert [r.index for r in results] == [0, 1, 2]
+    assert results[0].ok and results[1].ok and not results[2].ok
+    assert [c.center for c in results[0].circles] == [c.center for c in petri_circles]
+    assert [d.diameter for d in results[0].inhibitions] == \
+        [d.diameter for d in astimp.measureDiameters(petri_preproc)]
+    assert [l.text for l in results[0].labels] == [l.text for l in results[1].labels]
+
+with logged_action("streaming analysis"):
+    with open(img_path, "rb") as f:
+        img_bytes = f.read()
+    plates = iter([img_path, img_bytes, b"not an image", im_np] * 3)
+    records = list(astimp.analyze_stream(plates, workers=2, max_in_flight=3,
+                                         ordered=True))
+    assert [r.index for r in records] == list(range(12))
+    assert [r.ok for r in records] == [True, True, False, True] * 3
+    assert records[0].source == img_path and records[1].source is None
+    assert [p.diameter for p in records[0].pellets] == \
+        [d.diameter for d in results[1].inhibitions]
+    assert [p.label for p in records[1].pellets] == \
+        [l.text for l in results[1].labels]
@@ -0,0 +1,78 @@
+# Lint as: python3
+"""
+Compares the crop engines of getPetriDish (astimp.CROP_ENGINE) on a set of
+images: time of each engine, and intersection over union of its Petri dish
+bounding box with the one found by GrabCut.
+
+usage: python3 crop_engine_comparison.py images/*.jpg [-r repetitions]
+"""
+
+import time
+import astimp
+import numpy as np
+from argparse import ArgumentParser
+from imageio import imread
+
+ENGINES = {"grabcut": astimp.CROP_ENGINE.GRABCUT,
+           "circle_fit": astimp.CROP_ENGINE.CIRCLE_FIT,
+           "auto": astimp.CROP_ENGINE.AUTO}
+
+
+def iou(a, b):
+    w = min(a.right, b.right) - max(a.left, b.left)
+    h = min(a.bottom, b.bottom) - max(a.top, b.top)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (a.width * a.height + b.width * b.height - inter)
+
+
+def crop(img, engine, repetitions):
+    """Returns the bounding box found by the engine (None if it failed) and
+    the mean time of a crop."""
+    config = astimp.config.copy()
+    config.PetriDish_cropEngine = engine
+    try:
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            petri = astimp.getPetriDish(img, config)
+        elapsed = (time.perf_counter() - start) / repetitions
+    except Exception:
+        return None, None
+    return petri.boundingBox, elapsed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-r", "--repetitions", type=int, default=3)
+    args = parser.parse_args()
+
+    times = {name: [] for name in ENGINES}
+    ious = {name: [] for name in ENGINES}
+    failures = {name: 0 for name in ENGINES}
+    for path in args.images:
+        img = np.array(imread(path))
+        boxes = {}
+        for name, engine in ENGINES.items():
+            boxes[name], elapsed = crop(img, engine, args.repetitions)
+            if boxes[name] is None:
+                failures[name] += 1
+            else:
+                times[name].append(elapsed)
+        if boxes["grabcut"] is None:
+            continue
+        for name in ENGINES:
+            if boxes[name] is not None:
+                ious[name].append(iou(boxes[name], boxes["grabcut"]))
+
+    print("engine\t\ttime (ms)\tIoU mean\tIoU min\t\tIoU<0.9\tfailures")
+    for name in ENGINES:
+        if not times[name]:
+            print("{:12s}\t-\t\t-\t\t-\t\t-\t{}".format(name, failures[name]))
+            continue
+        engine_ious = np.array(ious[name]) if ious[name] else np.array([np.nan])
+        print("{:12s}\t{:.1f}\t\t{:.3f}\t\t{:.3f}\t\t{}\t{}".format(
+            name, 1000 * np.mean(times[name]), np.mean(engine_ious),
+            np.min(engine_ious), int(np.sum(engine_ious < 0.9)),
+            failures[name]))
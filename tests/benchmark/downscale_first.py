@@ -0,0 +1,81 @@
+# Lint as: python3
+"""
+Compares the inhibition preprocessing run at the resolution of the pictures
+(default) and resampled to Inhibition_preprocImg_px_per_mm first
+(Inhibition_downscaleFirst) on the images of a golden annotation file:
+measured diameters and preprocessing time.
+
+usage: python3 downscale_first.py [-c golden_file.yml] [-i image_dir]
+"""
+
+import os
+import time
+import astimp
+import numpy as np
+from argparse import ArgumentParser
+from imageio import imread
+from benchmark_utils import parse_and_validate_config
+
+
+def run(petri, circles, downscale_first):
+    """Preprocesses and measures a plate, returns the diameters and the
+    preprocessing time."""
+    config = astimp.config.copy()
+    config.Inhibition_downscaleFirst = downscale_first
+    start = time.perf_counter()
+    preproc = astimp.inhib_diam_preprocessing(petri, circles, config)
+    elapsed = time.perf_counter() - start
+    diameters = [d.diameter for d in astimp.measureDiameters(preproc, config)]
+    return diameters, elapsed
+
+
+def compare_one_image(path):
+    img = np.array(imread(path))
+    petri = astimp.getPetriDish(img)
+    circles = astimp.find_atb_pellets(petri.img)
+    if not circles:
+        return None
+    ref, ref_time = run(petri, circles, False)
+    new, new_time = run(petri, circles, True)
+    return {"diameters": np.abs(np.subtract(ref, new)),
+            "time": (ref_time, new_time),
+            "megapixels": petri.img.shape[0] * petri.img.shape[1] / 1e6}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--config_file", dest="config_file",
+                        default="annotations/amman/amman_golden.yml",
+                        help="Path to the file containing expected AST results.")
+    parser.add_argument("-i", "--image_dir", dest="image_dir",
+                        default="images/",
+                        help="Path of the directory containing AST images.")
+    args = parser.parse_args()
+
+    golden = parse_and_validate_config(args.config_file)
+    comparisons = []
+    for filename in golden:
+        path = os.path.join(args.image_dir, filename)
+        if not os.path.exists(path):
+            continue
+        try:
+            result = compare_one_image(path)
+        except Exception as e:
+            print("Error {} {}".format(filename, e))
+            continue
+        if result is not None:
+            comparisons.append(result)
+
+    if not comparisons:
+        raise SystemExit("no image could be processed")
+
+    diffs = np.concatenate([c["diameters"] for c in comparisons])
+    print("plates compared: {} (mean crop {:.1f} MP)".format(
+        len(comparisons), np.mean([c["megapixels"] for c in comparisons])))
+    print("diameter abs diff (mm): max {:.2f}  mean {:.3f}  <= 0.5mm: {:.1f}%  "
+          "identical: {:.1f}%".format(diffs.max(), diffs.mean(),
+                                     100 * np.mean(diffs <= 0.5),
+                                     100 * np.mean(diffs == 0)))
+    times = np.array([c["time"] for c in comparisons])
+    print("preprocessing time (s/plate): default {:.3f}  downscale first {:.3f}"
+          .format(*times.mean(axis=0)))
@@ -0,0 +1,70 @@
+# Lint as: python3
+"""
+Compares the latency of an interactive edit of the pellets of a plate when the
+inhibition preprocessing is run from scratch and when it is updated with
+astimp.update_inhib_diam_preprocessing.
+
+usage: python3 incremental_preprocessing.py image [image ...] [-r repetitions]
+
+For each plate, each pellet in turn is removed, then moved by a few pixels.
+The times are the median over the edits (in ms), the diameter difference is
+the largest difference between the updated and the from scratch measures (in
+mm).
+"""
+
+import astimp
+import numpy as np
+import time
+from argparse import ArgumentParser
+from imageio import imread
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def diameters(preproc):
+    return np.array([d.diameter for d in astimp.measureDiameters(preproc)])
+
+
+def edits(circles):
+    """all the pellets with one of them removed, then moved"""
+    for i in range(len(circles)):
+        yield "remove", circles[:i] + circles[i + 1:]
+    for i in range(len(circles)):
+        c = circles[i]
+        moved = astimp.Circle((c.center[0] + 3, c.center[1] - 2), c.radius)
+        yield "move", circles[:i] + [moved] + circles[i + 1:]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-r", "--repetitions", type=int, default=1)
+    args = parser.parse_args()
+
+    print("image\tpellets\tedit\tfull_ms\tupdate_ms\tmax_diam_diff_mm")
+    for path in args.images:
+        petri = astimp.getPetriDish(imread(path))
+        circles = astimp.find_atb_pellets(petri.img)
+        if len(circles) < 3:
+            continue
+        preproc = astimp.inhib_diam_preprocessing(petri, circles,
+                                                  keep_state=True)
+        times = {}
+        for edit, edited in edits(circles):
+            for _ in range(args.repetitions):
+                full_ms, full = timed(astimp.inhib_diam_preprocessing,
+                                      petri, edited)
+                update_ms, updated = timed(
+                    astimp.update_inhib_diam_preprocessing,
+                    preproc, petri, edited)
+                diff = np.max(np.abs(diameters(full) - diameters(updated)))
+                times.setdefault(edit, []).append((full_ms, update_ms, diff))
+        for edit, values in times.items():
+            values = np.array(values)
+            print("{}\t{}\t{}\t{:.1f}\t{:.1f}\t{:.2f}".format(
+                path, len(circles), edit, np.median(values[:, 0]),
+                np.median(values[:, 1]), np.max(values[:, 2])))
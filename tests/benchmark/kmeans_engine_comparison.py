@@ -0,0 +1,88 @@
+# Lint as: python3
+"""
+Compares the k-means engines used in inhibition preprocessing
+(astimp.KMEANS_ENGINE.OPENCV and astimp.KMEANS_ENGINE.HISTOGRAM) on the images
+of a golden annotation file: k-means centers, measured diameters and time.
+
+usage: python3 kmeans_engine_comparison.py [-c golden_file.yml] [-i image_dir]
+"""
+
+import os
+import time
+import astimp
+import numpy as np
+from argparse import ArgumentParser
+from imageio import imread
+from benchmark_utils import parse_and_validate_config
+
+ENGINES = {"opencv": astimp.KMEANS_ENGINE.OPENCV,
+           "histogram": astimp.KMEANS_ENGINE.HISTOGRAM}
+
+
+def run_engine(petri, circles, engine):
+    """Preprocesses and measures a plate with the given k-means engine.
+    Returns the preprocessing result, the diameters and the elapsed time."""
+    astimp.config.Inhibition_kmeansEngine = engine
+    start = time.perf_counter()
+    preproc = astimp.inhib_diam_preprocessing(petri, circles)
+    elapsed = time.perf_counter() - start
+    diameters = [d.diameter for d in astimp.measureDiameters(preproc)]
+    return preproc, diameters, elapsed
+
+
+def compare_one_image(path):
+    img = np.array(imread(path))
+    petri = astimp.getPetriDish(img)
+    circles = astimp.find_atb_pellets(petri.img)
+    if not circles:
+        return None
+    results = {name: run_engine(petri, circles, engine)
+               for name, engine in ENGINES.items()}
+    ref, new = results["opencv"], results["histogram"]
+    return {
+        "global": np.abs(np.subtract(ref[0].km_centers, new[0].km_centers)),
+        "local": np.abs(np.subtract(ref[0].km_centers_local,
+                                    new[0].km_centers_local)).ravel(),
+        "diameters": np.abs(np.subtract(ref[1], new[1])),
+        "time": (ref[2], new[2]),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--config_file", dest="config_file",
+                        default="annotations/amman/amman_golden.yml",
+                        help="Path to the file containing expected AST results.")
+    parser.add_argument("-i", "--image_dir", dest="image_dir",
+                        default="images/",
+                        help="Path of the directory containing AST images.")
+    args = parser.parse_args()
+
+    golden = parse_and_validate_config(args.config_file)
+    engine = astimp.config.Inhibition_kmeansEngine
+    comparisons = []
+    for filename in golden:
+        path = os.path.join(args.image_dir, filename)
+        if not os.path.exists(path):
+            continue
+        try:
+            result = compare_one_image(path)
+        except Exception as e:
+            print("Error {} {}".format(filename, e))
+            continue
+        if result is not None:
+            comparisons.append(result)
+    astimp.config.Inhibition_kmeansEngine = engine
+
+    if not comparisons:
+        raise SystemExit("no image could be processed")
+
+    print("plates compared:", len(comparisons))
+    for key in ("global", "local", "diameters"):
+        diffs = np.concatenate([c[key] for c in comparisons])
+        print("{:10s} max abs diff: {:.2f}  mean: {:.3f}  identical: {:.1f}%"
+              .format(key, diffs.max(), diffs.mean(),
+                      100 * np.mean(diffs == 0)))
+    times = np.array([c["time"] for c in comparisons])
+    print("preprocessing time (s/plate): opencv {:.3f}  histogram {:.3f}"
+          .format(*times.mean(axis=0)))
@@ -0,0 +1,54 @@
+# Lint as: python3
+"""
+Compares the time spent in the local k-means of inhib_diam_preprocessing
+when the inhibition ROIs are clustered serially and in parallel.
+
+usage: python3 local_kmeans_timing.py image [image ...] [-r repetitions]
+
+Timings are grouped by number of pellets found on the plate (e.g. 12- and
+16-disk panels).
+"""
+
+import astimp
+import numpy as np
+from argparse import ArgumentParser
+from collections import defaultdict
+from imageio import imread
+
+
+def preprocess(img, repetitions):
+    """Runs the preprocessing repetitions times, returns the timings"""
+    petri = astimp.getPetriDish(img)
+    circles = astimp.find_atb_pellets(petri.img)
+    astimp.reset_inhib_preproc_timings()
+    for _ in range(repetitions):
+        preproc = astimp.inhib_diam_preprocessing(petri, circles)
+    return len(circles), preproc, astimp.get_inhib_preproc_timings()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-r", "--repetitions", type=int, default=5)
+    args = parser.parse_args()
+
+    # local k-means time per plate, by number of pellets
+    timings = defaultdict(lambda: {False: [], True: []})
+    for path in args.images:
+        img = np.array(imread(path))
+        results = {}
+        for parallel in (False, True):
+            astimp.config.Inhibition_parallelLocalKmeans = parallel
+            n, preproc, t = preprocess(img, args.repetitions)
+            timings[n][parallel].append(t["localKmeansMs"] / t["calls"])
+            results[parallel] = preproc
+        if results[False].km_centers_local != results[True].km_centers_local:
+            print("WARNING: serial and parallel results differ for", path)
+    astimp.config.Inhibition_parallelLocalKmeans = True
+
+    print("pellets\tplates\tserial_ms\tparallel_ms\tspeedup")
+    for n in sorted(timings):
+        serial = np.mean(timings[n][False])
+        parallel = np.mean(timings[n][True])
+        print("{}\t{}\t{:.1f}\t{:.1f}\t{:.2f}".format(
+            n, len(timings[n][False]), serial, parallel, serial / parallel))
@@ -0,0 +1,84 @@
+// Micro-benchmark of the step fit used to measure inscribed inhibition
+// diameters: compares fitStepFunction (cumulative errors, linear in the
+// profile length) with the previous search, which summed the errors on both
+// sides of every candidate step (quadratic in the profile length).
+// The profiles are in [0,255], like the radial profiles. The sums of the
+// previous search go through a float: beyond about 258 samples they lose bits
+// and the results may differ (see fitStepFunction).
+//
+// usage: stepFitBenchmark [repetitions]
+
+#include <chrono>
+#include <climits>
+#include <cstdlib>
+#include <iostream>
+#include <numeric>
+#include <random>
+
+#include "utils.hpp"
+
+static double squareError(vector<float>::iterator first,
+                          vector<float>::iterator last, float m) {
+    return accumulate(first, last, 0,
+                      [m](float x, float y) { return x + pow((y - m), 2); });
+}
+
+static size_t quadraticStepFit(vector<float>::iterator first,
+                               vector<float>::iterator last, float lv,
+                               float hv, double *mse) {
+    size_t n = last - first;
+    size_t step = 0;
+    *mse = squareError(first, last, hv) / n;
+    for (size_t i = 1; i < n; i++) {
+        double curr_mse = (squareError(first, first + i, lv) +
+                           squareError(first + i, last, hv)) /
+                          n;
+        if (curr_mse < *mse) {
+            *mse = curr_mse;
+            step = i;
+        }
+    }
+    return step;
+}
+
+int main(int argc, char **argv) {
+    int repetitions = argc > 1 ? atoi(argv[1]) : 200;
+    mt19937 gen(0);
+    uniform_real_distribution<float> noise(-0.2, 0.2);
+
+    cout << "length\tquadratic_us\tlinear_us\tspeedup\tidentical" << endl;
+    for (size_t n : {50, 100, 200, 400, 800, 1600, 3200}) {
+        vector<float> profile(n);
+        for (size_t i = 0; i < n; i++) {
+            float v = (i < n / 3 ? 0.f : 1.f) + noise(gen);
+            profile[i] = min(max(v, 0.f), 1.f) * UCHAR_MAX;
+        }
+
+        using clock = chrono::steady_clock;
+        double mse_quadratic = 0, mse_linear = 0;
+        size_t step_quadratic = 0, step_linear = 0;
+
+        auto t0 = clock::now();
+        for (int r = 0; r < repetitions; r++) {
+            step_quadratic = quadraticStepFit(profile.begin(), profile.end(),
+                                              0, UCHAR_MAX, &mse_quadratic);
+        }
+        auto t1 = clock::now();
+        for (int r = 0; r < repetitions; r++) {
+            step_linear = fitStepFunction(profile.begin(), profile.end(), 0,
+                                          UCHAR_MAX, &mse_linear);
+        }
+        auto t2 = clock::now();
+
+        double quadratic_us =
+            chrono::duration<double, micro>(t1 - t0).count() / repetitions;
+        double linear_us =
+            chrono::duration<double, micro>(t2 - t1).count() / repetitions;
+        bool identical =
+            step_quadratic == step_linear && mse_quadratic == mse_linear;
+        cout << n << "\t" << quadratic_us << "\t" << linear_us << "\t"
+             << quadratic_us / linear_us << "\t" << boolalpha << identical
+             << endl;
+    }
+    return 0;
+}
@@ -0,0 +1,72 @@
+# Lint as: python3
+"""
+Analyzes a directory of plates with astimp.analyze_stream and reports the
+throughput and the peak memory of the process as the plates go by.
+
+usage: python3 stream_analysis.py image_dir [-w workers] [-m max_in_flight]
+                                  [-r rounds] [--ordered] [--bytes]
+
+The images are given by path (or, with --bytes, by file content read in the
+main thread). With compact records the peak memory should stop growing after
+the first max_in_flight plates, whatever the number of plates.
+"""
+
+import astimp
+import glob
+import os
+import resource
+import time
+from argparse import ArgumentParser
+from itertools import chain, repeat
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_bytes(paths):
+    for path in paths:
+        with open(path, "rb") as f:
+            yield f.read()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("image_dir")
+    parser.add_argument("-w", "--workers", type=int, default=0)
+    parser.add_argument("-m", "--max-in-flight", type=int, default=0)
+    parser.add_argument("-r", "--rounds", type=int, default=1,
+                        help="number of times the directory is analyzed")
+    parser.add_argument("--ordered", action="store_true")
+    parser.add_argument("--bytes", action="store_true",
+                        help="give the file contents instead of the paths")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.image_dir, "*.jpg")) +
+                   glob.glob(os.path.join(args.image_dir, "*.JPG")) +
+                   glob.glob(os.path.join(args.image_dir, "*.png")))
+    plates = chain.from_iterable(repeat(paths, args.rounds))
+    if args.bytes:
+        plates = read_bytes(plates)
+
+    n_plates = n_errors = n_pellets = 0
+    start = time.perf_counter()
+    print("plates\tplates/s\tpeak_rss_mb")
+    for record in astimp.analyze_stream(plates, workers=args.workers,
+                                        max_in_flight=args.max_in_flight,
+                                        ordered=args.ordered):
+        n_plates += 1
+        if record.ok:
+            n_pellets += len(record.pellets)
+        else:
+            n_errors += 1
+        if n_plates % 50 == 0:
+            elapsed = time.perf_counter() - start
+            print("{}\t{:.2f}\t{:.0f}".format(
+                n_plates, n_plates / elapsed, peak_rss_mb()))
+
+    elapsed = time.perf_counter() - start
+    print("{} plates ({} errors, {} pellets) in {:.1f}s, {:.2f} plates/s, "
+          "peak memory {:.0f}MB".format(n_plates, n_errors, n_pellets, elapsed,
+                                        n_plates / elapsed, peak_rss_mb()))
@@ -0,0 +1,74 @@
+# Lint as: python3
+"""
+Measures the throughput of the analysis of plates in a pool of python threads,
+for an increasing number of threads.
+
+usage: python3 thread_scaling.py image [image ...] [-t max_threads] [-r rounds]
+
+astimp releases the GIL while its C++ code runs, so the throughput should grow
+almost linearly with the number of threads, up to the number of cores.
+The parallel loops inside astimp are disabled (unless --inner-parallel is
+given) so that only the threads of the pool compete for the cores.
+"""
+
+import astimp
+import numpy as np
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from imageio import imread
+
+
+def analyze(img):
+    """Crops the plate, finds the pellets and measures the inhibition diameters"""
+    petri = astimp.getPetriDish(img)
+    circles = astimp.find_atb_pellets(petri.img)
+    preproc = astimp.inhib_diam_preprocessing(petri, circles)
+    return [d.diameter for d in astimp.measureDiameters(preproc)]
+
+
+def run(images, n_threads):
+    """Analyzes all the images with n_threads threads.
+    Returns the elapsed time (s) and the results."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        results = list(executor.map(analyze, images))
+    return time.perf_counter() - start, results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-t", "--max-threads", type=int,
+                        default=os.cpu_count())
+    parser.add_argument("-r", "--rounds", type=int, default=4,
+                        help="number of times each image is analyzed")
+    parser.add_argument("--inner-parallel", action="store_true",
+                        help="keep the parallel loops inside astimp enabled")
+    args = parser.parse_args()
+
+    astimp.config.Inhibition_parallelMeasurement = args.inner_parallel
+    astimp.config.Inhibition_parallelLocalKmeans = args.inner_parallel
+
+    images = [np.array(imread(path)) for path in args.images]
+    images = images * args.rounds
+
+    # warm-up (label model loading, caches)
+    run(images[:1], 1)
+
+    print("threads\tplates/s\tspeedup\tefficiency")
+    reference_time, reference = run(images, 1)
+    for n_threads in range(1, args.max_threads + 1):
+        if n_threads == 1:
+            elapsed, results = reference_time, reference
+        else:
+            elapsed, results = run(images, n_threads)
+        if results != reference:
+            print("WARNING: results differ with {} threads".format(n_threads))
+        speedup = reference_time / elapsed
+        print("{}\t{:.2f}\t{:.2f}\t{:.2f}".format(
+            n_threads, len(images) / elapsed, speedup, speedup / n_threads))
+
+    astimp.config.Inhibition_parallelMeasurement = True
+    astimp.config.Inhibition_parallelLocalKmeans = True
@@ -0,0 +1,154 @@
+#include <gtest/gtest.h>
+#include <test_config.h>
+
+#include <algorithm>
+#include <climits>
+#include <numeric>
+#include <random>
+#include <type_traits>
+
+#include "astimp.hpp"
+#include "utils.hpp"
+
+// Step fit as computed before fitStepFunction, testing every step position
+// against the whole profile. The errors are summed in Acc: int is the
+// previous search (the sum goes through a float), long long sums the
+// truncated errors exactly.
+template <typename Acc>
+static size_t referenceStepFit(vector<float>::iterator first,
+                               vector<float>::iterator last, float lv,
+                               float hv, double *mse) {
+    auto squareError = [](vector<float>::iterator first,
+                          vector<float>::iterator last, float m) {
+        return (double)accumulate(first, last, (Acc)0, [m](Acc x, float y) {
+            return std::is_same<Acc, int>::value
+                       ? (Acc)((float)x + pow((y - m), 2))
+                       : x + (Acc)pow((y - m), 2);
+        });
+    };
+    size_t n = last - first;
+    size_t step = 0;
+    *mse = squareError(first, last, hv) / n;
+    for (size_t i = 1; i < n; i++) {
+        double curr_mse = (squareError(first, first + i, lv) +
+                           squareError(first + i, last, hv)) /
+                          n;
+        if (curr_mse < *mse) {
+            *mse = curr_mse;
+            step = i;
+        }
+    }
+    return step;
+}
+
+// noisy step with values in [0,255], like a PROFILE_SWITCH radial profile,
+// with some samples exactly equal to 0 and 255
+static vector<float> noisyStep(size_t n, size_t true_step, mt19937 &gen) {
+    uniform_real_distribution<float> noise(-0.3, 0.3);
+    uniform_int_distribution<int> level(0, 4);
+    vector<float> profile(n);
+    for (size_t i = 0; i < n; i++) {
+        float v = (i < true_step ? 0.f : 1.f) + noise(gen);
+        if (level(gen) == 0) v = level(gen) / 4.f;
+        profile[i] = min(max(v, 0.f), 1.f) * UCHAR_MAX;
+    }
+    return profile;
+}
+
+template <typename Acc>
+static void expectSameFit(vector<float> &profile) {
+    auto minmax = minmax_element(profile.begin(), profile.end());
+    double mse, expected_mse;
+    size_t step = fitStepFunction(profile.begin(), profile.end(),
+                                  *minmax.first, *minmax.second, &mse);
+    size_t expected_step =
+        referenceStepFit<Acc>(profile.begin(), profile.end(), *minmax.first,
+                              *minmax.second, &expected_mse);
+    ASSERT_EQ(expected_step, step) << "length " << profile.size();
+    ASSERT_EQ(expected_mse, mse) << "length " << profile.size();
+}
+
+TEST(fitStepFunction, matchesReference) {
+    // the sums of the previous search stay below 2^24 (258 * 255^2)
+    mt19937 gen(42);
+    for (size_t n : {1, 2, 10, 50, 200, 250}) {
+        for (int trial = 0; trial < 20; trial++) {
+            vector<float> profile = noisyStep(n, n * trial / 20, gen);
+            expectSameFit<int>(profile);
+        }
+    }
+}
+
+TEST(fitStepFunction, exactSumsOnLongProfiles) {
+    // the previous search loses bits of its sums, the errors are summed
+    // exactly instead
+    mt19937 gen(42);
+    for (size_t n : {500, 1000, 2000, 5000}) {
+        for (int trial = 0; trial < 20; trial++) {
+            vector<float> profile = noisyStep(n, n * trial / 20, gen);
+            expectSameFit<long long>(profile);
+        }
+    }
+
+    // far from both levels, the errors of the best step sum above 2^24: the
+    // previous search gives other results
+    uniform_real_distribution<float> middle(0.3, 0.7);
+    size_t differences = 0;
+    for (int trial = 0; trial < 20; trial++) {
+        vector<float> profile(2000);
+        for (float &v : profile) v = middle(gen) * UCHAR_MAX;
+        profile.front() = 0;
+        profile.back() = UCHAR_MAX;
+        expectSameFit<long long>(profile);
+
+        double mse, previous_mse;
+        size_t step = fitStepFunction(profile.begin(), profile.end(), 0,
+                                      UCHAR_MAX, &mse);
+        size_t previous_step = referenceStepFit<int>(
+            profile.begin(), profile.end(), 0, UCHAR_MAX, &previous_mse);
+        differences += step != previous_step || mse != previous_mse;
+    }
+    EXPECT_GT(differences, 0u);
+}
+
+TEST(fitStepFunction, matchesReferenceOnPlate) {
+    // profiles measured with the default configuration
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+    astimp::PetriDish petri = astimp::getPetriDish(img);
+    vector<astimp::Circle> circles = astimp::find_atb_pellets(petri.img);
+    astimp::InhibDiamPreprocResult preproc =
+        astimp::inhib_diam_preprocessing(petri, circles);
+    size_t pellet_r_px =
+        (size_t)ceil(astimp::getConfig()->Pellets.DiamInMillimeters *
+                     preproc.px_per_mm / 2.0);
+
+    for (size_t i = 0; i < circles.size(); i++) {
+        vector<float> profile = astimp::radial_profile(
+            preproc, i, astimp::PROFILE_SWITCH,
+            preproc.km_thresholds_local[i] / (float)UCHAR_MAX);
+        if (profile.size() <= pellet_r_px) continue;
+        vector<float> fitted(profile.begin() + pellet_r_px, profile.end());
+        EXPECT_LT(fitted.size(), 258u);
+        expectSameFit<int>(fitted);
+    }
+}
+
+TEST(fitStepFunction, largeValues) {
+    vector<float> profile = {0, 0, 3, 1, 250, 255, 240, 255, 255};
+    double mse, expected_mse;
+    size_t step =
+        fitStepFunction(profile.begin(), profile.end(), 0, 255, &mse);
+    size_t expected_step = referenceStepFit<int>(
+        profile.begin(), profile.end(), 0, 255, &expected_mse);
+    EXPECT_EQ(4, step);
+    EXPECT_EQ(expected_step, step);
+    EXPECT_EQ(expected_mse, mse);
+}
+
+TEST(fitStepFunction, emptyProfile) {
+    vector<float> profile;
+    EXPECT_THROW(fitStepFunction(profile.begin(), profile.end(), 0, 1),
+                 astimp::Exception::generic);
+}
@@ -0,0 +1,144 @@
+#include <gtest/gtest.h>
+#include <test_config.h>
+
+#include <cstring>
+#include <thread>
+
+#include "astimp.hpp"
+
+namespace {
+
+bool sameCrop(const astimp::PetriDish &a, const astimp::PetriDish &b) {
+    if (a.boundingBox != b.boundingBox || a.isRound != b.isRound) return false;
+    if (a.img.size() != b.img.size() || a.img.type() != b.img.type()) {
+        return false;
+    }
+    for (int row = 0; row < a.img.rows; row++) {
+        if (memcmp(a.img.ptr(row), b.img.ptr(row),
+                   a.img.cols * a.img.elemSize()) != 0) {
+            return false;
+        }
+    }
+    return true;
+}
+
+}  // namespace
+
+TEST(getPetriDish, restoresTheThreadRNG) {
+    string path = test_img_path + string("test0.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    const uint64_t state = 12345;
+    cv::theRNG().state = state;
+    astimp::getPetriDish(img);
+    ASSERT_EQ(state, cv::theRNG().state);
+}
+
+TEST(getPetriDish, doesNotDependOnTheThreadRNG) {
+    string path = test_img_path + string("test0.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::PetriDish expected = astimp::getPetriDish(img);
+    cv::theRNG().state = 12345;
+    ASSERT_TRUE(sameCrop(expected, astimp::getPetriDish(img)));
+}
+
+TEST(getPetriDish, concurrentCropsSameAsSerial) {
+    /* Crops of several plates from a pool of threads are byte-identical to
+     the crops of the same plates done one after the other. */
+
+    vector<string> names = {"test0.jpg", "test-antibio-full.jpg",
+                            "test_blood_agar_0.jpg", "dzone.jpg"};
+    vector<cv::Mat> images;
+    vector<astimp::PetriDish> expected;
+    for (const string &name : names) {
+        cv::Mat img = cv::imread(test_img_path + name, cv::IMREAD_COLOR);
+        ASSERT_FALSE(img.empty()) << name;
+        images.push_back(img);
+        expected.push_back(astimp::getPetriDish(img));
+    }
+
+    const size_t numThreads = 8;
+    const size_t cropsPerThread = 2 * images.size();
+    vector<vector<astimp::PetriDish>> results(numThreads);
+    vector<std::thread> threads;
+    for (size_t t = 0; t < numThreads; t++) {
+        threads.emplace_back([&, t]() {
+            // each thread starts from a different RNG state
+            cv::theRNG().state = t + 1;
+            for (size_t k = 0; k < cropsPerThread; k++) {
+                size_t i = (t + k) % images.size();
+                results[t].push_back(astimp::getPetriDish(images[i]));
+            }
+        });
+    }
+    for (auto &thread : threads) thread.join();
+
+    for (size_t t = 0; t < numThreads; t++) {
+        ASSERT_EQ(cropsPerThread, results[t].size());
+        for (size_t k = 0; k < cropsPerThread; k++) {
+            size_t i = (t + k) % images.size();
+            ASSERT_TRUE(sameCrop(expected[i], results[t][k]))
+                << names[i] << " differs in thread " << t;
+        }
+    }
+}
+
+namespace {
+
+// Picture of a round Petri dish on a dark background.
+cv::Mat roundDishPicture(cv::Point center, int radius) {
+    cv::Mat img(800, 1000, CV_8UC3, cv::Scalar(20, 20, 20));
+    cv::circle(img, center, radius, cv::Scalar(170, 190, 200), -1);
+    cv::circle(img, center, radius - 15, cv::Scalar(140, 160, 170), -1);
+    return img;
+}
+
+astimp::PetriDish cropWithEngine(const cv::Mat &img,
+                                 astimp::CROP_ENGINE engine) {
+    astimp::ImprocConfig config = *astimp::getConfig();
+    config.PetriDish.cropEngine = engine;
+    return astimp::getPetriDish(img, config);
+}
+
+}  // namespace
+
+TEST(getPetriDish, circleFitFindsRoundDish) {
+    const cv::Point center(520, 390);
+    const int radius = 300;
+    cv::Mat img = roundDishPicture(center, radius);
+    const cv::Rect expected(center.x - radius, center.y - radius, 2 * radius,
+                            2 * radius);
+
+    astimp::PetriDish petri = cropWithEngine(img, astimp::CROP_CIRCLE_FIT);
+    ASSERT_TRUE(petri.isRound);
+    // one pixel of the resized picture is 5 pixels of the picture
+    const int tolerance = 15;
+    ASSERT_NEAR(expected.x, petri.boundingBox.x, tolerance);
+    ASSERT_NEAR(expected.y, petri.boundingBox.y, tolerance);
+    ASSERT_NEAR(expected.width, petri.boundingBox.width, 2 * tolerance);
+    ASSERT_NEAR(expected.height, petri.boundingBox.height, 2 * tolerance);
+    ASSERT_EQ(petri.boundingBox.size(), petri.img.size());
+
+    // the circle fit is confident for a round dish
+    ASSERT_TRUE(sameCrop(petri, cropWithEngine(img, astimp::CROP_AUTO)));
+}
+
+TEST(getPetriDish, autoEngineFallsBackToGrabCut) {
+    // the dish of test0.jpg is square
+    string path = test_img_path + string("test0.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::PetriDish expected = cropWithEngine(img, astimp::CROP_GRABCUT);
+    ASSERT_TRUE(sameCrop(expected, astimp::getPetriDish(img)));
+    ASSERT_TRUE(sameCrop(expected, cropWithEngine(img, astimp::CROP_AUTO)));
+}
+
+TEST(getPetriDish, circleFitThrowsWithoutDish) {
+    cv::Mat img(600, 800, CV_8UC3, cv::Scalar(20, 20, 20));
+    ASSERT_THROW(cropWithEngine(img, astimp::CROP_CIRCLE_FIT),
+                 astimp::Exception::generic);
+}
@@ -0,0 +1,57 @@
+#include <gtest/gtest.h>
+
+#include <random>
+
+#include "utils.hpp"
+
+// Optimal split by brute force: squared error of every threshold.
+static vector<int> bruteForce2Means(const vector<uint> &hist) {
+    double best_err = -1;
+    vector<int> best;
+    for (size_t t = 0; t + 1 < hist.size(); t++) {
+        double n[2] = {0, 0}, s[2] = {0, 0};
+        for (size_t v = 0; v < hist.size(); v++) {
+            n[v > t] += hist[v];
+            s[v > t] += (double)v * hist[v];
+        }
+        if (n[0] == 0 || n[1] == 0) continue;
+        double err = 0;
+        for (size_t v = 0; v < hist.size(); v++) {
+            double m = s[v > t] / n[v > t];
+            err += hist[v] * (v - m) * (v - m);
+        }
+        if (best_err < 0 || err < best_err - 1e-6) {
+            best_err = err;
+            best = {cvRound(s[0] / n[0]), cvRound(s[1] / n[1])};
+        }
+    }
+    return best;
+}
+
+TEST(histogram_2_means, twoModes) {
+    vector<uint> hist(256, 0);
+    hist[40] = 100;
+    hist[41] = 100;
+    hist[200] = 50;
+    EXPECT_EQ(vector<int>({40, 200}), histogram_2_means(hist));
+}
+
+TEST(histogram_2_means, sameAsBruteForce) {
+    mt19937 gen(1);
+    normal_distribution<double> inhib(60, 15), bacteria(150, 25);
+    for (int trial = 0; trial < 20; trial++) {
+        vector<uint> hist(256, 0);
+        for (int i = 0; i < 500 + 100 * trial; i++) {
+            double v = i % (trial + 2) ? bacteria(gen) : inhib(gen);
+            hist[min(max(cvRound(v), 0), 255)]++;
+        }
+        ASSERT_EQ(bruteForce2Means(hist), histogram_2_means(hist));
+    }
+}
+
+TEST(histogram_2_means, degenerateHistograms) {
+    vector<uint> hist(256, 0);
+    EXPECT_THROW(histogram_2_means(hist), astimp::Exception::generic);
+    hist[77] = 3;
+    EXPECT_EQ(vector<int>({77, 77}), histogram_2_means(hist));
+}
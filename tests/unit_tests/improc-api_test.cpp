@@ -1,9 +1,13 @@
 #include "improc-api.hpp"
 
+#include <fcntl.h>
 #include <gtest/gtest.h>
+#include <sys/stat.h>
 #include <test_config.h>
 
 #include <chrono>
+#include <fstream>
+#include <iterator>
 
 using namespace astimp;
 using namespace std::chrono;
@@ -174,3 +178,233 @@ TEST(measureOnePelletDiameter, measuresDZoneDiameter) {
     }
     ASSERT_TRUE(clindaFound);
 }
+
+static vector<uchar> readFileBytes(const string &path) {
+    ifstream file(path, ios::binary);
+    return vector<uchar>(istreambuf_iterator<char>(file),
+                         istreambuf_iterator<char>());
+}
+
+TEST(findPellets, inMemoryImagesSameAsPath) {
+    string path = test_img_path + string("test0_crop.jpg");
+    PelletsAndPxPerMm fromPath = findPellets(path);
+
+    vector<uchar> bytes = readFileBytes(path);
+    ASSERT_FALSE(bytes.empty());
+    PelletsAndPxPerMm fromBytes = findPellets(bytes);
+    ASSERT_EQ(fromPath.pellets, fromBytes.pellets);
+
+    PelletsAndPxPerMm fromMat = findPellets(cv::imread(path, cv::IMREAD_COLOR));
+    ASSERT_EQ(fromPath.pellets, fromMat.pellets);
+    ASSERT_EQ(fromPath.original_img_px_per_mm,
+              fromMat.original_img_px_per_mm);
+}
+
+TEST(findPetriDishWithRoi, inMemoryImagesSameAsPath) {
+    string path = test_img_path + string("test0.jpg");
+    cv::Rect roi(100, 500, 2800, 2800);
+    PetriDish fromPath = findPetriDishWithRoi(path, roi);
+    PetriDish fromBytes = findPetriDishWithRoi(readFileBytes(path), roi);
+    PetriDish fromMat =
+        findPetriDishWithRoi(cv::imread(path, cv::IMREAD_COLOR), roi);
+    ASSERT_EQ(fromPath.boundingBox, fromBytes.boundingBox);
+    ASSERT_EQ(fromPath.boundingBox, fromMat.boundingBox);
+}
+
+TEST(measureOnePelletDiameter, inMemoryImagesSameAsPath) {
+    string path = test_img_path + string("test0_crop.jpg");
+    vector<Circle> circles;
+    for (const Pellet &pellet : findPellets(path).pellets) {
+        circles.push_back(pellet.circle);
+    }
+    InhibDisk fromPath = measureOnePelletDiameter(path, circles, 0, INSCRIBED);
+    InhibDisk fromBytes =
+        measureOnePelletDiameter(readFileBytes(path), circles, 0, INSCRIBED);
+    ASSERT_EQ(fromPath, fromBytes);
+
+    Pellet pellet = findPellet(circles.back(), circles, readFileBytes(path));
+    ASSERT_EQ(circles.back(), pellet.circle);
+}
+
+TEST(decodeImage, throwsOnInvalidData) {
+    ASSERT_THROW(findPellets(vector<uchar>{1, 2, 3}),
+                 astimp::Exception::generic);
+    ASSERT_THROW(findPellets(vector<uchar>()), astimp::Exception::generic);
+}
+
+// Restores the budget of the image cache when going out of scope, even if an
+// assertion fails.
+struct ImgCacheBudgetGuard {
+    const size_t maxBytes = getImgCacheStats().maxBytes;
+    ~ImgCacheBudgetGuard() { setImgCacheMaxBytes(maxBytes); }
+};
+
+// Sets the modification time of a file to the given seconds and nanoseconds.
+static void setMtime(const string &path, time_t sec, long nsec) {
+    struct timespec times[2];
+    times[0].tv_sec = 0;
+    times[0].tv_nsec = UTIME_OMIT;  // access time
+    times[1].tv_sec = sec;
+    times[1].tv_nsec = nsec;
+    ASSERT_EQ(0, utimensat(AT_FDCWD, path.c_str(), times, 0));
+}
+
+TEST(ImgCache, hitsMissesAndEvictions) {
+    ImgCacheBudgetGuard budgetGuard;
+    string path0 = test_img_path + string("test0.jpg");
+    string path1 = test_img_path + string("test-antibio-full.jpg");
+    invalidateImgCache();
+    resetImgCacheStats();
+
+    cv::Mat img0 = readImage(path0);
+    ASSERT_EQ(img0.data, readImage(path0).data);
+    ImgCacheStats stats = getImgCacheStats();
+    ASSERT_EQ(1u, stats.misses);
+    ASSERT_EQ(1u, stats.hits);
+    ASSERT_EQ(1u, stats.entries);
+    const size_t imgBytes = img0.total() * img0.elemSize();
+    ASSERT_EQ(imgBytes, stats.bytes);
+
+    // room for one image only: reading another one evicts the first
+    setImgCacheMaxBytes(imgBytes);
+    readImage(path1);
+    stats = getImgCacheStats();
+    ASSERT_EQ(1u, stats.evictions);
+    ASSERT_EQ(1u, stats.entries);
+    readImage(path0);
+    ASSERT_EQ(3u, getImgCacheStats().misses);
+
+    invalidateImgCache(path0);
+    ASSERT_EQ(0u, getImgCacheStats().entries);
+    ASSERT_EQ(0u, getImgCacheStats().bytes);
+
+    // images larger than the budget are not cached
+    setImgCacheMaxBytes(imgBytes - 1);
+    readImage(path0);
+    ASSERT_EQ(0u, getImgCacheStats().entries);
+}
+
+TEST(ImgCache, readsModifiedFilesAgain) {
+    string path = "img_cache_test.png";
+    cv::imwrite(path, cv::Mat(10, 10, CV_8UC3, cv::Scalar(1, 2, 3)));
+    ASSERT_EQ(10, readImage(path).rows);
+
+    cv::imwrite(path, cv::Mat(20, 20, CV_8UC3, cv::Scalar(1, 2, 3)));
+    ASSERT_EQ(20, readImage(path).rows);
+    remove(path.c_str());
+
+    // rewritten with the same size within the same second: only the
+    // nanoseconds of the modification time differ
+    path = "img_cache_test.bmp";
+    struct stat fileStat;
+    cv::imwrite(path, cv::Mat(10, 10, CV_8UC3, cv::Scalar(1, 2, 3)));
+    setMtime(path, 1000000000, 100);
+    ASSERT_EQ(0, stat(path.c_str(), &fileStat));
+    const off_t size = fileStat.st_size;
+    ASSERT_EQ(1, readImage(path).at<cv::Vec3b>(0, 0)[0]);
+
+    cv::imwrite(path, cv::Mat(10, 10, CV_8UC3, cv::Scalar(4, 5, 6)));
+    setMtime(path, 1000000000, 200);
+    ASSERT_EQ(0, stat(path.c_str(), &fileStat));
+    ASSERT_EQ(size, fileStat.st_size);
+    ASSERT_EQ(4, readImage(path).at<cv::Vec3b>(0, 0)[0]);
+
+    remove(path.c_str());
+    ASSERT_THROW(readImage(path), astimp::Exception::generic);
+}
+
+TEST(PlateSession, sameAsFreeFunctions) {
+    string path = test_img_path + string("dzone.jpg");
+    vector<Pellet> pellets = findPellets(path).pellets;
+    ASSERT_GT(pellets.size(), 1u);
+    vector<Circle> circles;
+    for (const Pellet &pellet : pellets) circles.push_back(pellet.circle);
+
+    PlateSession session(path, circles);
+    const InhibDiamPreprocResult *preproc = &session.preprocessing();
+    for (size_t i = 0; i < circles.size(); i++) {
+        for (InhibMeasureMode mode : {INSCRIBED, CIRCUMSCRIBED}) {
+            ASSERT_EQ(measureOnePelletDiameter(path, circles, i, mode),
+                      session.measureOnePelletDiameter(i, mode));
+        }
+    }
+    // the preprocessing was not run again
+    ASSERT_EQ(preproc->img.data, session.preprocessing().img.data);
+
+    ASSERT_THROW(session.measureOnePelletDiameter(circles.size(), INSCRIBED),
+                 astimp::Exception::generic);
+}
+
+TEST(PlateSession, findPelletAddsThePellet) {
+    string path = test_img_path + string("test0_crop.jpg");
+    vector<Pellet> pellets = findPellets(path).pellets;
+    Pellet lastPellet = pellets.back();
+    vector<Circle> circles;
+    for (size_t i = 0; i + 1 < pellets.size(); i++) {
+        circles.push_back(pellets[i].circle);
+    }
+
+    PlateSession session(path, circles);
+    cv::Mat preprocImg = session.preprocessing().img;
+    Pellet pellet = session.findPellet(lastPellet.circle);
+    // the preprocessing is updated, not run from scratch: the diameter may
+    // differ slightly
+    Pellet expected = findPellet(lastPellet.circle, circles, path);
+    ASSERT_EQ(expected.circle, pellet.circle);
+    ASSERT_EQ(expected.labelMatch, pellet.labelMatch);
+    ASSERT_NEAR(expected.disk.diameter, pellet.disk.diameter, 0.5);
+    ASSERT_EQ(pellets.size(), session.circles().size());
+    ASSERT_EQ(lastPellet.circle, session.circles().back());
+    // the preprocessing was updated for the new pellet
+    ASSERT_NE(preprocImg.data, session.preprocessing().img.data);
+    ASSERT_EQ(pellet.disk, session.measureOnePelletDiameter(
+                               pellets.size() - 1, INSCRIBED));
+}
+
+TEST(rereadPlate, reusesPelletsOfShiftedPicture) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+    PlateReading first = readPlate(img);
+    ASSERT_FALSE(first.registered);
+    ASSERT_FALSE(first.pellets.empty());
+
+    // the plate moved by (40, 25) pixels in the new picture
+    const cv::Point moved(40, 25);
+    cv::Mat shifted;
+    cv::copyMakeBorder(img, shifted, moved.y, 0, moved.x, 0,
+                       cv::BORDER_REPLICATE);
+    shifted = shifted(cv::Rect(0, 0, img.cols, img.rows)).clone();
+
+    PlateReading second = rereadPlate(shifted, first);
+    ASSERT_TRUE(second.registered);
+    ASSERT_NEAR(first.boundingBox.x + moved.x, second.boundingBox.x, 1);
+    ASSERT_NEAR(first.boundingBox.y + moved.y, second.boundingBox.y, 1);
+    ASSERT_EQ(first.pellets.size(), second.pellets.size());
+    for (size_t i = 0; i < first.pellets.size(); i++) {
+        const Pellet &a = first.pellets[i];
+        const Pellet &b = second.pellets[i];
+        cv::Point2f inPicture =
+            b.circle.center + cv::Point2f(second.boundingBox.tl()) -
+            cv::Point2f(first.boundingBox.tl() + moved);
+        ASSERT_NEAR(a.circle.center.x, inPicture.x, 1);
+        ASSERT_NEAR(a.circle.center.y, inPicture.y, 1);
+        ASSERT_EQ(a.circle.radius, b.circle.radius);
+        ASSERT_EQ(a.labelMatch, b.labelMatch);
+        ASSERT_NEAR(a.disk.diameter, b.disk.diameter, 0.5);
+    }
+}
+
+TEST(rereadPlate, readsFromScratchWhenPelletsAreNotFound) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+    PlateReading first = readPlate(img);
+
+    PlateReading elsewhere = first;
+    elsewhere.boundingBox.x += img.cols;
+    PlateReading second = rereadPlate(img, elsewhere);
+    ASSERT_FALSE(second.registered);
+    ASSERT_EQ(first.boundingBox, second.boundingBox);
+    ASSERT_EQ(first.pellets, second.pellets);
+}
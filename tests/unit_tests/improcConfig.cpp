@@ -1,7 +1,10 @@
 #include <gtest/gtest.h>
 #include <test_config.h>
 
+#include <thread>
+
 #include "astimp.hpp"
+#include "utils.hpp"
 
 TEST(ImprocConfig, set_get_param) {
     /* the config object can be written and read correctly */
@@ -66,3 +69,88 @@ TEST(ImprocConfig, findAtbPelletsRespectsMaxRatio) {
     config->Pellets.maxPictureToPelletRatio = 10;
     ASSERT_EQ(astimp::find_atb_pellets(img).size(), 0);
 }
+
+TEST(ImprocConfig, scopedConfigOverridesTheCallingThread) {
+    const float default_diameter =
+        astimp::getConfig()->Pellets.DiamInMillimeters;
+    {
+        astimp::ScopedConfig scope(*astimp::getConfig());
+        scope.config()->Pellets.DiamInMillimeters = default_diameter + 1;
+        ASSERT_EQ(default_diameter + 1,
+                  astimp::getConfig()->Pellets.DiamInMillimeters);
+        {
+            astimp::ScopedConfig inner(*astimp::getConfig());
+            inner.config()->Pellets.DiamInMillimeters = default_diameter + 2;
+            ASSERT_EQ(default_diameter + 2,
+                      astimp::getConfig()->Pellets.DiamInMillimeters);
+        }
+        ASSERT_EQ(default_diameter + 1,
+                  astimp::getConfig()->Pellets.DiamInMillimeters);
+
+        // other threads keep the process default
+        float other_thread_diameter = 0;
+        std::thread t([&]() {
+            other_thread_diameter =
+                astimp::getConfig()->Pellets.DiamInMillimeters;
+        });
+        t.join();
+        ASSERT_EQ(default_diameter, other_thread_diameter);
+        ASSERT_EQ(default_diameter,
+                  astimp::getConfigWritable()->Pellets.DiamInMillimeters);
+    }
+    ASSERT_EQ(default_diameter, astimp::getConfig()->Pellets.DiamInMillimeters);
+}
+
+TEST(ImprocConfig, parallelTasksSeeTheCallerConfig) {
+    astimp::ImprocConfig config;
+    config.Pellets.DiamInMillimeters = 42;
+    astimp::ScopedConfig scope(config);
+
+    vector<float> seen(64, 0);
+    parallel_for_each_index(seen.size(), 0, [&](size_t i) {
+        seen[i] = astimp::getConfig()->Pellets.DiamInMillimeters;
+    });
+    for (float diameter : seen) ASSERT_EQ(42, diameter);
+}
+
+TEST(ImprocConfig, perCallConfigInConcurrentThreads) {
+    /* Two threads measure the same plate with different pellet diameters,
+     each gets the same result as a serial run with its own config. */
+
+    string path = test_img_path + string("phantom_picture_25.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::ImprocConfig configs[2];
+    configs[1].Pellets.DiamInMillimeters =
+        configs[0].Pellets.DiamInMillimeters / 2;
+
+    auto analyze = [&img](const astimp::ImprocConfig &config) {
+        astimp::PetriDish petri = astimp::getPetriDish(img, config);
+        vector<astimp::Circle> circles =
+            astimp::find_atb_pellets(petri.img, config);
+        astimp::InhibDiamPreprocResult inhib =
+            astimp::inhib_diam_preprocessing(petri, circles, config);
+        return astimp::measureDiameters(inhib, config);
+    };
+
+    vector<astimp::InhibDisk> expected[2] = {analyze(configs[0]),
+                                             analyze(configs[1])};
+    ASSERT_NE(expected[0], expected[1]);
+
+    const int rounds = 4;
+    vector<astimp::InhibDisk> results[2][rounds];
+    vector<std::thread> threads;
+    for (int k = 0; k < 2; k++) {
+        threads.emplace_back([&, k]() {
+            for (int r = 0; r < rounds; r++) {
+                results[k][r] = analyze(configs[k]);
+            }
+        });
+    }
+    for (auto &t : threads) t.join();
+
+    for (int k = 0; k < 2; k++) {
+        for (int r = 0; r < rounds; r++) ASSERT_EQ(expected[k], results[k][r]);
+    }
+}
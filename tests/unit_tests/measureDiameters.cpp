@@ -60,4 +60,103 @@ TEST(measureDiameters, onPhantomPicture_increasing) {
     for (size_t i = 0; i < disks.size(); i++) {
         ASSERT_EQ(round(disks[i].diameter), true_diameters[i]);
     }
-}
\ No newline at end of file
+}
+TEST(measureDiameters, parallelSameAsSerial) {
+    string path = test_img_path + string("phantom_picture_25.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::PetriDish petri = astimp::getPetriDish(img);
+    vector<astimp::Circle> circles = astimp::find_atb_pellets(petri.img);
+    astimp::InhibDiamPreprocResult inhib =
+        inhib_diam_preprocessing(petri, circles);
+
+    auto config = astimp::getConfigWritable();
+    bool parallelMeasurement = config->Inhibition.parallelMeasurement;
+    config->Inhibition.parallelMeasurement = false;
+    vector<astimp::InhibDisk> serial = astimp::measureDiameters(inhib);
+    config->Inhibition.parallelMeasurement = true;
+    vector<astimp::InhibDisk> parallel = astimp::measureDiameters(inhib);
+    config->Inhibition.parallelMeasurement = parallelMeasurement;
+
+    ASSERT_EQ(serial, parallel);
+}
+
+TEST(measureDiameters, parallelLocalKmeansSameAsSerial) {
+    string path = test_img_path + string("phantom_picture_25.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::PetriDish petri = astimp::getPetriDish(img);
+    vector<astimp::Circle> circles = astimp::find_atb_pellets(petri.img);
+
+    auto config = astimp::getConfigWritable();
+    bool parallelLocalKmeans = config->Inhibition.parallelLocalKmeans;
+    config->Inhibition.parallelLocalKmeans = false;
+    astimp::resetInhibPreprocTimings();
+    astimp::InhibDiamPreprocResult serial =
+        inhib_diam_preprocessing(petri, circles);
+    config->Inhibition.parallelLocalKmeans = true;
+    astimp::InhibDiamPreprocResult parallel =
+        inhib_diam_preprocessing(petri, circles);
+    config->Inhibition.parallelLocalKmeans = parallelLocalKmeans;
+
+    ASSERT_EQ(serial.km_centers_local, parallel.km_centers_local);
+    ASSERT_EQ(serial.km_thresholds_local, parallel.km_thresholds_local);
+
+    astimp::InhibPreprocTimings timings = astimp::getInhibPreprocTimings();
+    EXPECT_EQ(2, timings.calls);
+    EXPECT_EQ(2 * circles.size(), timings.localKmeansROIs);
+}
+
+TEST(measureDiameters, downscaleFirst) {
+    // same diameters when the plate is resampled before the median blur
+    string path = test_img_path + string("phantom_picture_increasing.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::PetriDish petri = astimp::getPetriDish(img);
+    vector<astimp::Circle> circles = astimp::find_atb_pellets(petri.img);
+    astimp::InhibDiamPreprocResult expected =
+        inhib_diam_preprocessing(petri, circles);
+
+    astimp::ImprocConfig config = *astimp::getConfig();
+    config.Inhibition.downscaleFirst = true;
+    astimp::InhibPreprocState state;
+    astimp::InhibDiamPreprocResult inhib =
+        inhib_diam_preprocessing(petri, circles, config, &state);
+    ASSERT_TRUE(state.downscaled);
+    ASSERT_EQ(expected.img.size(), inhib.img.size());
+    ASSERT_EQ(expected.ROIs, inhib.ROIs);
+    ASSERT_FLOAT_EQ(expected.px_per_mm, inhib.px_per_mm);
+
+    vector<astimp::InhibDisk> disks = astimp::measureDiameters(inhib, config);
+    vector<astimp::InhibDisk> expectedDisks =
+        astimp::measureDiameters(expected);
+    ASSERT_EQ(expectedDisks.size(), disks.size());
+    for (size_t i = 0; i < disks.size(); i++) {
+        ASSERT_EQ(round(expectedDisks[i].diameter), round(disks[i].diameter));
+    }
+}
+
+TEST(measureDiameters, preprocessingDoesNotDependOnTheThreadRNG) {
+    string path = test_img_path + string("test0.jpg");
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    astimp::PetriDish petri = astimp::getPetriDish(img);
+    vector<astimp::Circle> circles = astimp::find_atb_pellets(petri.img);
+    astimp::InhibDiamPreprocResult expected =
+        inhib_diam_preprocessing(petri, circles);
+
+    const vector<uint64_t> states = {1, 12345, 987654321};
+    for (uint64_t state : states) {
+        cv::theRNG().state = state;
+        astimp::InhibDiamPreprocResult inhib =
+            inhib_diam_preprocessing(petri, circles);
+        ASSERT_EQ(expected.km_centers, inhib.km_centers) << state;
+        ASSERT_EQ(expected.km_centers_local, inhib.km_centers_local) << state;
+        // the RNG of the thread is restored
+        ASSERT_EQ(state, cv::theRNG().state);
+    }
+}
@@ -0,0 +1,26 @@
+#include <gtest/gtest.h>
+
+#include <atomic>
+
+#include "utils.hpp"
+
+TEST(parallel_for_each_index, callsEveryIndexOnce) {
+    vector<atomic<int>> calls(100);
+    for (auto &c : calls) c = 0;
+    for (int maxThreads : {0, 1, 3}) {
+        parallel_for_each_index(calls.size(), maxThreads,
+                                [&](size_t i) { calls[i]++; });
+    }
+    for (auto &c : calls) ASSERT_EQ(3, c);
+}
+
+TEST(parallel_for_each_index, rethrowsFirstException) {
+    try {
+        parallel_for_each_index(50, 0, [](size_t i) {
+            if (i % 10 == 7) throw astimp::Exception::generic(to_string(i));
+        });
+        FAIL() << "no exception thrown";
+    } catch (const astimp::Exception::generic &e) {
+        ASSERT_NE(string::npos, e.message().find("<7>"));
+    }
+}
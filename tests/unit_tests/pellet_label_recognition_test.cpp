@@ -56,3 +56,64 @@ TEST(PelletLabelRecognitionMLTest, getPelletModelInputs) {
     EXPECT_NEAR(modelInputs[1][100], 0.442385, 0.000001);
     EXPECT_NEAR(modelInputs[2][64 * 64 - 1], 34, 0.000001);
 }
+
+TEST(PelletLabelRecognitionMLTest, interpreterPoolIsReused) {
+    string path = test_img_path + jpgs[0];
+    cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+    if (img.empty()) {
+        FAIL() << "test image not found: " << path;
+    }
+
+    PelletLabelRecognitionUsingML::shutdownInterpreterPool();
+    PelletLabelRecognitionUsingML::initInterpreterPool(1);
+    for (size_t i = 0; i < 3; i++) {
+        ASSERT_EQ(labels[0],
+                  getOnePelletText(img).labelsAndConfidence.begin()->label);
+    }
+    InterpreterPoolStats stats =
+        PelletLabelRecognitionUsingML::getInterpreterPoolStats();
+    EXPECT_EQ(1, stats.created);
+    EXPECT_EQ(2, stats.hits);
+
+    // the pool can be used again after shutdown
+    PelletLabelRecognitionUsingML::shutdownInterpreterPool();
+    ASSERT_EQ(labels[0],
+              getOnePelletText(img).labelsAndConfidence.begin()->label);
+}
+
+TEST(PelletLabelRecognitionMLTest, batchedInferenceMatchesOneByOne) {
+    vector<cv::Mat> images;
+    for (const auto &jpg : jpgs) {
+        string path = test_img_path + jpg;
+        cv::Mat img = cv::imread(path, cv::IMREAD_COLOR);
+        if (img.empty()) {
+            FAIL() << "test image not found: " << path;
+        }
+        images.emplace_back(img);
+    }
+
+    auto config = astimp::getConfigWritable();
+    int batchSize = config->Labels.maxInferenceBatchSize;
+    config->Labels.maxInferenceBatchSize = 1;
+    vector<Label_match> oneByOne = getPelletsText(images);
+    // reset the pool counters
+    PelletLabelRecognitionUsingML::shutdownInterpreterPool();
+    PelletLabelRecognitionUsingML::initInterpreterPool();
+    config->Labels.maxInferenceBatchSize = 2;
+    vector<Label_match> batched = getPelletsText(images);
+    config->Labels.maxInferenceBatchSize = batchSize;
+
+    // the 4 pellets are labeled in 2 batches
+    InterpreterPoolStats stats =
+        PelletLabelRecognitionUsingML::getInterpreterPoolStats();
+    EXPECT_EQ(0, stats.batchFallbacks);
+    EXPECT_EQ(2, stats.batchedInvokes);
+
+    ASSERT_EQ(oneByOne.size(), batched.size());
+    for (size_t i = 0; i < batched.size(); i++) {
+        auto expected = oneByOne[i].labelsAndConfidence.begin();
+        auto actual = batched[i].labelsAndConfidence.begin();
+        EXPECT_EQ(expected->label, actual->label);
+        EXPECT_NEAR(expected->confidence, actual->confidence, 1e-5);
+    }
+}
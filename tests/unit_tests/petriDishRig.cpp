@@ -0,0 +1,70 @@
+#include "petri_dish_rig.hpp"
+
+#include <gtest/gtest.h>
+#include <test_config.h>
+
+#include "astimp.hpp"
+
+using namespace astimp;
+
+static cv::Mat shifted(const cv::Mat &img, double dx, double dy) {
+    cv::Mat transform = (cv::Mat_<double>(2, 3) << 1, 0, dx, 0, 1, dy);
+    cv::Mat out;
+    cv::warpAffine(img, out, transform, img.size(), cv::INTER_LINEAR,
+                   cv::BORDER_REPLICATE);
+    return out;
+}
+
+TEST(PetriDishRig, samePictureTakesTheFastPath) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    PetriDishRig rig;
+    ASSERT_FALSE(rig.isCalibrated());
+    PetriDish expected = getPetriDish(img);
+    PetriDish first = rig.getPetriDish(img);
+    ASSERT_TRUE(rig.isCalibrated());
+    ASSERT_EQ(expected.boundingBox, first.boundingBox);
+    ASSERT_EQ(expected.boundingBox, rig.boundingBox());
+
+    for (int i = 0; i < 3; i++) {
+        PetriDish petri = rig.getPetriDish(img);
+        ASSERT_EQ(expected.boundingBox, petri.boundingBox);
+        ASSERT_EQ(expected.isRound, petri.isRound);
+        ASSERT_EQ(0, cv::norm(expected.img, petri.img, cv::NORM_INF));
+    }
+    RigStats stats = rig.stats();
+    ASSERT_EQ(3u, stats.fastPath);
+    ASSERT_EQ(1u, stats.grabCut);
+    ASSERT_EQ(0u, stats.recalibrations);
+
+    rig.resetStats();
+    ASSERT_EQ(0u, rig.stats().fastPath);
+    ASSERT_EQ(0u, rig.stats().grabCut);
+}
+
+TEST(PetriDishRig, movedDishIsCroppedAgain) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    PetriDishRig rig(img);
+    ASSERT_EQ(0u, rig.stats().grabCut);
+
+    // the dish moved by 5% of the picture
+    cv::Mat moved = shifted(img, 0.05 * img.cols, 0.05 * img.rows);
+    PetriDish expected = getPetriDish(moved);
+    PetriDish petri = rig.getPetriDish(moved);
+    ASSERT_EQ(expected.boundingBox, petri.boundingBox);
+    ASSERT_EQ(expected.boundingBox, rig.boundingBox());
+
+    RigStats stats = rig.stats();
+    ASSERT_EQ(0u, stats.fastPath);
+    ASSERT_EQ(1u, stats.grabCut);
+    ASSERT_EQ(1u, stats.recalibrations);
+
+    // the new place is used for the next pictures
+    rig.getPetriDish(moved);
+    ASSERT_EQ(1u, rig.stats().fastPath);
+}
@@ -0,0 +1,81 @@
+#include "plate_analysis.hpp"
+
+#include <gtest/gtest.h>
+#include <test_config.h>
+
+#include "astimp.hpp"
+
+using namespace astimp;
+
+static const string plates[3] = {"test0.jpg", "test-antibio-full.jpg",
+                                 "dzone.jpg"};
+
+TEST(PlateAnalysisPool, sameAsSerialPipeline) {
+    vector<cv::Mat> images;
+    for (const auto &name : plates) {
+        cv::Mat img = cv::imread(test_img_path + name, cv::IMREAD_COLOR);
+        ASSERT_FALSE(img.empty()) << name;
+        images.push_back(img);
+    }
+
+    PlateAnalysisPool pool(2);
+    for (const cv::Mat &img : images) pool.submit(img);
+    // paths are read by the workers
+    for (const auto &name : plates) pool.submitPath(test_img_path + name);
+    ASSERT_EQ(2 * images.size(), pool.inFlight());
+
+    vector<bool> seen(2 * images.size(), false);
+    PlateAnalysis result;
+    while (pool.next(result)) {
+        ASSERT_LT(result.index, seen.size());
+        ASSERT_FALSE(seen[result.index]);
+        seen[result.index] = true;
+        ASSERT_TRUE(result.ok) << result.error;
+
+        const cv::Mat &img = images[result.index % images.size()];
+        PetriDish petri = getPetriDish(img);
+        vector<Circle> circles = find_atb_pellets(petri.img);
+        ASSERT_EQ(petri.boundingBox, result.petri.boundingBox);
+        ASSERT_EQ(circles, result.circles);
+        ASSERT_EQ(circles.size(), result.labels.size());
+        ASSERT_EQ(circles.size(), result.disks.size());
+        if (circles.empty()) continue;
+
+        InhibDiamPreprocResult preproc =
+            inhib_diam_preprocessing(petri, circles);
+        ASSERT_EQ(measureDiameters(preproc), result.disks);
+        vector<cv::Mat> pellets;
+        for (const Circle &circle : circles) {
+            pellets.push_back(cutOnePelletInImage(petri.img, circle));
+        }
+        ASSERT_EQ(getPelletsText(pellets), result.labels);
+    }
+    ASSERT_EQ(0u, pool.inFlight());
+    for (bool s : seen) ASSERT_TRUE(s);
+}
+
+TEST(PlateAnalysisPool, errorsAreReportedPerPlate) {
+    PlateAnalysisPool pool(2);
+    size_t bad = pool.submitPath(test_img_path + string("foo.jpg"));
+    size_t good = pool.submitPath(test_img_path + string("test0.jpg"));
+
+    size_t count = 0;
+    PlateAnalysis result;
+    while (pool.next(result)) {
+        count++;
+        if (result.index == bad) {
+            ASSERT_FALSE(result.ok);
+            ASSERT_NE(string::npos, result.error.find("foo.jpg"));
+        } else {
+            ASSERT_EQ(good, result.index);
+            ASSERT_TRUE(result.ok) << result.error;
+        }
+    }
+    ASSERT_EQ(2u, count);
+}
+
+TEST(PlateAnalysisPool, nextReturnsFalseWhenEmpty) {
+    PlateAnalysisPool pool(1);
+    PlateAnalysis result;
+    ASSERT_FALSE(pool.next(result));
+}
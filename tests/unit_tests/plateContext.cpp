@@ -0,0 +1,67 @@
+#include <gtest/gtest.h>
+#include <test_config.h>
+
+#include "astimp.hpp"
+
+using namespace astimp;
+
+TEST(PlateContext, sameResultsAsImageFunctions) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    PlateContext picture(img);
+    PetriDish petri = getPetriDish(img);
+    ASSERT_EQ(petri.boundingBox, getPetriDish(picture).boundingBox);
+
+    PlateContext plate(petri.img);
+    vector<Circle> circles = find_atb_pellets(petri.img);
+    ASSERT_EQ(circles, find_atb_pellets(plate));
+    ASSERT_EQ(isGrowthMediumBlood(petri.img), isGrowthMediumBlood(plate));
+
+    InhibPreprocState expectedState, state;
+    InhibDiamPreprocResult expected =
+        inhib_diam_preprocessing(petri, circles, &expectedState);
+    InhibDiamPreprocResult preproc =
+        inhib_diam_preprocessing(plate, petri.isRound, circles, &state);
+    ASSERT_EQ(0, cv::norm(expected.img, preproc.img, cv::NORM_INF));
+    ASSERT_EQ(measureDiameters(expected), measureDiameters(preproc));
+
+    vector<Circle> fewer(circles.begin(), circles.end() - 1);
+    ASSERT_EQ(measureDiameters(update_inhib_diam_preprocessing(
+                  expected, expectedState, petri, fewer)),
+              measureDiameters(update_inhib_diam_preprocessing(
+                  preproc, state, plate, petri.isRound, fewer)));
+}
+
+TEST(PlateContext, keepsDerivedImagesUntilReleased) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0_crop.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+
+    PlateContext plate(img);
+    ASSERT_EQ(0u, plate.bytes());
+
+    const cv::Mat &gray = plate.gray();
+    ASSERT_EQ(img.size(), gray.size());
+    ASSERT_EQ(CV_8UC1, gray.type());
+    ASSERT_EQ(gray.data, plate.gray().data);
+    ASSERT_EQ(gray.total(), plate.bytes());
+
+    double scale;
+    const cv::Mat &small = plate.resized(100, &scale);
+    ASSERT_LE(max(small.cols, small.rows), 100);
+    ASSERT_LT(scale, 1);
+    ASSERT_EQ(small.data, plate.resized(100).data);
+
+    const cv::Mat &blue = plate.channel(0);
+    cv::Mat expected;
+    cv::extractChannel(img, expected, 0);
+    ASSERT_EQ(0, cv::norm(expected, blue, cv::NORM_INF));
+    ASSERT_EQ(gray.total() + small.total() * small.elemSize() + blue.total(),
+              plate.bytes());
+
+    plate.release();
+    ASSERT_EQ(0u, plate.bytes());
+    ASSERT_EQ(img.data, plate.image().data);
+}
@@ -0,0 +1,34 @@
+#include <gtest/gtest.h>
+
+#include "utils.hpp"
+
+TEST(getRadialIndex, matchesRMatrix) {
+    for (int s : {0, 1, 2, 7, 8, 41}) {
+        shared_ptr<const RadialIndex> index = getRadialIndex(s);
+        vector<vector<uint>> R = r_matrix(s);
+        uint max_r = s / 2;
+
+        ASSERT_EQ(s, index->size);
+        ASSERT_EQ(max_r + 2, index->radiusBegin.size());
+        // the pixels at each radius are the ones of r_matrix, row by row
+        size_t k = 0;
+        for (uint r = 0; r <= max_r; r++) {
+            ASSERT_EQ(k, index->radiusBegin[r]);
+            for (int i = 0; i < s; i++) {
+                for (int j = 0; j < s; j++) {
+                    if (R[i][j] != r) continue;
+                    ASSERT_EQ(cv::Point(j, i), index->pixels[k]);
+                    k++;
+                }
+            }
+        }
+        ASSERT_EQ(k, index->pixels.size());
+        ASSERT_EQ(k, index->radiusBegin[max_r + 1]);
+    }
+}
+
+TEST(getRadialIndex, isShared) {
+    shared_ptr<const RadialIndex> index = getRadialIndex(33);
+    ASSERT_EQ(index, getRadialIndex(33));
+    ASSERT_NE(index, getRadialIndex(34));
+}
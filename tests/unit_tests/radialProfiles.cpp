@@ -0,0 +1,106 @@
+#include <gtest/gtest.h>
+
+#include <algorithm>
+#include <climits>
+#include <cmath>
+#include <functional>
+
+#include "astimp.hpp"
+
+// radial profile computed pixel by pixel, independently of the radial index
+vector<float> bruteForceProfile(const cv::Mat &img, astimp::PROFILE_TYPE type,
+                                int px_per_mm, float th_value) {
+    int n = img.rows;
+    vector<vector<float>> values(n / 2 + 1);
+    for (int i = 0; i < n; i++) {
+        for (int j = 0; j < n; j++) {
+            int r = (int)round(sqrt(pow(i - n / 2, 2) + pow(j - n / 2, 2)));
+            float val = img.at<float>(i, j);
+            if (r <= n / 2 && val >= 0) values[r].push_back(val);
+        }
+    }
+
+    vector<float> profile(values.size(), 0);
+    for (size_t r = 0; r < values.size(); r++) {
+        vector<float> &v = values[r];
+        sort(v.begin(), v.end(), std::greater<float>());
+        double sum = 0;
+        int above = 0;
+        switch (type) {
+            case astimp::PROFILE_MEAN:
+                for (float val : v) sum += val;
+                profile[r] = v.empty() ? NAN : sum / v.size();
+                break;
+            case astimp::PROFILE_MAX:
+                profile[r] = v.empty() ? 0 : max(v[0], 0.0f);
+                break;
+            case astimp::PROFILE_MAXAVERAGE: {
+                size_t sz = min(v.size(), (size_t)(2 * px_per_mm));
+                for (size_t k = 0; k < sz; k++) sum += v[k];
+                profile[r] = sz == 0 ? 0 : sum / sz;
+                break;
+            }
+            case astimp::PROFILE_SWITCH:
+                for (float val : v) above += val > th_value;
+                if ((int)r < px_per_mm || above > 2 * px_per_mm) {
+                    profile[r] = 1;
+                } else if (above > px_per_mm) {
+                    profile[r] = (float)above / (2 * px_per_mm);
+                } else {
+                    profile[r] = 0;
+                }
+                break;
+        }
+        profile[r] *= UCHAR_MAX;
+    }
+    return profile;
+}
+
+TEST(radialProfiles, sameAsBruteForce) {
+    // a disk of low intensity on a noisy background, with masked pixels
+    cv::Mat img(61, 61, CV_32F);
+    cv::randu(img, cv::Scalar(0.3), cv::Scalar(1));
+    cv::circle(img, cv::Point(30, 30), 12, cv::Scalar(0.1), cv::FILLED);
+    cv::circle(img, cv::Point(30, 30), 3, cv::Scalar(-1), cv::FILLED);
+
+    vector<astimp::PROFILE_TYPE> types = {
+        astimp::PROFILE_MEAN, astimp::PROFILE_MAX, astimp::PROFILE_SWITCH,
+        astimp::PROFILE_MAXAVERAGE};
+    int px_per_mm = 4;
+    float th_value = 0.5;
+
+    astimp::RadialProfiles profiles =
+        astimp::radial_profiles(img, types, px_per_mm, th_value);
+
+    ASSERT_EQ(types, profiles.types);
+    ASSERT_EQ(types.size(), profiles.profiles.size());
+    for (size_t i = 0; i < types.size(); i++) {
+        vector<float> expected =
+            bruteForceProfile(img, types[i], px_per_mm, th_value);
+        ASSERT_EQ(expected.size(), profiles.profiles[i].size());
+        for (size_t r = 0; r < expected.size(); r++) {
+            if (std::isnan(expected[r])) {
+                // mean of a radius where all the pixels are masked
+                EXPECT_TRUE(std::isnan(profiles.profiles[i][r]));
+            } else {
+                EXPECT_NEAR(expected[r], profiles.profiles[i][r], 1e-3)
+                    << "type " << types[i] << " radius " << r;
+            }
+        }
+    }
+
+    // pixels at radius 0 to 3 are masked
+    ASSERT_EQ(31, profiles.counts.size());
+    EXPECT_EQ(0, profiles.counts[2]);
+    EXPECT_LT(0, profiles.counts[10]);
+}
+
+TEST(radialProfiles, maxAverageOfMaskedRadiiIsZero) {
+    cv::Mat img(21, 21, CV_32F, cv::Scalar(0.8));
+    cv::circle(img, cv::Point(10, 10), 3, cv::Scalar(-1), cv::FILLED);
+
+    vector<float> profile =
+        astimp::radial_profile(img, astimp::PROFILE_MAXAVERAGE, 4, 0.5);
+    for (size_t r = 0; r <= 2; r++) EXPECT_EQ(0, profile[r]);
+    EXPECT_FLOAT_EQ(0.8 * UCHAR_MAX, profile[6]);
+}
@@ -0,0 +1,113 @@
+#include <gtest/gtest.h>
+#include <test_config.h>
+
+#include "astimp.hpp"
+
+using namespace astimp;
+
+namespace {
+
+void expectSamePreproc(const InhibDiamPreprocResult &expected,
+                       const InhibDiamPreprocResult &actual) {
+    ASSERT_EQ(expected.img.size(), actual.img.size());
+    EXPECT_EQ(0, cv::norm(expected.img, actual.img, cv::NORM_INF));
+    EXPECT_EQ(expected.circles, actual.circles);
+    EXPECT_EQ(expected.ROIs, actual.ROIs);
+    EXPECT_EQ(expected.km_centers, actual.km_centers);
+    EXPECT_EQ(expected.km_threshold, actual.km_threshold);
+    EXPECT_EQ(expected.km_centers_local, actual.km_centers_local);
+    EXPECT_EQ(expected.km_thresholds_local, actual.km_thresholds_local);
+    EXPECT_EQ(expected.scale_factor, actual.scale_factor);
+    EXPECT_EQ(expected.pad, actual.pad);
+    EXPECT_EQ(expected.px_per_mm, actual.px_per_mm);
+    EXPECT_EQ(expected.original_img_px_per_mm, actual.original_img_px_per_mm);
+}
+
+// Index of the pellet closest to the center of the pellets, moving it does
+// not change the ROI of the preprocessing.
+size_t centralPellet(const vector<Circle> &circles) {
+    cv::Point2f center(0, 0);
+    for (const Circle &circle : circles) center += circle.center;
+    center *= 1.0 / circles.size();
+    size_t best = 0;
+    for (size_t i = 1; i < circles.size(); i++) {
+        if (cv::norm(circles[i].center - center) <
+            cv::norm(circles[best].center - center)) {
+            best = i;
+        }
+    }
+    return best;
+}
+
+}  // namespace
+
+TEST(updateInhibDiamPreprocessing, movedPelletSameAsFromScratch) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+    PetriDish petri = getPetriDish(img);
+    vector<Circle> circles = find_atb_pellets(petri.img);
+    ASSERT_GT(circles.size(), 2u);
+    InhibPreprocState state;
+    InhibDiamPreprocResult preproc =
+        inhib_diam_preprocessing(petri, circles, &state);
+    ASSERT_EQ(circles, state.plateCircles);
+
+    vector<Circle> moved(circles);
+    size_t i = centralPellet(moved);
+    moved[i].center += cv::Point2f(3, -2);
+
+    resetInhibPreprocTimings();
+    InhibDiamPreprocResult updated =
+        update_inhib_diam_preprocessing(preproc, state, petri, moved);
+    // only the ROIs around the moved pellet are clustered again
+    EXPECT_LT(getInhibPreprocTimings().localKmeansROIs, moved.size());
+    EXPECT_EQ(moved, state.plateCircles);
+
+    expectSamePreproc(inhib_diam_preprocessing(petri, moved), updated);
+
+    // and back
+    expectSamePreproc(preproc, update_inhib_diam_preprocessing(
+                                   updated, state, petri, circles));
+}
+
+TEST(updateInhibDiamPreprocessing, removedPellet) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+    PetriDish petri = getPetriDish(img);
+    vector<Circle> circles = find_atb_pellets(petri.img);
+    ASSERT_GT(circles.size(), 2u);
+    InhibPreprocState state;
+    InhibDiamPreprocResult preproc =
+        inhib_diam_preprocessing(petri, circles, &state);
+
+    vector<Circle> removed(circles);
+    removed.erase(removed.begin() + centralPellet(removed));
+    InhibDiamPreprocResult updated =
+        update_inhib_diam_preprocessing(preproc, state, petri, removed);
+    InhibDiamPreprocResult expected = inhib_diam_preprocessing(petri, removed);
+
+    vector<InhibDisk> disks = measureDiameters(updated);
+    vector<InhibDisk> expectedDisks = measureDiameters(expected);
+    ASSERT_EQ(expectedDisks.size(), disks.size());
+    for (size_t i = 0; i < disks.size(); i++) {
+        EXPECT_NEAR(expectedDisks[i].diameter, disks[i].diameter, 0.5) << i;
+    }
+}
+
+TEST(updateInhibDiamPreprocessing, withoutStateRunsFromScratch) {
+    cv::Mat img =
+        cv::imread(test_img_path + string("test0.jpg"), cv::IMREAD_COLOR);
+    ASSERT_FALSE(img.empty());
+    PetriDish petri = getPetriDish(img);
+    vector<Circle> circles = find_atb_pellets(petri.img);
+    InhibDiamPreprocResult preproc = inhib_diam_preprocessing(petri, circles);
+
+    InhibPreprocState state;
+    expectSamePreproc(preproc, update_inhib_diam_preprocessing(
+                                   preproc, state, petri, circles));
+    // the state of the result is returned
+    EXPECT_EQ(circles, state.plateCircles);
+    EXPECT_FALSE(state.blurred.empty());
+}